@@ -0,0 +1,255 @@
+import asyncio
+import json
+import os
+import posixpath
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+import workers
+from llm_cache import make_key
+from llm_engine import agenerate_explanation, LLM_CONCURRENCY, MODEL, PROMPT_VERSION
+from pipeline import analyze_upload, attach_explanations, format_results
+
+# Many-patient analysis in one request.
+# VCFs come from a tar/zip archive and/or individual file parts; each one is
+# extracted to a temp file, analyzed in the worker pool and streamed back as
+# one NDJSON line as soon as it finishes. Identical explanation requests
+# (same gene/phenotype/drug/variants) are made once per batch.
+
+VCF_SUFFIXES = (".vcf", ".vcf.gz", ".vcf.bgz")
+
+# Patients analyzed at once; also bounds how many extracted VCFs sit on disk
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", max(workers.ANALYSIS_WORKERS, 2)))
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def patient_id_for(name):
+    base = posixpath.basename(name.replace("\\", "/"))
+    for suffix in VCF_SUFFIXES:
+        if base.lower().endswith(suffix):
+            return base[:-len(suffix)]
+    return base
+
+
+def is_vcf_name(name):
+    base = posixpath.basename(name.replace("\\", "/"))
+    return not base.startswith(".") and base.lower().endswith(VCF_SUFFIXES)
+
+
+def parse_manifest(text):
+    """
+    Manifest is a JSON object mapping patient_id -> VCF file name (an
+    archive member path or the filename of an uploaded file part).
+    """
+
+    if not text:
+        return None
+
+    try:
+        manifest = json.loads(text)
+    except ValueError:
+        raise ValueError("Manifest must be a JSON object of patient_id -> VCF file name")
+
+    if not isinstance(manifest, dict) or not all(isinstance(v, str) for v in manifest.values()):
+        raise ValueError("Manifest must be a JSON object of patient_id -> VCF file name")
+
+    return manifest
+
+
+def _extract(stream):
+    with tempfile.NamedTemporaryFile(prefix="pharmaguard-", suffix=".vcf", delete=False) as out:
+        shutil.copyfileobj(stream, out, COPY_CHUNK_SIZE)
+    return out.name
+
+
+def _iter_archive_members(path):
+    # Tar archives (optionally compressed) are read in a single forward pass
+    if tarfile.is_tarfile(path):
+        with tarfile.open(path, "r:*") as tar:
+            for member in tar:
+                if member.isfile():
+                    yield member.name, lambda member=member: tar.extractfile(member)
+        return
+
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield info.filename, lambda info=info: archive.open(info)
+        return
+
+    raise ValueError("Unsupported archive: expected a tar or zip file")
+
+
+def iter_sources(archive_path=None, file_paths=(), manifest=None):
+    """
+    Yield (patient_id, vcf_path, error) for every VCF in the batch, one at
+    a time. vcf_path is a temp file the consumer must delete. The archive
+    and any unconsumed uploaded files are removed when iteration ends.
+
+    With a manifest, only listed files are analyzed and listed files that
+    are missing are reported as errors.
+    """
+
+    wanted = None
+    if manifest is not None:
+        wanted = {}
+        for patient_id, name in manifest.items():
+            wanted[name] = patient_id
+            wanted.setdefault(posixpath.basename(name), patient_id)
+
+    seen = set()
+    remaining = list(file_paths)
+
+    def resolve(name):
+        if wanted is None:
+            return patient_id_for(name) if is_vcf_name(name) else None
+        return wanted.get(name, wanted.get(posixpath.basename(name)))
+
+    try:
+        while remaining:
+            name, path = remaining.pop(0)
+            patient_id = resolve(name)
+
+            if patient_id is None or patient_id in seen:
+                os.unlink(path)
+                if patient_id is not None:
+                    yield patient_id, None, f"Duplicate patient_id: {name}"
+                continue
+
+            seen.add(patient_id)
+            yield patient_id, path, None
+
+        if archive_path is not None:
+            for name, open_member in _iter_archive_members(archive_path):
+                patient_id = resolve(name)
+                if patient_id is None:
+                    continue
+                if patient_id in seen:
+                    yield patient_id, None, f"Duplicate patient_id: {name}"
+                    continue
+                seen.add(patient_id)
+
+                with open_member() as stream:
+                    yield patient_id, _extract(stream), None
+
+        if manifest is not None:
+            for patient_id in manifest:
+                if patient_id not in seen:
+                    yield patient_id, None, f"VCF not found in upload: {manifest[patient_id]}"
+
+    finally:
+        for _, path in remaining:
+            os.unlink(path)
+        if archive_path is not None:
+            os.unlink(archive_path)
+
+
+async def run_batch(sources, drug_list, concurrency=None):
+    """
+    Analyze every (patient_id, vcf_path, error) source, at most
+    `concurrency` at a time, yielding one result dict per patient in
+    completion order followed by a summary dict.
+    """
+
+    semaphore = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+    llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+    explanations = {}
+    queue = asyncio.Queue()
+    sources = iter(sources)
+    close_sources = getattr(sources, "close", None)
+
+    async def explain(request):
+        key = make_key(*request, MODEL, PROMPT_VERSION)
+
+        if key not in explanations:
+            async def call():
+                async with llm_semaphore:
+                    return await agenerate_explanation(*request)
+            explanations[key] = asyncio.ensure_future(call())
+
+        return await asyncio.shield(explanations[key])
+
+    async def analyze(patient_id, path):
+        try:
+            analysis = await workers.run_job(analyze_upload, path, drug_list)
+            responses = await asyncio.gather(*(explain(request) for _, request in analysis["llm_requests"]))
+            attach_explanations(analysis, responses)
+            return {"patient_id": patient_id, "results": format_results(analysis, patient_id)}
+        except Exception as e:
+            return {"patient_id": patient_id, "error": str(e)}
+        finally:
+            os.unlink(path)
+
+    async def run(patient_id, path):
+        try:
+            await queue.put(await analyze(patient_id, path))
+        finally:
+            semaphore.release()
+
+    async def produce():
+        tasks = set()
+        try:
+            while True:
+                await semaphore.acquire()
+                source = await workers.run_in_thread(next, sources, None)
+
+                if source is None:
+                    semaphore.release()
+                    break
+
+                patient_id, path, error = source
+                if error is not None:
+                    semaphore.release()
+                    await queue.put({"patient_id": patient_id, "error": error})
+                    continue
+
+                task = asyncio.create_task(run(patient_id, path))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+            await asyncio.gather(*tasks)
+
+        except Exception as e:
+            await queue.put({"error": str(e)})
+
+        finally:
+            for task in tasks:
+                task.cancel()
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    patients = failed = 0
+
+    try:
+        while True:
+            result = await queue.get()
+            if result is None:
+                break
+
+            if "patient_id" in result:
+                patients += 1
+                failed += "error" in result
+
+            yield result
+
+        yield {
+            "summary": {
+                "patients": patients,
+                "succeeded": patients - failed,
+                "failed": failed,
+                "unique_explanations": len(explanations)
+            }
+        }
+
+    finally:
+        producer.cancel()
+        try:
+            if close_sources is not None:
+                close_sources()
+        except ValueError:
+            # Still running in a worker thread; it finishes on its own
+            pass
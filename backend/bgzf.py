@@ -0,0 +1,291 @@
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# gzip / BGZF (blocked gzip, as written by bgzip and htslib)
+GZIP_MAGIC = b"\x1f\x8b"
+BGZF_HEADER_SIZE = 18
+BGZF_MAX_BLOCK_DATA = 0xff00
+
+BGZF_EOF = bytes.fromhex(
+    "1f8b08040000000000ff0600424302001b0003000000000000000000"
+)
+
+# BGZF blocks are independent deflate streams, so batches of them can be
+# decompressed in parallel while the previous batch is being parsed. zlib
+# releases the GIL while inflating, so threads decompress in parallel, and
+# they work inside the analysis worker processes that large uploads run in
+BGZF_WORKERS = int(os.getenv("BGZF_WORKERS", os.cpu_count() or 1))
+BLOCKS_PER_BATCH = 64
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_gzip(head):
+    return head[:2] == GZIP_MAGIC
+
+
+def is_bgzf(head):
+    """
+    Check for the BGZF extra subfield (SI1='B', SI2='C') in a gzip header.
+    """
+
+    if len(head) < BGZF_HEADER_SIZE or head[:4] != b"\x1f\x8b\x08\x04":
+        return False
+
+    return head[12:14] == b"BC" and head[14:16] == b"\x02\x00"
+
+
+class PrefixedStream:
+    """
+    File-like wrapper that replays already-read bytes before the stream,
+    so format detection doesn't require a seekable upload.
+    """
+
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+
+        if size is None or size < 0:
+            data = self.prefix + self.stream.read()
+            self.prefix = b""
+            return data
+
+        data = self.prefix[:size]
+        self.prefix = self.prefix[size:]
+        return data
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+
+    while len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+
+    return data
+
+
+def read_block(stream):
+    """
+    Read one raw (still compressed) BGZF block. Returns b"" at end of file.
+    """
+
+    header = _read_exact(stream, 12)
+    if not header:
+        return b""
+
+    if len(header) < 12:
+        raise EOFError("BGZF file ended inside a block header")
+
+    if not is_gzip(header):
+        raise ValueError("Invalid BGZF block header")
+
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = _read_exact(stream, xlen)
+
+    bsize = None
+    offset = 0
+    while offset + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[offset + 2:offset + 4])[0]
+        if extra[offset:offset + 2] == b"BC" and slen == 2:
+            bsize = struct.unpack("<H", extra[offset + 4:offset + 6])[0]
+            break
+        offset += 4 + slen
+
+    if bsize is None:
+        raise ValueError("BGZF block is missing its BSIZE field")
+
+    size = bsize + 1 - 12 - xlen
+    body = _read_exact(stream, size)
+    if len(body) < size:
+        raise EOFError("BGZF file ended inside a block")
+
+    return header + extra + body
+
+
+def iter_blocks(stream):
+    """
+    Yield raw BGZF blocks to the end of the stream. Raises EOFError when
+    the last block is not the BGZF_EOF marker, i.e. the file was cut off
+    at a block boundary.
+    """
+
+    last = None
+    while True:
+        block = read_block(stream)
+        if not block:
+            break
+        last = block
+        yield block
+
+    if last != BGZF_EOF:
+        raise EOFError("BGZF file ended without its end-of-file marker")
+
+
+def check_eof(stream):
+    """
+    Check a seekable BGZF stream for the trailing BGZF_EOF marker without
+    reading it through; raises EOFError if missing. The stream is rewound.
+    """
+
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(max(size - len(BGZF_EOF), 0))
+    tail = stream.read(len(BGZF_EOF))
+    stream.seek(0)
+
+    if tail != BGZF_EOF:
+        raise EOFError("BGZF file ended without its end-of-file marker")
+
+
+def decompress_block(block):
+    # wbits=31: a single gzip member, CRC32 and ISIZE are verified
+    return zlib.decompress(block, 31)
+
+
+def _get_pool():
+    global _pool
+
+    if BGZF_WORKERS < 2:
+        return None
+
+    # One per process: the server's, or an analysis worker's
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=BGZF_WORKERS, thread_name_prefix="bgzf")
+
+    return _pool
+
+
+def shutdown():
+    """
+    Stop the decompression pool (called on app shutdown).
+    """
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def iter_decompressed(stream, with_offsets=False):
+    """
+    Yield decompressed BGZF block payloads in file order.
+    One batch is decompressing in the pool while the previous one is consumed.
+    With with_offsets=True, yields (compressed_offset, payload) pairs, which
+    is what tabix virtual offsets are built from.
+    """
+
+    blocks = iter_blocks(stream)
+    pool = _get_pool()
+    coffset = 0
+
+    if pool is None:
+        for block in blocks:
+            data = decompress_block(block)
+            yield (coffset, data) if with_offsets else data
+            coffset += len(block)
+        return
+
+    pending = None
+    pending_offsets = None
+
+    while True:
+        batch = list(islice(blocks, BLOCKS_PER_BATCH))
+        submitted = pool.map(decompress_block, batch) if batch else None
+
+        offsets = []
+        for block in batch:
+            offsets.append(coffset)
+            coffset += len(block)
+
+        if pending is not None:
+            if with_offsets:
+                yield from zip(pending_offsets, pending)
+            else:
+                yield from pending
+
+        if submitted is None:
+            return
+
+        pending = submitted
+        pending_offsets = offsets
+
+
+def iter_gunzip(stream, chunk_size):
+    """
+    Streaming decompression for plain (non-blocked) gzip, including
+    multi-member files. This path is inherently sequential. Raises
+    EOFError when the last member is truncated.
+    """
+
+    decompressor = zlib.decompressobj(31)
+
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+
+        while chunk:
+            # Bytes after a complete member start the next one
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(31)
+
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+
+            if not decompressor.eof:
+                break
+
+            chunk = decompressor.unused_data
+
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+    if not decompressor.eof:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+
+def compress_block(data, level=6):
+    """
+    Build a single BGZF block for up to BGZF_MAX_BLOCK_DATA bytes of input.
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+
+    bsize = BGZF_HEADER_SIZE + len(cdata) + 8 - 1
+    header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+
+    return (
+        header
+        + struct.pack("<H", bsize)
+        + cdata
+        + struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+    )
+
+
+def write_bgzf(data, out, block_data=BGZF_MAX_BLOCK_DATA):
+    """
+    Compress bytes into BGZF blocks (bgzip-compatible output).
+    """
+
+    for start in range(0, len(data), block_data):
+        out.write(compress_block(data[start:start + block_data]))
+
+    out.write(BGZF_EOF)
@@ -0,0 +1,259 @@
+import numpy as np
+
+from vcf_parser import iter_lines, detect_build
+from records import Site, PgxVariant
+from knowledge_base import get_kb
+from phenotype_engine import infer_phenotypes_batch
+from cpic_engine import apply_cpic_guideline
+from scoring_engine import calculate_confidence
+
+# Multi-sample (cohort) VCF support.
+# Genotypes for every sample are decoded per row with NumPy into a
+# sites x samples allele-count matrix instead of one dict per call.
+
+MISSING = -1
+
+_ZERO = ord("0")
+_DOT = ord(".")
+_COLON = ord(":")
+_GT_SEPARATORS = (ord("/"), ord("|"))
+
+GENOTYPE_LABELS = {1: "0/1", 2: "1/1"}
+
+
+def _decode_genotypes(sample_fields, gt_index, allele=1):
+    """
+    Copies of ALT allele `allele` (0, 1, 2, or MISSING) for one row across
+    all samples; other ALTs of a multi-allelic row do not count.
+
+    The common case (GT first, single-digit diploid calls) is decoded
+    without a per-sample Python loop by viewing the first four characters
+    of every field as a code-point matrix.
+    """
+
+    if gt_index == 0 and allele <= 9:
+        codes = np.array(sample_fields, dtype="U4").view(np.uint32).reshape(len(sample_fields), 4)
+        first, sep, second, tail = codes[:, 0], codes[:, 1], codes[:, 2], codes[:, 3]
+
+        well_formed = (
+            np.isin(sep, _GT_SEPARATORS)
+            & ((tail == _COLON) | (tail == 0))
+            & (((first >= _ZERO) & (first <= _ZERO + 9)) | (first == _DOT))
+            & (((second >= _ZERO) & (second <= _ZERO + 9)) | (second == _DOT))
+        )
+
+        if well_formed.all():
+            code = _ZERO + allele
+            counts = (first == code).astype(np.int8) + (second == code).astype(np.int8)
+            counts[(first == _DOT) | (second == _DOT)] = MISSING
+            return counts
+
+    # Haploid, multi-digit allele indexes or GT not first: decode per sample
+    counts = np.empty(len(sample_fields), dtype=np.int8)
+
+    for j, field in enumerate(sample_fields):
+        values = field.split(":")
+        gt = values[gt_index] if gt_index < len(values) else "."
+        alleles = gt.replace("|", "/").split("/")
+
+        if "." in alleles:
+            counts[j] = MISSING
+        else:
+            counts[j] = min(sum(value == str(allele) for value in alleles), 2)
+
+    return counts
+
+
+def _decode_int_field(sample_fields, index):
+    values = np.zeros(len(sample_fields), dtype=np.int32)
+
+    if index is None:
+        return values
+
+    for j, field in enumerate(sample_fields):
+        parts = field.split(":")
+        if index < len(parts) and parts[index] not in ("", "."):
+            values[j] = int(parts[index])
+
+    return values
+
+
+def extract_genotype_matrix(file, rsids=None, stats=None, positions=None):
+    """
+    Decode a multi-sample VCF into per-site records plus
+    sites x samples matrices of alt-allele counts, DP and GQ.
+    Sample IDs come from the #CHROM header line.
+
+    With an rsid set, rows are prefiltered on the ID column as in
+    vcf_parser.parse_lines. Every data row that gives no site is counted
+    in stats["prefiltered"]. With position indexes, rows are also
+    recognized by CHROM/POS/REF/ALT of the build named in the header (or
+    the default build).
+    """
+
+    if stats is None:
+        stats = {}
+    stats.setdefault("prefiltered", 0)
+
+    samples = []
+    sites = []
+    counts, dps, gqs = [], [], []
+    index = positions.for_build() if positions is not None else None
+
+    for line in iter_lines(file):
+        if line.startswith("#"):
+            if line.startswith("#CHROM"):
+                samples = line.split("\t")[9:]
+            elif index is not None and line.startswith("##"):
+                build = detect_build(line)
+                if build is not None:
+                    index = positions.for_build(build)
+            continue
+
+        if rsids is not None:
+            head = line.split("\t", 3)
+            if len(head) < 4:
+                continue
+            if head[2] not in rsids and not (
+                index is not None
+                and not head[2].startswith("rs")
+                and head[1].isdigit()
+                and index.has_position(head[0], int(head[1]))
+            ):
+                if line.count("\t") >= 9:
+                    stats["prefiltered"] += 1
+                continue
+
+        columns = line.split("\t")
+
+        if len(columns) < 10:
+            continue
+
+        # As in vcf_parser.parse_line: coordinates fill in a missing rsID
+        # and pick the annotated ALT of a multi-allelic row
+        allele = 1
+        if index is not None and columns[1].isdigit() and (not columns[2].startswith("rs") or "," in columns[4]):
+            found = index.match(columns[0], int(columns[1]), columns[3], columns[4])
+            if found is not None and (found[0] == columns[2] or not columns[2].startswith("rs")):
+                columns[2], allele = found
+
+        format_keys = columns[8].split(":")
+        if not columns[2].startswith("rs") or "GT" not in format_keys:
+            stats["prefiltered"] += 1
+            continue
+
+        sample_fields = columns[9:]
+        qual = columns[5]
+
+        sites.append(Site(
+            columns[0],
+            int(columns[1]),
+            columns[2],
+            columns[3],
+            columns[4],
+            float(qual) if qual != "." else 0,
+            columns[6]
+        ))
+
+        counts.append(_decode_genotypes(sample_fields, format_keys.index("GT"), allele))
+        dps.append(_decode_int_field(sample_fields, format_keys.index("DP") if "DP" in format_keys else None))
+        gqs.append(_decode_int_field(sample_fields, format_keys.index("GQ") if "GQ" in format_keys else None))
+
+    if not samples and counts:
+        samples = [f"sample{j + 1}" for j in range(len(counts[0]))]
+
+    shape = (0, len(samples))
+
+    return {
+        "samples": samples,
+        "sites": sites,
+        "allele_counts": np.vstack(counts) if counts else np.zeros(shape, dtype=np.int8),
+        "dp": np.vstack(dps) if dps else np.zeros(shape, dtype=np.int32),
+        "gq": np.vstack(gqs) if gqs else np.zeros(shape, dtype=np.int32),
+        "total_variants_scanned": len(sites) + stats["prefiltered"]
+    }
+
+
+def _pgx_site_rows(sites):
+    # Same recognition rules as variant_mapper.classify_variants
+    kb = get_kb()
+    rows = []
+
+    for i, site in enumerate(sites):
+        info = kb.variants.get(site.rsid)
+        if site.filter == "PASS" and info and info["gene"] in kb.critical_genes:
+            rows.append((i, info))
+
+    return rows
+
+
+def mapped_variants_for_sample(matrix, sample_index, pgx_rows=None):
+    if pgx_rows is None:
+        pgx_rows = _pgx_site_rows(matrix["sites"])
+
+    sites = matrix["sites"]
+    counts = matrix["allele_counts"]
+    mapped = []
+
+    for i, info in pgx_rows:
+        genotype = GENOTYPE_LABELS.get(int(counts[i, sample_index]))
+        if genotype is None:
+            continue
+
+        mapped.append(PgxVariant(
+            sites[i].rsid,
+            info["gene"],
+            info["allele"],
+            info["effect"],
+            genotype,
+            int(matrix["dp"][i, sample_index]),
+            int(matrix["gq"][i, sample_index]),
+            sites[i].filter,
+            sites[i].chrom,
+            sites[i].pos
+        ))
+
+    return mapped
+
+
+def analyze_cohort(matrix, drugs):
+    """
+    Phenotype every sample in one vectorized pass, then run CPIC lookup and
+    confidence scoring per sample. Returns one deterministic result per
+    sample ID.
+    """
+
+    sites = matrix["sites"]
+    samples = matrix["samples"]
+
+    site_mask = np.array([site.filter == "PASS" for site in sites], dtype=bool)
+    batch = infer_phenotypes_batch(
+        matrix["allele_counts"].T,
+        [site.rsid for site in sites],
+        get_kb().variants,
+        site_mask
+    )
+
+    pgx_rows = _pgx_site_rows(sites)
+
+    # Cohorts share a handful of phenotype combinations; look each one up once
+    cpic_by_profile = {}
+    results = {}
+
+    for j, sample_id in enumerate(samples):
+        phenotypes = {gene: str(labels[j]) for gene, labels in batch.items()}
+        profile = tuple(phenotypes.items())
+
+        if profile not in cpic_by_profile:
+            cpic_by_profile[profile] = apply_cpic_guideline(phenotypes, drugs)
+
+        mapped = mapped_variants_for_sample(matrix, j, pgx_rows)
+
+        results[sample_id] = {
+            "phenotypes": phenotypes,
+            "cpic_results": cpic_by_profile[profile],
+            "confidence_score": calculate_confidence(mapped, phenotypes),
+            "detected_variants": [v.to_dict() for v in mapped]
+        }
+
+    return results
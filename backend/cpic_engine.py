@@ -1,196 +1,145 @@
-CPIC_GUIDELINES = {
-
-    "CLOPIDOGREL": {
-        "CYP2C19": {
-            "PM": {
-                "risk_category": "Ineffective",
-                "severity": "High",
-                "recommendation": "Avoid clopidogrel; use alternative antiplatelet therapy",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Reduced efficacy",
-                "severity": "Moderate",
-                "recommendation": "Consider alternative therapy",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    },
-
-    "CODEINE": {
-        "CYP2D6": {
-            "PM": {
-                "risk_category": "Ineffective",
-                "severity": "Moderate",
-                "recommendation": "Use alternative analgesic",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Reduced efficacy",
-                "severity": "Low",
-                "recommendation": "Monitor response",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    },
-
-    "WARFARIN": {
-        "CYP2C9": {
-            "PM": {
-                "risk_category": "Toxic",
-                "severity": "High",
-                "recommendation": "Reduce dose significantly and monitor INR closely",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Adjust Dosage",
-                "severity": "Moderate",
-                "recommendation": "Reduce starting dose",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    },
-
-    "SIMVASTATIN": {
-        "SLCO1B1": {
-            "PM": {
-                "risk_category": "Toxic",
-                "severity": "High",
-                "recommendation": "Avoid high doses; consider alternative statin",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Adjust Dosage",
-                "severity": "Moderate",
-                "recommendation": "Use lower dose",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    },
-
-    "AZATHIOPRINE": {
-        "TPMT": {
-            "PM": {
-                "risk_category": "Toxic",
-                "severity": "High",
-                "recommendation": "Avoid use; high risk of myelosuppression",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Adjust Dosage",
-                "severity": "Moderate",
-                "recommendation": "Reduce dose by 30–70%",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    },
-
-    "FLUOROURACIL": {
-        "DPYD": {
-            "PM": {
-                "risk_category": "Toxic",
-                "severity": "High",
-                "recommendation": "Avoid use; severe toxicity risk",
-                "evidence_level": "CPIC Level A"
-            },
-            "IM": {
-                "risk_category": "Adjust Dosage",
-                "severity": "Moderate",
-                "recommendation": "Reduce starting dose",
-                "evidence_level": "CPIC Level A"
-            },
-            "NM": {
-                "risk_category": "Safe",
-                "severity": "Low",
-                "recommendation": "Standard dosing",
-                "evidence_level": "CPIC Level A"
-            }
-        }
-    }
-}
+from knowledge_base import get_kb
+from diplotype_engine import INDETERMINATE
 
+# CPIC drug -> gene -> phenotype rules live in the compiled knowledge base
+# (knowledge/cpic_guidelines.json). They are compiled into DECISION_TABLE
+# once per loaded knowledge base version.
 
-def apply_cpic_guideline(phenotypes, drugs):
 
-    drug_list = [d.strip().upper() for d in drugs.split(",")]
-    results = {}
+class ReadOnlyDict(dict):
+    """
+    dict that rejects mutation. Compiled decision-table entries are shared
+    across requests, so callers must not be able to modify them. Still a
+    real dict, so it serializes to JSON and pickles normally.
+    """
 
-    for drug in drug_list:
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("CPIC decision table entries are read-only")
 
-        if drug not in CPIC_GUIDELINES:
-            results[drug] = {
-                "gene": None,
-                "phenotype": None,
-                "risk_category": "Unknown",
-                "severity": "Unknown",
-                "recommendation": "No CPIC guideline available",
-                "evidence_level": None
-            }
-            continue
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
 
-        drug_rules = CPIC_GUIDELINES[drug]
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+
+NO_GUIDELINE = ReadOnlyDict({
+    "gene": None,
+    "phenotype": None,
+    "risk_category": "Unknown",
+    "severity": "Unknown",
+    "recommendation": "No CPIC guideline available",
+    "evidence_level": None
+})
+
+NO_APPLICABLE_RULE = ReadOnlyDict({
+    "gene": None,
+    "phenotype": None,
+    "risk_category": "Unknown",
+    "severity": "Unknown",
+    "recommendation": "No applicable CPIC rule",
+    "evidence_level": None
+})
 
-        # Each drug currently maps to one gene
-        for gene in drug_rules.keys():
 
-            phenotype = phenotypes.get(gene, "NM")
+def compile_guidelines(guidelines):
+    """
+    Flatten the nested guideline dict into a (drug, gene, phenotype) lookup
+    table with response entries pre-built, plus each drug's gene order.
+    """
 
-            if phenotype in drug_rules[gene]:
+    table = {}
+    drug_genes = {}
 
-                rule = drug_rules[gene][phenotype]
+    for drug, drug_rules in guidelines.items():
+        drug_genes[drug] = tuple(drug_rules)
+
+        for gene, rules in drug_rules.items():
+            for phenotype, rule in rules.items():
 
                 risk_label = rule.get("risk_category")
                 if risk_label == "Reduced efficacy":
                     risk_label = "Adjust Dosage"
 
-                results[drug] = {
+                table[(drug, gene, phenotype)] = ReadOnlyDict({
                     "gene": gene,
                     "phenotype": phenotype,
                     "risk_category": risk_label,
                     "severity": rule["severity"],
                     "recommendation": rule["recommendation"],
                     "evidence_level": rule["evidence_level"]
-                }
+                })
 
-        # Safety fallback
-        if drug not in results:
-            results[drug] = {
-                "gene": None,
-                "phenotype": None,
+            # No diplotype fits the calls: keep the gene, withhold guidance
+            table.setdefault((drug, gene, INDETERMINATE), ReadOnlyDict({
+                "gene": gene,
+                "phenotype": INDETERMINATE,
                 "risk_category": "Unknown",
                 "severity": "Unknown",
-                "recommendation": "No applicable CPIC rule",
+                "recommendation": f"{gene} genotype does not resolve to a single diplotype; confirm genotype before applying CPIC guidance",
                 "evidence_level": None
-            }
+            }))
+
+    return table, drug_genes
+
+
+def decision_table(kb=None):
+    """
+    (DECISION_TABLE, DRUG_GENES) for the current knowledge base.
+    """
+
+    kb = kb or get_kb()
+    return kb.derived("decision_table", lambda kb: compile_guidelines(kb.guidelines))
+
+
+def __getattr__(name):
+    if name == "CPIC_GUIDELINES":
+        return get_kb().guidelines
+    if name == "DECISION_TABLE":
+        return decision_table()[0]
+    if name == "DRUG_GENES":
+        return decision_table()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def parse_drugs(drugs):
+    """
+    Normalize a comma-separated drug string (or an already-parsed list)
+    into a list of upper-case drug names.
+    """
+
+    if isinstance(drugs, str):
+        return [d.strip().upper() for d in drugs.split(",")]
+
+    return list(drugs)
+
+
+def apply_cpic_guideline(phenotypes, drugs):
+    """
+    Resolve each drug with constant-time lookups into DECISION_TABLE.
+    drugs may be a comma-separated string or a list from parse_drugs.
+    Returned entries are shared and read-only.
+    """
+
+    table, drug_genes = decision_table()
+    results = {}
+
+    for drug in parse_drugs(drugs):
+
+        genes = drug_genes.get(drug)
+
+        if genes is None:
+            results[drug] = NO_GUIDELINE
+            continue
+
+        # Each drug currently maps to one gene
+        for gene in genes:
+            entry = table.get((drug, gene, phenotypes.get(gene, "NM")))
+            if entry is not None:
+                results[drug] = entry
+
+        # Safety fallback
+        if drug not in results:
+            results[drug] = NO_APPLICABLE_RULE
 
-    return results
\ No newline at end of file
+    return results
@@ -0,0 +1,172 @@
+import numpy as np
+
+from knowledge_base import get_kb
+
+# Star-allele diplotype calling.
+# Each allele definition is a bitset over its gene's core variants, packed
+# into 64-bit words. All candidate diplotypes are scored against a
+# patient's calls at once with vectorized XOR/AND and a popcount table, so
+# genes with 100+ defined alleles cost one array pass per sample instead
+# of a Python loop over allele pairs. Phase from the GT field ("0|1" vs
+# "1|0") is used when every heterozygous call of the gene is phased.
+# Calls that no diplotype explains exactly (e.g. three alt alleles), or
+# that several explain equally, are indeterminate rather than guessed.
+
+REFERENCE_ALLELE = "*1"
+INDETERMINATE = "Indeterminate"
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int32)
+
+
+def _popcount(words):
+    # Set bits per row of a (..., words) uint64 array
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int32)
+    return _POPCOUNT[words.view(np.uint8)].sum(axis=-1)
+
+
+def _pack(bits):
+    # Bool array (..., width) with width a multiple of 64 -> uint64 words
+    return np.packbits(bits, axis=-1).view(np.uint64)
+
+
+class AlleleTable:
+    """
+    Compiled allele definitions of one gene. Alleles keep their definition
+    order, which is also the order used to break ties and print diplotypes.
+    """
+
+    def __init__(self, gene, definitions):
+        definitions = dict(definitions)
+
+        # The reference allele is the one without core variants
+        if not any(not rsids for rsids in definitions.values()):
+            definitions = {REFERENCE_ALLELE: [], **definitions}
+
+        self.gene = gene
+        self.names = list(definitions)
+        self.core = sorted({rsid for rsids in definitions.values() for rsid in rsids})
+        self.core_index = {rsid: i for i, rsid in enumerate(self.core)}
+
+        self.width = max(-(-len(self.core) // 64), 1) * 64
+        bits = np.zeros((len(self.names), self.width), dtype=bool)
+        for a, name in enumerate(self.names):
+            for rsid in definitions[name]:
+                bits[a, self.core_index[rsid]] = True
+
+        self.masks = _pack(bits)
+
+        # Unordered allele pairs (i <= j): the sites one allele carries
+        # (heterozygous) and the sites both carry (homozygous)
+        self.pair_i, self.pair_j = np.triu_indices(len(self.names))
+        self.pair_het = self.masks[self.pair_i] ^ self.masks[self.pair_j]
+        self.pair_hom = self.masks[self.pair_i] & self.masks[self.pair_j]
+
+    def _haplotypes(self, variants):
+        """
+        Alt-allele presence per haplotype over the core variants, and
+        whether every heterozygous call was phased.
+        """
+
+        hap1 = np.zeros(self.width, dtype=bool)
+        hap2 = np.zeros(self.width, dtype=bool)
+        phased = True
+
+        for v in variants:
+            i = self.core_index.get(v["rsid"])
+            if i is None:
+                continue
+
+            genotype = v.get("genotype")
+            gt = v.get("gt") or genotype or ""
+
+            if genotype == "1/1":
+                hap1[i] = hap2[i] = True
+            elif "|" in gt:
+                first, _, second = gt.partition("|")
+                hap1[i] = first not in ("0", ".")
+                hap2[i] = second not in ("0", ".")
+            elif genotype == "0/1":
+                hap1[i] = True
+                phased = False
+
+        return hap1, hap2, phased
+
+    def call_indices(self, variants):
+        """
+        (allele index, allele index) of the one diplotype that explains
+        every one of the gene's calls, ordered by definition order. None
+        when no diplotype explains them exactly or several do.
+        """
+
+        hap1, hap2, phased = self._haplotypes(variants)
+
+        if phased:
+            # Each haplotype independently: fewest differing core sites
+            h1 = _pack(hap1)
+            h2 = _pack(hap2)
+            scores1 = _popcount(self.masks ^ h1)
+            scores2 = _popcount(self.masks ^ h2)
+            exact1 = np.flatnonzero(scores1 == 0)
+            exact2 = np.flatnonzero(scores2 == 0)
+            if len(exact1) != 1 or len(exact2) != 1:
+                return None
+            a, b = int(exact1[0]), int(exact2[0])
+        else:
+            # Every unordered pair at once: differing het + hom sites
+            het = _pack(hap1 ^ hap2)
+            hom = _pack(hap1 & hap2)
+            scores = _popcount(self.pair_het ^ het) + _popcount(self.pair_hom ^ hom)
+            exact = np.flatnonzero(scores == 0)
+            if len(exact) != 1:
+                return None
+            a, b = int(self.pair_i[exact[0]]), int(self.pair_j[exact[0]])
+
+        a, b = sorted((a, b))
+        return a, b
+
+    def call(self, variants):
+        """
+        (allele, allele) names for the gene's calls, None if indeterminate.
+        """
+
+        pair = self.call_indices(variants)
+        if pair is None:
+            return None
+        return self.names[pair[0]], self.names[pair[1]]
+
+
+def allele_tables(kb=None):
+    """
+    {gene: AlleleTable}, compiled once per knowledge base version.
+    """
+
+    kb = kb or get_kb()
+    return kb.derived("allele_tables", lambda kb: {
+        gene: AlleleTable(gene, alleles) for gene, alleles in kb.alleles.items()
+    })
+
+
+def call_diplotype(gene, variants):
+    """
+    Star-allele diplotype such as "*1/*4" for one gene's recognized
+    variants, or INDETERMINATE when no single diplotype explains them.
+    Genes without allele definitions fall back to the variants' own
+    allele labels.
+    """
+
+    if not variants:
+        return f"{REFERENCE_ALLELE}/{REFERENCE_ALLELE}"
+
+    table = allele_tables().get(gene)
+    if table is None:
+        alleles = [v["allele"] for v in variants for _ in range(2 if v.get("genotype") == "1/1" else 1)]
+        if len(alleles) > 2:
+            return INDETERMINATE
+        alleles = (alleles + [REFERENCE_ALLELE, REFERENCE_ALLELE])[:2]
+        return f"{alleles[0]}/{alleles[1]}"
+
+    pair = table.call(variants)
+    if pair is None:
+        return INDETERMINATE
+    return f"{pair[0]}/{pair[1]}"
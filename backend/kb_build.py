@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+import argparse
+import hashlib
+import json
+import os
+import re
+import struct
+import sys
+import tempfile
+from array import array
+
+# Compiles the JSON knowledge base sources (knowledge/*.json) into the
+# binary file read by knowledge_base.py. Run at build time; for updates
+# without a code deploy, build into the file PGX_KB_PATH points at and
+# running workers pick it up on their next stat check.
+#
+# Layout (little-endian):
+#   magic (8 bytes) | header length (uint32) | header JSON | sections
+# The header records the format, the version (hash of the sources) and
+# (offset, length) of every section, relative to the 8-byte aligned end
+# of the header. Sections are 8-byte aligned:
+#   keys       sorted uint64 rsID numbers ("rs4244285" -> 4244285)
+#   offsets    uint32 record offsets, one per key plus the end offset
+#   records    compact JSON of each variant definition
+#   positions  JSON rows of (chrom, pos, ref, alt, rsid, build)
+#   genes      JSON of genes.json (critical genes, loci, star-allele
+#              definitions as core-variant rsID lists, allele activity
+#              values, activity score -> phenotype thresholds and
+#              gene/drug mechanism text for template explanations)
+#   guidelines JSON of cpic_guidelines.json
+
+MAGIC = b"PGXKB\x00\x00\x01"
+FORMAT = 1
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge")
+DEFAULT_OUTPUT = os.path.join(SOURCE_DIR, "pgx_kb.bin")
+
+SOURCES = ("genes.json", "variants.json", "cpic_guidelines.json")
+
+_RSID = re.compile(r"^rs[0-9]+$")
+_REQUIRED_FIELDS = ("gene", "allele", "effect")
+
+
+def _compact(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def load_sources(source_dir=SOURCE_DIR):
+    sources = []
+
+    for name in SOURCES:
+        with open(os.path.join(source_dir, name), encoding="utf-8") as f:
+            sources.append(json.load(f))
+
+    return sources
+
+
+def source_version(genes, variants, guidelines):
+    return hashlib.sha256(_compact([genes, variants, guidelines])).hexdigest()
+
+
+def _validate(genes, variants, guidelines):
+    if not isinstance(genes.get("critical_genes"), list):
+        raise ValueError("genes.json: critical_genes must be a list")
+
+    for rsid, info in variants.items():
+        if not _RSID.match(rsid):
+            raise ValueError(f"variants.json: {rsid!r} is not an rsID")
+
+        missing = [field for field in _REQUIRED_FIELDS if field not in info]
+        if missing:
+            raise ValueError(f"variants.json: {rsid} is missing {', '.join(missing)}")
+
+        for build, coordinates in info.get("coordinates", {}).items():
+            if len(coordinates) != 4:
+                raise ValueError(f"variants.json: {rsid} {build} coordinates must be [chrom, pos, ref, alt]")
+
+            # Indexed bgzipped VCFs are only read inside the gene regions,
+            # so a variant outside them would be found in plain text only
+            if build in genes.get("regions", {}):
+                region = genes["regions"][build].get(info["gene"])
+                chrom, pos = coordinates[:2]
+                if region is None or region[0] != chrom or not region[1] <= pos <= region[2]:
+                    raise ValueError(
+                        f"genes.json: {build} region of {info['gene']} does not contain {rsid} at {chrom}:{pos}"
+                    )
+
+    for gene, alleles in genes.get("alleles", {}).items():
+        core = set()
+        for allele, rsids in alleles.items():
+            for rsid in rsids:
+                if variants.get(rsid, {}).get("gene") != gene:
+                    raise ValueError(f"genes.json: {gene}{allele} uses {rsid}, which is not a {gene} variant")
+            core.update(rsids)
+
+        # Every variant of a gene with allele definitions must be callable
+        for rsid, info in variants.items():
+            if info["gene"] == gene and rsid not in core:
+                raise ValueError(f"genes.json: {rsid} is not part of any {gene} allele definition")
+
+    for gene, activity in genes.get("activity", {}).items():
+        for allele, value in activity.items():
+            if allele not in genes.get("alleles", {}).get(gene, {}):
+                raise ValueError(f"genes.json: activity for undefined allele {gene}{allele}")
+            if value < 0 or value * 4 != int(value * 4):
+                raise ValueError(f"genes.json: {gene}{allele} activity must be a non-negative multiple of 0.25")
+
+    for gene, thresholds in genes.get("phenotypes", {}).items():
+        minimums = [minimum for minimum, label in thresholds]
+        if not minimums or minimums[0] != 0 or minimums != sorted(set(minimums)):
+            raise ValueError(f"genes.json: {gene} phenotype thresholds must start at 0 and increase")
+
+    for gene, drugs in genes.get("mechanisms", {}).items():
+        for drug, text in drugs.items():
+            if not isinstance(text, str) or not text:
+                raise ValueError(f"genes.json: {gene}/{drug} mechanism must be a non-empty string")
+
+    for drug, drug_rules in guidelines.items():
+        for gene, rules in drug_rules.items():
+            for phenotype, rule in rules.items():
+                if "severity" not in rule or "recommendation" not in rule:
+                    raise ValueError(f"cpic_guidelines.json: {drug}/{gene}/{phenotype} is incomplete")
+
+
+def compile_kb(genes, variants, guidelines):
+    """
+    Binary knowledge base as bytes.
+    """
+
+    _validate(genes, variants, guidelines)
+
+    rsids = sorted(variants, key=lambda rsid: int(rsid[2:]))
+
+    keys = array("Q", (int(rsid[2:]) for rsid in rsids))
+    offsets = array("I")
+    records = bytearray()
+    positions = []
+
+    for rsid in rsids:
+        info = variants[rsid]
+        offsets.append(len(records))
+        records += _compact(info)
+
+        for build, (chrom, pos, ref, alt) in sorted(info.get("coordinates", {}).items()):
+            positions.append([chrom, pos, ref, alt, rsid, build])
+
+    offsets.append(len(records))
+
+    if sys.byteorder != "little":
+        keys.byteswap()
+        offsets.byteswap()
+
+    sections = [
+        ("keys", keys.tobytes()),
+        ("offsets", offsets.tobytes()),
+        ("records", bytes(records)),
+        ("positions", _compact(positions)),
+        ("genes", _compact(genes)),
+        ("guidelines", _compact(guidelines))
+    ]
+
+    # Section offsets are relative to the (aligned) end of the header
+    header = {
+        "format": FORMAT,
+        "version": source_version(genes, variants, guidelines),
+        "variants": len(rsids),
+        "sections": {}
+    }
+
+    body = bytearray()
+    for name, data in sections:
+        body += b"\x00" * (align(len(body)) - len(body))
+        header["sections"][name] = [len(body), len(data)]
+        body += data
+
+    header_bytes = _compact(header)
+
+    out = bytearray(MAGIC)
+    out += struct.pack("<I", len(header_bytes))
+    out += header_bytes
+    out += b"\x00" * (align(len(out)) - len(out))
+    out += body
+
+    return bytes(out)
+
+
+def align(offset, boundary=8):
+    return (offset + boundary - 1) // boundary * boundary
+
+
+def build(source_dir=SOURCE_DIR, output=DEFAULT_OUTPUT):
+    """
+    Compile the sources and atomically replace `output`; returns the
+    version. Workers that have the old file mapped keep reading it until
+    they reload.
+    """
+
+    genes, variants, guidelines = load_sources(source_dir)
+    data = compile_kb(genes, variants, guidelines)
+
+    directory = os.path.dirname(os.path.abspath(output))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, output)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    return source_version(genes, variants, guidelines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the pharmacogenomic knowledge base")
+    parser.add_argument("--source", default=SOURCE_DIR, help="directory with the JSON sources")
+    parser.add_argument("--output", default=os.getenv("PGX_KB_PATH") or DEFAULT_OUTPUT,
+                        help="binary knowledge base to write")
+    args = parser.parse_args()
+
+    version = build(args.source, args.output)
+    print(f"Wrote {args.output} (version {version[:12]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from functools import lru_cache
+
+import kb_build
+
+# Read side of the compiled pharmacogenomic knowledge base (see kb_build.py).
+# The binary file is memory-mapped read-only, so every worker process
+# shares one copy through the page cache and opening it costs the same
+# whatever its size. Variant definitions are decoded only when looked up;
+# derived structures (rsID set, position index, allele and activity
+# tables, CPIC decision table) are built on first use and cached per
+# loaded version. Workers stat the file at most every PGX_KB_RELOAD_SECONDS
+# and swap in a new version when it has been replaced.
+
+PGX_KB_PATH = os.getenv("PGX_KB_PATH", "")
+PGX_KB_RELOAD_SECONDS = float(os.getenv("PGX_KB_RELOAD_SECONDS", 5))
+
+# Decoded variant definitions kept per loaded version
+DECODE_CACHE_SIZE = 4096
+
+_MISSING = object()
+
+
+class VariantTable(Mapping):
+    """
+    rsID -> variant definition, read from the mapped file. Lookups are a
+    binary search over the sorted key array; definitions are decoded on
+    demand and must be treated as read-only.
+    """
+
+    def __init__(self, keys, offsets, records):
+        self._keys = keys
+        self._offsets = offsets
+        self._records = records
+        self._decode = lru_cache(maxsize=DECODE_CACHE_SIZE)(self._decode_uncached)
+
+    def _find(self, rsid):
+        if not isinstance(rsid, str) or rsid[:2] != "rs" or not rsid[2:].isdigit():
+            return -1
+
+        number = int(rsid[2:])
+        i = bisect_left(self._keys, number)
+
+        if i < len(self._keys) and self._keys[i] == number:
+            return i
+        return -1
+
+    def _decode_uncached(self, i):
+        info = json.loads(bytes(self._records[self._offsets[i]:self._offsets[i + 1]]))
+
+        for field in ("gene", "allele", "effect"):
+            info[field] = sys.intern(info[field])
+
+        return info
+
+    def __getitem__(self, rsid):
+        i = self._find(rsid)
+        if i < 0:
+            raise KeyError(rsid)
+        return self._decode(i)
+
+    def __contains__(self, rsid):
+        return self._find(rsid) >= 0
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        for number in self._keys:
+            yield f"rs{number}"
+
+
+class KnowledgeBase:
+    """
+    One loaded version of the binary knowledge base.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.stat_key = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+        view = memoryview(self._mmap)
+        magic_size = len(kb_build.MAGIC)
+
+        if bytes(view[:magic_size]) != kb_build.MAGIC:
+            raise ValueError(f"{path} is not a compiled knowledge base")
+
+        (header_size,) = struct.unpack_from("<I", view, magic_size)
+        header_end = magic_size + 4 + header_size
+        header = json.loads(bytes(view[magic_size + 4:header_end]))
+
+        if header.get("format") != kb_build.FORMAT:
+            raise ValueError(f"{path}: unsupported knowledge base format {header.get('format')}")
+
+        self.version = header["version"]
+        self._base = kb_build.align(header_end)
+        self._sections = header["sections"]
+        self._view = view
+
+        self.variants = VariantTable(
+            self._array("keys", "Q"),
+            self._array("offsets", "I"),
+            self.section("records")
+        )
+
+        self._derived = {}
+        # Reentrant: derived values may be built from other derived values
+        self._lock = threading.RLock()
+
+    def section(self, name):
+        offset, length = self._sections[name]
+        start = self._base + offset
+        return self._view[start:start + length]
+
+    def _array(self, name, typecode):
+        data = self.section(name)
+
+        if sys.byteorder == "little":
+            # Zero-copy view onto the mapped file
+            return data.cast(typecode)
+
+        values = array(typecode, bytes(data))
+        values.byteswap()
+        return values
+
+    def _json(self, name):
+        return json.loads(bytes(self.section(name)))
+
+    def derived(self, name, build):
+        """
+        Value of build(self), computed once per loaded version.
+        """
+
+        value = self._derived.get(name, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            value = self._derived.get(name, _MISSING)
+            if value is _MISSING:
+                value = build(self)
+                self._derived[name] = value
+
+        return value
+
+    @property
+    def critical_genes(self):
+        return self.derived("critical_genes", lambda kb: frozenset(kb._json("genes")["critical_genes"]))
+
+    @property
+    def regions(self):
+        """
+        {build: {gene: (chrom, start, end)}}
+        """
+
+        return self.derived("regions", lambda kb: {
+            build: {gene: tuple(region) for gene, region in genes.items()}
+            for build, genes in kb._json("genes").get("regions", {}).items()
+        })
+
+    @property
+    def alleles(self):
+        """
+        {gene: {allele: [core rsIDs]}}; an empty list is the reference allele.
+        """
+
+        return self.derived("alleles", lambda kb: kb._json("genes").get("alleles", {}))
+
+    @property
+    def activity(self):
+        """
+        {gene: {allele: activity value}}
+        """
+
+        return self.derived("activity", lambda kb: kb._json("genes").get("activity", {}))
+
+    @property
+    def phenotype_thresholds(self):
+        """
+        {gene: [(minimum activity score, phenotype), ...]} in increasing order.
+        """
+
+        return self.derived("phenotype_thresholds", lambda kb: {
+            gene: [tuple(row) for row in rows]
+            for gene, rows in kb._json("genes").get("phenotypes", {}).items()
+        })
+
+    @property
+    def mechanisms(self):
+        """
+        {gene: {drug: how the gene affects the drug}}
+        """
+
+        return self.derived("mechanisms", lambda kb: kb._json("genes").get("mechanisms", {}))
+
+    @property
+    def guidelines(self):
+        return self.derived("guidelines", lambda kb: kb._json("guidelines"))
+
+    def position_rows(self):
+        """
+        (chrom, pos, ref, alt, rsid, build) for every defined coordinate.
+        """
+
+        return [tuple(row) for row in self._json("positions")]
+
+
+# --- Current version -------------------------------------------------------
+
+_current = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _fallback_path():
+    # No compiled file (e.g. a dev checkout without the build step): compile
+    # the JSON sources once per process into a temp file named after
+    # their content
+    digest = hashlib.sha256()
+    for name in kb_build.SOURCES:
+        with open(os.path.join(kb_build.SOURCE_DIR, name), "rb") as f:
+            digest.update(f.read())
+
+    path = os.path.join(tempfile.gettempdir(), f"pharmaguard-kb-{digest.hexdigest()[:16]}.bin")
+    if not os.path.exists(path):
+        kb_build.build(kb_build.SOURCE_DIR, path)
+    return path
+
+
+def kb_path():
+    if PGX_KB_PATH:
+        return PGX_KB_PATH
+    if os.path.exists(kb_build.DEFAULT_OUTPUT):
+        return kb_build.DEFAULT_OUTPUT
+    return _fallback_path()
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def reload_if_changed():
+    """
+    Load the knowledge base, or swap in a new version if the file was
+    replaced. A missing or unreadable replacement keeps the current one.
+    """
+
+    global _current, _checked_at
+
+    with _lock:
+        _checked_at = time.monotonic()
+        current = _current
+
+        if current is not None:
+            path = kb_path()
+            stat_key = _stat_key(path)
+            if stat_key is None or (path == current.path and stat_key == current.stat_key):
+                return current
+
+            try:
+                loaded = KnowledgeBase(path)
+            except (OSError, ValueError):
+                return current
+        else:
+            loaded = KnowledgeBase(kb_path())
+
+        _current = loaded
+        return loaded
+
+
+def get_kb():
+    """
+    Currently loaded knowledge base, opened on first use.
+    """
+
+    kb = _current
+    if kb is not None and time.monotonic() - _checked_at < PGX_KB_RELOAD_SECONDS:
+        return kb
+
+    return reload_if_changed()
@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Content-addressed cache for LLM explanations.
+# Explanations depend only on (gene, phenotype, drug, variant set), which
+# take few distinct values across patients, so repeat combinations are
+# answered from memory (LRU) or disk (SQLite) instead of a new API call.
+
+CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "pharmaguard-llm-cache.sqlite3")
+)
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 2048))
+
+
+def make_key(gene, phenotype, drug, variants_for_gene, model, prompt_version):
+    """
+    Canonical hash of everything that determines an explanation.
+    Variant order doesn't matter; only rsID, allele and genotype are used.
+    """
+
+    variants = sorted(
+        (v.get("rsid") or "", v.get("allele") or "", v.get("genotype") or "")
+        for v in (variants_for_gene or [])
+    )
+
+    payload = json.dumps(
+        [gene, phenotype, drug, variants, model, prompt_version],
+        separators=(",", ":")
+    )
+
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExplanationCache:
+    """
+    Two-tier cache: an in-process LRU in front of an optional SQLite store
+    that is shared by all workers on the host. Entries expire after ttl
+    seconds in both tiers. Async callers use aget/aset, which touch SQLite
+    (whose writers can hold a lock for seconds) only from a thread.
+    """
+
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+        if path:
+            try:
+                self._db = sqlite3.connect(path, check_same_thread=False, timeout=5)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS explanations ("
+                    "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+                )
+                self._db.commit()
+            except sqlite3.Error:
+                # Disk tier is optional; fall back to memory only
+                self._db = None
+
+    def _remember(self, key, value, expires_at):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _memory_get(self, key, now):
+        with self._lock:
+            entry = self._memory.get(key)
+
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is None:
+                self.misses += 1
+            return None
+
+    def _disk_get(self, key, now):
+        # The memory lock is not held here, so a slow disk never blocks
+        # lookups that memory can answer
+        try:
+            with self._db_lock:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM explanations WHERE key = ?", (key,)
+                ).fetchone()
+        except sqlite3.Error:
+            row = None
+
+        with self._lock:
+            if row is None or row[1] <= now:
+                self.misses += 1
+                return None
+
+            value = json.loads(row[0])
+            self._remember(key, value, row[1])
+            self.hits += 1
+            self.disk_hits += 1
+            return value
+
+    def _disk_set(self, key, value, expires_at):
+        try:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO explanations (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), expires_at)
+                )
+                # Expired rows are purged periodically rather than per write
+                self._writes += 1
+                if self._writes % 256 == 0:
+                    self._db.execute("DELETE FROM explanations WHERE expires_at <= ?", (time.time(),))
+                self._db.commit()
+        except sqlite3.Error:
+            pass
+
+    def get(self, key):
+        now = time.time()
+        value = self._memory_get(key, now)
+
+        if value is None and self._db is not None:
+            value = self._disk_get(key, now)
+        return value
+
+    def set(self, key, value):
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._remember(key, value, expires_at)
+
+        if self._db is not None:
+            self._disk_set(key, value, expires_at)
+
+    async def aget(self, key):
+        now = time.time()
+        value = self._memory_get(key, now)
+
+        if value is None and self._db is not None:
+            value = await asyncio.to_thread(self._disk_get, key, now)
+        return value
+
+    async def aset(self, key, value):
+        expires_at = time.time() + self.ttl
+
+        with self._lock:
+            self._remember(key, value, expires_at)
+
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_set, key, value, expires_at)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "evictions": self.evictions,
+                "memory_entries": len(self._memory),
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -1,20 +1,344 @@
-from openai import OpenAI
+import asyncio
+import json
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from llm_cache import ExplanationCache, make_key
+from knowledge_base import get_kb
+from cpic_engine import apply_cpic_guideline
+from llm_resilience import CircuitBreaker, CircuitOpen, TokenBucket, call_with_retries, call_with_retries_sync
+import metrics
+
 load_dotenv()
 
-api_key = os.getenv("MISTRAL_API_KEY")
+BASE_URL = "https://api.mistral.ai/v1"
 
-if not api_key:
-    raise ValueError("MISTRAL_API_KEY not found in .env")
+# Max explanations in flight per analysis, and per-call deadline (seconds)
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", 6))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", 20))
 
-client = OpenAI(
-    api_key=api_key,
-    base_url="https://api.mistral.ai/v1"
-)
+# Serve CPIC results without remote explanations: no API key, SDK import
+# or network calls (same as LLM_BACKEND=template)
+DETERMINISTIC_ONLY = os.getenv("DETERMINISTIC_ONLY", "").lower() in ("1", "true", "yes")
 
-def generate_explanation(gene, phenotype, drug, variants_for_gene=None):
+# Explanation backends: "mistral", "template" (built locally from the
+# knowledge base) or "stub" (llm_stub_server.py, for offline runs and
+# load tests). When the remote backend errors or has not answered within
+# the latency budget, the fallback backend answers instead ("none" keeps
+# the "LLM Error" result); the remote call still finishes in the
+# background and caches its answer.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "mistral").lower()
+LLM_FALLBACK_BACKEND = os.getenv("LLM_FALLBACK_BACKEND", "template").lower()
+LLM_LATENCY_BUDGET_SECONDS = float(os.getenv("LLM_LATENCY_BUDGET_SECONDS", 8))
+LLM_STUB_URL = os.getenv("LLM_STUB_URL", "http://127.0.0.1:8001/v1")
+
+# Distinct explanation requests arriving within the window (e.g. every
+# drug of one analysis) are sent as one prompt asking for a JSON array,
+# up to this many per prompt (1 disables batching)
+LLM_BATCH_WINDOW_SECONDS = float(os.getenv("LLM_BATCH_WINDOW_SECONDS", 0.01))
+LLM_BATCH_MAX_ITEMS = int(os.getenv("LLM_BATCH_MAX_ITEMS", 8))
+
+MODEL = "mistral-large-latest"
+
+# Bump whenever the prompt text changes so cached explanations are not reused
+PROMPT_VERSION = "1"
+
+SYSTEM_PROMPT = "You are a clinical pharmacogenomics expert. Provide concise explanations suitable for healthcare professionals. Always cite rsIDs and allele names when available."
+
+PHENOTYPE_NAMES = {
+    "PM": "poor metabolizer",
+    "IM": "intermediate metabolizer",
+    "NM": "normal metabolizer",
+    "RM": "rapid metabolizer",
+    "UM": "ultrarapid metabolizer"
+}
+
+EFFECT_NAMES = {
+    "loss_of_function": "no function",
+    "reduced_function": "decreased function",
+    "increased_function": "increased function"
+}
+
+ZYGOSITY = {"0/1": "heterozygous", "1/1": "homozygous"}
+
+explanation_cache = ExplanationCache()
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async calls by key: the first caller starts the
+    call and later callers with the same key await the same task, so a
+    burst of identical requests makes one upstream call. The task is only
+    cancelled when every caller waiting on it has been cancelled.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._flights)
+
+    def _forget(self, key, flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def wait(self, key, start, timeout=None):
+        """
+        Result of the in-flight call for key, starting start() if there is
+        none. Raises asyncio.TimeoutError after timeout seconds; the call
+        itself keeps running for the other callers (and the cache).
+        """
+
+        flight = self._flights.get(key)
+
+        # A call left pending by an event loop that has since closed
+        if flight is not None and flight.task.get_loop() is not asyncio.get_running_loop():
+            flight = None
+
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(start()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+            metrics.inc(metrics.LLM_COALESCED)
+
+        flight.waiters += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+
+        except asyncio.CancelledError:
+            # Stop the call only when nobody else is waiting for it
+            if flight.waiters == 1:
+                flight.task.cancel()
+            raise
+
+        finally:
+            flight.waiters -= 1
+
+
+# In-flight explanation calls of this process, by cache key
+in_flight = SingleFlight()
+
+
+class LLMUnavailable(Exception):
+    """
+    Raised when a backend's clients cannot be built (no API key).
+    """
+
+
+class OpenAICompatibleBackend:
+    """
+    Chat completions over an OpenAI-compatible API (Mistral, or the local
+    stub server). The OpenAI SDK is imported and the clients are built on
+    first use (or by warm() at startup), so importing this module is cheap
+    and works without an API key. Retries are ours (see _upstream), not
+    the SDK's; each backend paces its calls and has its own breaker.
+    """
+
+    remote = True
+
+    def __init__(self, name, base_url, model, api_key_env=None):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.api_key_env = api_key_env
+        self._clients = None
+        self._lock = threading.Lock()
+        self.breaker = CircuitBreaker()
+        self.rate_limiter = TokenBucket()
+
+    def _get_clients(self):
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    api_key = os.getenv(self.api_key_env) if self.api_key_env else self.name
+                    if not api_key:
+                        raise LLMUnavailable(f"{self.api_key_env} not found in .env")
+
+                    import httpx
+                    from openai import OpenAI, AsyncOpenAI
+
+                    client = OpenAI(
+                        api_key=api_key,
+                        base_url=self.base_url,
+                        max_retries=0
+                    )
+
+                    # Shared keep-alive connection pool for the async fan-out path
+                    async_client = AsyncOpenAI(
+                        api_key=api_key,
+                        base_url=self.base_url,
+                        max_retries=0,
+                        http_client=httpx.AsyncClient(
+                            limits=httpx.Limits(
+                                max_connections=LLM_CONCURRENCY * 4,
+                                max_keepalive_connections=LLM_CONCURRENCY * 2
+                            )
+                        )
+                    )
+
+                    self._clients = (client, async_client)
+
+        return self._clients
+
+    def warm(self):
+        try:
+            self._get_clients()
+        except LLMUnavailable:
+            return False
+        return True
+
+    def _request_kwargs(self, prompt, items=1):
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            "max_tokens": 200 * items
+        }
+
+    def complete(self, gene, phenotype, drug, variants_for_gene, timeout):
+        response = self._get_clients()[0].chat.completions.create(
+            **self._request_kwargs(_build_prompt(gene, phenotype, drug, variants_for_gene)),
+            timeout=timeout
+        )
+        return response.choices[0].message.content
+
+    async def acomplete(self, gene, phenotype, drug, variants_for_gene):
+        response = await self._get_clients()[1].chat.completions.create(
+            **self._request_kwargs(_build_prompt(gene, phenotype, drug, variants_for_gene))
+        )
+        return response.choices[0].message.content
+
+    async def acomplete_batch(self, requests):
+        """
+        One completion for several requests; explanation text per request,
+        None where the answer was missing or malformed.
+        """
+
+        response = await self._get_clients()[1].chat.completions.create(
+            **self._request_kwargs(_build_batch_prompt(requests), items=len(requests))
+        )
+        return _parse_batch(response.choices[0].message.content, len(requests))
+
+
+class TemplateBackend:
+    """
+    Deterministic explanations assembled from the knowledge base (variant
+    alleles and effects, gene/drug mechanism, CPIC recommendation). Takes
+    microseconds and never fails, so it is also the fallback backend.
+    """
+
+    name = "template"
+    model = "template"
+    remote = False
+
+    def warm(self):
+        return True
+
+    def complete(self, gene, phenotype, drug, variants_for_gene, timeout=None):
+        return template_explanation(gene, phenotype, drug, variants_for_gene)
+
+    async def acomplete(self, gene, phenotype, drug, variants_for_gene):
+        return template_explanation(gene, phenotype, drug, variants_for_gene)
+
+
+_BACKEND_FACTORIES = {
+    "mistral": lambda: OpenAICompatibleBackend("mistral", BASE_URL, MODEL, "MISTRAL_API_KEY"),
+    "stub": lambda: OpenAICompatibleBackend("stub", LLM_STUB_URL, "stub"),
+    "template": TemplateBackend
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_backend(name=None):
+    """
+    Backend instance by name (default: the configured LLM_BACKEND).
+    """
+
+    if name is None:
+        name = "template" if DETERMINISTIC_ONLY else LLM_BACKEND
+
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in _BACKEND_FACTORIES:
+            raise ValueError(f"Unknown LLM backend {name!r}; expected one of {', '.join(_BACKEND_FACTORIES)}")
+        with _backends_lock:
+            backend = _backends.setdefault(name, _BACKEND_FACTORIES[name]())
+
+    return backend
+
+
+def _fallback_backend():
+    if LLM_FALLBACK_BACKEND in ("", "none"):
+        return None
+    return get_backend(LLM_FALLBACK_BACKEND)
+
+
+def warm():
+    """
+    Build the configured backend's clients ahead of the first explanation.
+    Returns False when they cannot be built (no API key).
+    """
+
+    return get_backend().warm()
+
+
+def circuit_state():
+    """
+    Circuit breaker state of the configured backend ("closed" when it
+    has none, e.g. the template backend).
+    """
+
+    breaker = getattr(get_backend(), "breaker", None)
+    return "closed" if breaker is None else breaker.state
+
+
+def template_explanation(gene, phenotype, drug, variants_for_gene=None):
+    kb = get_kb()
+
+    sentences = [f"{gene} {PHENOTYPE_NAMES.get(phenotype, phenotype)} ({phenotype}) for {drug.lower()}."]
+
+    if variants_for_gene:
+        cited = ", ".join(
+            f"{v.get('rsid')} ({gene}{v.get('allele')}, "
+            f"{EFFECT_NAMES.get(v.get('effect'), 'unknown function')}, "
+            f"{ZYGOSITY.get(v.get('genotype'), v.get('genotype'))})"
+            for v in variants_for_gene
+        )
+        sentences.append(f"Detected {cited}.")
+    else:
+        sentences.append(f"No {gene} variants were detected, consistent with the {gene}*1 reference allele.")
+
+    mechanism = kb.mechanisms.get(gene, {}).get(drug)
+    if mechanism:
+        sentences.append(mechanism + ".")
+
+    entry = apply_cpic_guideline({gene: phenotype}, [drug]).get(drug, {})
+    if entry.get("recommendation"):
+        evidence = f" ({entry['evidence_level']})" if entry.get("evidence_level") else ""
+        sentences.append(f"Recommendation{evidence}: {entry['recommendation']}.")
+
+    return " ".join(sentences)
+
+
+def _variant_section(variants_for_gene):
 
     # Build a variant citation list for the prompt
     citations = []
@@ -22,9 +346,14 @@ def generate_explanation(gene, phenotype, drug, variants_for_gene=None):
         for v in variants_for_gene:
             citations.append(f"{v.get('rsid')} ({v.get('allele')}) genotype={v.get('genotype')}")
 
-    variant_section = "\n".join(citations) if citations else "None"
+    return "\n".join(citations) if citations else "None"
+
 
-    prompt = f"""
+def _build_prompt(gene, phenotype, drug, variants_for_gene):
+
+    variant_section = _variant_section(variants_for_gene)
+
+    return f"""
 Provide a brief, clinician-facing explanation (3-4 sentences max) of this pharmacogenomic interaction.
 Include explicit variant citations (rsID and star allele) and the biological mechanism linking variant to drug effect.
 
@@ -41,36 +370,400 @@ Focus on:
 Return a concise plain-text explanation and be sure to mention the rsIDs and allele names.
 """
 
+
+def _build_batch_prompt(requests):
+
+    interactions = "\n\n".join(
+        f"Interaction {i}:\nGene: {gene}\nPhenotype: {phenotype}\nDrug: {drug}\n"
+        f"Variants: {_variant_section(variants_for_gene)}"
+        for i, (gene, phenotype, drug, variants_for_gene) in enumerate(requests, 1)
+    )
+
+    return f"""
+Provide a brief, clinician-facing explanation (3-4 sentences max) of each pharmacogenomic interaction below.
+Include explicit variant citations (rsID and star allele) and the biological mechanism linking variant to drug effect.
+
+{interactions}
+
+For each interaction focus on:
+1. Which specific variants (rsIDs, allele names) drive this phenotype
+2. The molecular/biological mechanism affecting the drug
+3. Clear clinical action (cite CPIC where applicable)
+
+Return only a JSON array with one object per interaction, in the same order:
+[{{"id": 1, "explanation": "..."}}, {{"id": 2, "explanation": "..."}}]
+"""
+
+
+def _parse_batch(text, count):
+    """
+    Explanation per interaction from a batched answer, None for every
+    interaction without a usable one. Tolerates prose or a code fence
+    around the array and items in any order.
+    """
+
+    texts = [None] * count
+    start = (text or "").find("[")
+    end = (text or "").rfind("]")
+
     try:
-        response = client.chat.completions.create(
-            model="mistral-large-latest",
-            messages=[
-                {"role": "system", "content": "You are a clinical pharmacogenomics expert. Provide concise explanations suitable for healthcare professionals. Always cite rsIDs and allele names when available."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-            max_tokens=200
+        items = json.loads(text[start:end + 1]) if 0 <= start < end else None
+    except ValueError:
+        items = None
+
+    if not isinstance(items, list):
+        return texts
+
+    for position, item in enumerate(items):
+        if isinstance(item, dict):
+            number, explanation = item.get("id", position + 1), item.get("explanation")
+        else:
+            number, explanation = position + 1, item
+
+        if (
+            isinstance(number, int) and 1 <= number <= count and texts[number - 1] is None
+            and isinstance(explanation, str) and explanation.strip()
+        ):
+            texts[number - 1] = explanation.strip()
+
+    return texts
+
+
+def _build_result(text, variants_for_gene):
+
+    # Build citation objects
+    citation_objs = []
+    if variants_for_gene:
+        for v in variants_for_gene:
+            citation_objs.append({
+                "rsid": v.get("rsid"),
+                "allele": v.get("allele"),
+                "genotype": v.get("genotype")
+            })
+
+    return {
+        "explanation_text": text,
+        "variant_citations": citation_objs
+    }
+
+
+def _error_result(message):
+    return {
+        "explanation_text": f"LLM Error: {message}",
+        "variant_citations": []
+    }
+
+
+def _local_result(backend, gene, phenotype, drug, variants_for_gene):
+    return _build_result(backend.complete(gene, phenotype, drug, variants_for_gene), variants_for_gene)
+
+
+def _failure_result(reason, message, gene, phenotype, drug, variants_for_gene):
+    # Remote failures are answered by the fallback backend when there is one
+    fallback = _fallback_backend()
+    if fallback is None:
+        return _error_result(message)
+
+    metrics.inc(metrics.LLM_FALLBACKS, reason=reason)
+    return _local_result(fallback, gene, phenotype, drug, variants_for_gene)
+
+
+def _record_call(backend, start, outcome):
+    # Every API call is timed, successful or not
+    metrics.observe_stage("llm", time.perf_counter() - start)
+    metrics.inc(metrics.LLM_CALLS, backend=backend.name, outcome=outcome)
+
+
+def generate_explanation(gene, phenotype, drug, variants_for_gene=None):
+
+    backend = get_backend()
+    if not backend.remote:
+        return _local_result(backend, gene, phenotype, drug, variants_for_gene)
+
+    cache_key = make_key(gene, phenotype, drug, variants_for_gene, backend.model, PROMPT_VERSION)
+    cached = explanation_cache.get(cache_key)
+    metrics.cache_lookup("llm", cached is not None)
+    if cached is not None:
+        return cached
+
+    # Blocking callers cannot answer early, so the budget is the deadline
+    timeout = LLM_TIMEOUT_SECONDS
+    if _fallback_backend() is not None:
+        timeout = min(timeout, LLM_LATENCY_BUDGET_SECONDS)
+
+    # Same guards as the async path: breaker, rate limiter and retries,
+    # all within the deadline
+    if not backend.breaker.allow():
+        return _failure_result("circuit_open", "circuit open", gene, phenotype, drug, variants_for_gene)
+
+    start = time.perf_counter()
+
+    try:
+        text = call_with_retries_sync(
+            lambda remaining: backend.complete(gene, phenotype, drug, variants_for_gene, remaining),
+            limiter=backend.rate_limiter,
+            on_retry=lambda e: metrics.inc(metrics.LLM_RETRIES, backend=backend.name),
+            deadline=time.monotonic() + timeout
         )
+        result = _build_result(text, variants_for_gene)
 
-        text = response.choices[0].message.content
+    except TimeoutError as e:
+        _record_call(backend, start, "timeout")
+        backend.breaker.record_failure()
+        return _failure_result("timeout", str(e), gene, phenotype, drug, variants_for_gene)
 
-        # Build citation objects
-        citation_objs = []
-        if variants_for_gene:
-            for v in variants_for_gene:
-                citation_objs.append({
-                    "rsid": v.get("rsid"),
-                    "allele": v.get("allele"),
-                    "genotype": v.get("genotype")
-                })
+    except Exception as e:
+        _record_call(backend, start, "error")
+        backend.breaker.record_failure()
+        return _failure_result("error", str(e), gene, phenotype, drug, variants_for_gene)
 
-        return {
-            "explanation_text": text,
-            "variant_citations": citation_objs
-        }
+    _record_call(backend, start, "ok")
+    backend.breaker.record_success()
+
+    # Errors above are never cached, so a transient failure is retried
+    explanation_cache.set(cache_key, result)
+
+    return result
+
+
+async def _upstream(backend, start_call, timeout):
+    """
+    One API call (single or batched prompt): paced by the backend's rate
+    limiter and retried with jittered backoff on retryable errors, all
+    within `timeout` seconds. Raises CircuitOpen without calling out while
+    the backend's breaker is open; the outcome after retries feeds it.
+    """
+
+    if not backend.breaker.allow():
+        raise CircuitOpen(f"{backend.name} circuit open")
+
+    start = time.perf_counter()
+
+    try:
+        result = await asyncio.wait_for(
+            call_with_retries(
+                start_call,
+                limiter=backend.rate_limiter,
+                on_retry=lambda e: metrics.inc(metrics.LLM_RETRIES, backend=backend.name)
+            ),
+            timeout
+        )
+
+    except asyncio.TimeoutError:
+        _record_call(backend, start, "timeout")
+        backend.breaker.record_failure()
+        raise
+
+    except asyncio.CancelledError:
+        backend.breaker.release()
+        raise
+
+    except Exception:
+        _record_call(backend, start, "error")
+        backend.breaker.record_failure()
+        raise
+
+    _record_call(backend, start, "ok")
+    backend.breaker.record_success()
+    return result
+
+
+class ExplanationBatcher:
+    """
+    Micro-batches remote explanation requests. Requests submitted within
+    `window` seconds of the first pending one (or until `max_items` are
+    pending) go out as one prompt that asks for a JSON array, and each
+    caller gets its own item back. Items missing from or malformed in the
+    answer are re-requested one at a time; an error of the batched call
+    itself is raised to every caller.
+    """
+
+    def __init__(self, window=LLM_BATCH_WINDOW_SECONDS, max_items=LLM_BATCH_MAX_ITEMS):
+        self.window = window
+        self.max_items = max_items
+        self._pending = {}
+        self._timers = {}
+        self._sending = set()
+
+    async def submit(self, backend, request, timeout):
+        """
+        Explanation text for one (gene, phenotype, drug, variants_for_gene)
+        request.
+        """
+
+        if self.max_items <= 1 or not hasattr(backend, "acomplete_batch"):
+            return await _upstream(backend, lambda: backend.acomplete(*request), timeout)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(backend, [])
+
+        # Left behind by an event loop that has since closed
+        if pending and pending[0][2].get_loop() is not loop:
+            pending.clear()
+        pending.append((request, timeout, future))
+
+        if len(pending) >= self.max_items:
+            self._flush(backend)
+        elif len(pending) == 1:
+            self._timers[backend] = loop.call_later(self.window, self._flush, backend)
+
+        return await future
+
+    def _flush(self, backend):
+        timer = self._timers.pop(backend, None)
+        if timer is not None:
+            timer.cancel()
+
+        batch = self._pending.pop(backend, [])
+        if batch:
+            task = asyncio.ensure_future(self._send(backend, batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, backend, batch):
+        # Callers that gave up (cancelled) while the batch was collecting
+        batch = [entry for entry in batch if not entry[2].done()]
+        if not batch:
+            return
+
+        if len(batch) == 1:
+            await self._send_one(backend, *batch[0])
+            return
+
+        requests = [request for request, _, _ in batch]
+        timeout = max(timeout for _, timeout, _ in batch)
+
+        try:
+            texts = await _upstream(backend, lambda: backend.acomplete_batch(requests), timeout)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        retry = []
+        for entry, text in zip(batch, texts):
+            metrics.inc(metrics.LLM_BATCH_ITEMS, result="ok" if text is not None else "invalid")
+            if text is None:
+                retry.append(entry)
+            elif not entry[2].done():
+                entry[2].set_result(text)
+
+        # One bad item doesn't fail the others: ask for it on its own
+        await asyncio.gather(*(self._send_one(backend, *entry) for entry in retry))
+
+    async def _send_one(self, backend, request, timeout, future):
+        try:
+            text = await _upstream(backend, lambda: backend.acomplete(*request), timeout)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+
+        if not future.done():
+            future.set_result(text)
+
+
+# Pending batches of this process, per backend
+batcher = ExplanationBatcher()
+
+
+async def _remote_explanation(backend, cache_key, timeout, gene, phenotype, drug, variants_for_gene):
+    request = (gene, phenotype, drug, variants_for_gene)
+
+    # Not worth waiting for a batch that cannot be sent
+    if backend.breaker.state == "open":
+        return _failure_result("circuit_open", f"{backend.name} circuit open", gene, phenotype, drug, variants_for_gene)
+
+    try:
+        text = await asyncio.wait_for(batcher.submit(backend, request, timeout), timeout)
+
+        result = _build_result(text, variants_for_gene)
+        await explanation_cache.aset(cache_key, result)
+
+        return result
+
+    except asyncio.TimeoutError:
+        return _failure_result("timeout", f"timed out after {timeout:g}s", gene, phenotype, drug, variants_for_gene)
+
+    except CircuitOpen as e:
+        # Upstream degraded: straight to the fallback, no call made
+        return _failure_result("circuit_open", str(e), gene, phenotype, drug, variants_for_gene)
 
     except Exception as e:
-        return {
-            "explanation_text": f"LLM Error: {str(e)}",
-            "variant_citations": []
-        }
+        return _failure_result("error", str(e), gene, phenotype, drug, variants_for_gene)
+
+
+async def agenerate_explanation(gene, phenotype, drug, variants_for_gene=None, timeout=None):
+    """
+    Async variant of generate_explanation with a hard per-call deadline.
+    With a fallback backend, callers get its answer once the latency budget
+    is spent while the remote call runs on to its deadline (and caches).
+    Never raises; failures come back as a fallback or "LLM Error" result.
+    """
+
+    backend = get_backend()
+    if not backend.remote:
+        return _local_result(backend, gene, phenotype, drug, variants_for_gene)
+
+    cache_key = make_key(gene, phenotype, drug, variants_for_gene, backend.model, PROMPT_VERSION)
+    cached = await explanation_cache.aget(cache_key)
+    metrics.cache_lookup("llm", cached is not None)
+    if cached is not None:
+        return cached
+
+    timeout = LLM_TIMEOUT_SECONDS if timeout is None else timeout
+    budget = None
+    if _fallback_backend() is not None and LLM_LATENCY_BUDGET_SECONDS < timeout:
+        budget = LLM_LATENCY_BUDGET_SECONDS
+
+    # Identical requests already in flight share that call
+    try:
+        return await in_flight.wait(
+            cache_key,
+            lambda: _remote_explanation(backend, cache_key, timeout, gene, phenotype, drug, variants_for_gene),
+            budget
+        )
+
+    except asyncio.TimeoutError:
+        metrics.inc(metrics.LLM_FALLBACKS, reason="budget")
+        return _local_result(_fallback_backend(), gene, phenotype, drug, variants_for_gene)
+
+
+async def generate_explanations(requests, concurrency=None, timeout=None):
+    """
+    Explain many (gene, phenotype, drug, variants_for_gene) requests
+    concurrently, at most `concurrency` at a time. Results keep the order
+    of the requests, so total latency tracks the slowest call, not the sum.
+    """
+
+    return await asyncio.gather(*_explanation_tasks(requests, concurrency, timeout))
+
+
+async def iter_explanations(requests, concurrency=None, timeout=None):
+    """
+    Same as generate_explanations, but yields (index, result) pairs as
+    each call completes, for streaming responses.
+    """
+
+    tasks = _explanation_tasks(requests, concurrency, timeout, indexed=True)
+
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Consumer went away (e.g. client disconnected): stop pending calls
+        for task in tasks:
+            task.cancel()
+
+
+def _explanation_tasks(requests, concurrency, timeout, indexed=False):
+    semaphore = asyncio.Semaphore(concurrency or LLM_CONCURRENCY)
+
+    async def run(index, request):
+        async with semaphore:
+            result = await agenerate_explanation(*request, timeout=timeout)
+        return (index, result) if indexed else result
+
+    return [asyncio.ensure_future(run(i, request)) for i, request in enumerate(requests)]
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+# Guards for calls to a remote LLM API: jittered exponential retry of
+# retryable errors, a token bucket pacing requests to the API tier's rate
+# limit, and a circuit breaker that stops calling a degraded upstream so
+# callers go straight to the deterministic fallback. Deadlines are applied
+# by the caller around the whole retry loop (see llm_engine._upstream).
+
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", 0.5))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", 4))
+
+# Requests per second and burst size allowed by the API tier (0 = unlimited)
+LLM_RATE_LIMIT_PER_SECOND = float(os.getenv("LLM_RATE_LIMIT_PER_SECOND", 5))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", 10))
+
+# Consecutive failed calls that open the breaker, and how long it stays open
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", 30))
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling an upstream whose circuit breaker is open.
+    """
+
+
+def is_retryable(error):
+    """
+    Rate limits, server errors, timeouts and connection failures are
+    retried; other client errors (bad request, auth) are not.
+    """
+
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+
+    # The SDK is already loaded when one of its clients raised
+    openai = sys.modules.get("openai")
+    return openai is not None and isinstance(error, openai.APIConnectionError)
+
+
+def retry_after(error):
+    """
+    Seconds from a Retry-After header on the error's response, if any.
+    """
+
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+
+    try:
+        return max(float(headers.get("retry-after")), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=None, cap=None):
+    """
+    Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)].
+    """
+
+    base = LLM_RETRY_BASE_SECONDS if base is None else base
+    cap = LLM_RETRY_MAX_SECONDS if cap is None else cap
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call_with_retries(start_call, limiter=None, max_retries=None, on_retry=None):
+    """
+    Await start_call(), retrying retryable errors after a jittered backoff
+    (or the server's Retry-After). Each attempt waits for a rate-limit token.
+    """
+
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+
+    while True:
+        if limiter is not None:
+            await limiter.acquire()
+
+        try:
+            return await start_call()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+
+            delay = retry_after(e)
+            await asyncio.sleep(backoff_delay(attempt) if delay is None else delay)
+
+            attempt += 1
+            if on_retry is not None:
+                on_retry(e)
+
+
+def call_with_retries_sync(call, limiter=None, max_retries=None, on_retry=None, deadline=None):
+    """
+    Blocking counterpart of call_with_retries. call(timeout) is passed the
+    seconds left before `deadline` (a time.monotonic() value, or None for
+    no deadline); no attempt or backoff runs past it.
+    """
+
+    max_retries = LLM_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+
+    while True:
+        if limiter is not None:
+            limiter.wait()
+
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            raise TimeoutError("deadline passed before the call was made")
+
+        try:
+            return call(remaining)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+
+            delay = retry_after(e)
+            delay = backoff_delay(attempt) if delay is None else delay
+            if deadline is not None and time.monotonic() + delay >= deadline:
+                raise
+
+            time.sleep(delay)
+
+            attempt += 1
+            if on_retry is not None:
+                on_retry(e)
+
+
+class TokenBucket:
+    """
+    Paces calls to `rate` per second with bursts of up to `burst`. Tokens
+    are reserved in arrival order, so waiting callers are served FIFO.
+    """
+
+    def __init__(self, rate=LLM_RATE_LIMIT_PER_SECOND, burst=LLM_RATE_LIMIT_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token; returns how many seconds to wait before using it.
+        """
+
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self):
+        # Blocking acquire, for callers without an event loop
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed calls. While open, allow()
+    is False; after reset_seconds one trial call is let through
+    (half-open), whose outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, failures=LLM_BREAKER_FAILURES, reset_seconds=LLM_BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at < self.reset_seconds:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open" or self._trial:
+                return False
+
+            self._trial = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+
+    def release(self):
+        # An abandoned (cancelled) call says nothing about the upstream
+        with self._lock:
+            self._trial = False
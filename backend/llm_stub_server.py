@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Minimal OpenAI-compatible chat completions server for offline runs and
+# load tests (LLM_BACKEND=stub). Answers every POST .../chat/completions
+# with a canned explanation built from the Gene/Phenotype/Drug lines of
+# the prompt (a JSON array of them for batched prompts), after a
+# configurable latency. Standard library only.
+#
+#   python llm_stub_server.py --port 8001 --latency 0.5 --jitter 0.2
+#   LLM_BACKEND=stub LLM_STUB_URL=http://127.0.0.1:8001/v1 uvicorn main:app
+
+_FIELD = re.compile(r"^(Gene|Phenotype|Drug): *(.*)$", re.MULTILINE)
+_INTERACTION = re.compile(r"^Interaction (\d+):$", re.MULTILINE)
+
+
+def _stub_text(prompt):
+    fields = dict(_FIELD.findall(prompt))
+    return (
+        f"Stub explanation for {fields.get('Drug', 'the drug')}: "
+        f"{fields.get('Gene', 'the gene')} phenotype {fields.get('Phenotype', 'unknown')}."
+    )
+
+
+def stub_completion(request):
+    prompt = request.get("messages", [{}])[-1].get("content", "")
+    blocks = _INTERACTION.split(prompt)
+
+    if len(blocks) > 1:
+        # Batched prompt: answer with the JSON array it asks for
+        text = json.dumps([
+            {"id": int(number), "explanation": _stub_text(block)}
+            for number, block in zip(blocks[1::2], blocks[2::2])
+        ])
+    else:
+        text = _stub_text(prompt)
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": text},
+            "finish_reason": "stop"
+        }],
+        "usage": {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(text.split()),
+            "total_tokens": len(prompt.split()) + len(text.split())
+        }
+    }
+
+
+def make_handler(latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+                return
+
+            time.sleep(max(0.0, latency + random.uniform(-jitter, jitter)))
+
+            if random.random() < error_rate:
+                self._send(error_status, {"error": {"message": "stub server error", "type": "server_error"}})
+                return
+
+            self._send(200, stub_completion(request))
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def make_server(host="127.0.0.1", port=8001, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500):
+    """
+    Server instance (port 0 picks a free port); call serve_forever().
+    """
+
+    server = ThreadingHTTPServer((host, port), make_handler(latency, jitter, error_rate, error_status))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stand-in LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("LLM_STUB_PORT", 8001)))
+    parser.add_argument("--latency", type=float, default=float(os.getenv("LLM_STUB_LATENCY_SECONDS", 0.5)),
+                        help="seconds before each response")
+    parser.add_argument("--jitter", type=float, default=float(os.getenv("LLM_STUB_JITTER_SECONDS", 0)),
+                        help="uniform +/- seconds added to the latency")
+    parser.add_argument("--error-rate", type=float, default=float(os.getenv("LLM_STUB_ERROR_RATE", 0)),
+                        help="fraction of requests answered with an error")
+    parser.add_argument("--error-status", type=int, default=int(os.getenv("LLM_STUB_ERROR_STATUS", 500)),
+                        help="HTTP status of error responses (e.g. 429 to simulate rate limiting)")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status)
+    print(f"Stub LLM server on http://{args.host}:{server.server_address[1]}/v1 (latency {args.latency:g}s)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
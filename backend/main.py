@@ -1,18 +1,71 @@
-from fastapi import FastAPI, UploadFile, File, Form
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime
+from fastapi.responses import StreamingResponse, Response
+from typing import List
+import asyncio
+import json
+import logging
 import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+from functools import partial
 
 from models import ManualInput
-from vcf_parser import extract_variants
-from variant_mapper import map_rsids_to_effects, classify_variants
+from records import to_dicts
 from phenotype_engine import infer_phenotypes
-from cpic_engine import apply_cpic_guideline
+from cpic_engine import apply_cpic_guideline, parse_drugs
 from scoring_engine import calculate_confidence
-from llm_engine import generate_explanation
+from llm_engine import generate_explanations, iter_explanations
+import llm_engine
+from pipeline import (
+    classify_upload, analyze_classification, attach_explanations, explanation_entry, format_results,
+    quality_metrics, debug_parse, map_upload, analyze_cohort_upload, warm
+)
+from upload_cache import UploadCache, upload_digests
+from knowledge_base import get_kb
+from workers import run_upload, Overloaded
+from batch import parse_manifest, iter_sources, run_batch
+import bgzf
+import metrics
+import workers
+
+
+# Level-gated so per-request detail costs nothing unless LOG_LEVEL=DEBUG.
+# Only our own logger is configured; library loggers keep their defaults.
+logger = logging.getLogger("pharmaguard")
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s %(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False
+
+def _warm_llm():
+    if not llm_engine.warm():
+        logger.warning("startup llm_backend=%s unavailable (no API key)", llm_engine.get_backend().name)
+
 
+@asynccontextmanager
+async def lifespan(app):
+    # Knowledge base tables are built before the first request. The LLM
+    # client is built in the background, so startup never waits on the SDK
+    version = await workers.run_in_thread(warm)
+    backend = llm_engine.get_backend()
+    logger.info("startup kb_version=%s llm_backend=%s", version[:12], backend.name)
 
-app = FastAPI()
+    if backend.remote:
+        asyncio.get_running_loop().run_in_executor(None, _warm_llm)
+
+    try:
+        yield
+    finally:
+        workers.shutdown()
+        bgzf.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # ---------------------------
 # CORS Configuration
@@ -41,6 +94,65 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ---------------------------
+# Worker Pool
+# ---------------------------
+
+def _overloaded(e):
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+async def _run(func, file, *args, index=None):
+    # CPU-bound work never runs on the event loop; a full queue is a 503
+    try:
+        return await run_upload(func, file, *args, index=index)
+    except Overloaded as e:
+        raise _overloaded(e)
+    except (EOFError, zlib.error) as e:
+        # Truncated or corrupt gzip/BGZF upload: the client's bytes are bad
+        raise HTTPException(status_code=400, detail=f"Corrupt or truncated compressed VCF: {e}")
+
+
+# Parsed uploads by content hash; repeats of the same VCF skip parsing
+upload_cache = UploadCache()
+
+
+def _cached_classification(key):
+    # Classifications made with an older knowledge base are stale
+    classification = upload_cache.get(key)
+    if classification is not None and classification.get("kb_version") != get_kb().version:
+        return None
+    return classification
+
+
+async def _classify(file, index, upload_id):
+    # Cache reads and writes may touch the disk tier, so they run in threads
+    if file is None:
+        classification = await workers.run_in_thread(_cached_classification, upload_id)
+        metrics.cache_lookup("upload", classification is not None)
+        if classification is None:
+            raise HTTPException(status_code=404, detail="Unknown upload_id; upload the VCF file again")
+        return upload_id, classification
+
+    start = time.perf_counter()
+    key, digest = await workers.run_in_thread(upload_digests, file, index)
+    metrics.observe_stage("upload_read", time.perf_counter() - start)
+
+    classification = await workers.run_in_thread(_cached_classification, key)
+    metrics.cache_lookup("upload", classification is not None)
+
+    if classification is None:
+        # The parser reuses the hash instead of reading the upload again
+        classification = await _run(partial(classify_upload, digest=digest), file, index=index)
+        await workers.run_in_thread(upload_cache.set, key, classification)
+
+    return key, classification
+
+
 # ---------------------------
 # Root Endpoint
 # ---------------------------
@@ -49,28 +161,40 @@ app.add_middleware(
 def home():
     return {"message": "PharmaGuard Backend Running"}
 
+
+@app.get("/metrics")
+def prometheus_metrics():
+    # Prometheus text format; stage histograms, byte and cache counters
+    body = metrics.registry.render({
+        "pharmaguard_analysis_pending": ("Analyses queued or running", workers.pending()),
+        "pharmaguard_llm_circuit_open": (
+            "1 while the LLM backend's circuit breaker is open or half-open",
+            int(llm_engine.circuit_state() != "closed")
+        )
+    })
+    return Response(body, media_type="text/plain; version=0.0.4")
+
 # ---------------------------
 # Test Endpoints
 # ---------------------------
 
 @app.post("/test-vcf")
 async def test_vcf(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    print(f"DEBUG test-vcf: Extracted {len(variants)} raw variants")
-    
-    classification = classify_variants(variants)
+    # Debug endpoint: full decode of every line, no rsID prefilter
+    classification = await _run(debug_parse, file)
     mapped = classification["recognized_pgx_variants"]
-    print(f"DEBUG test-vcf: Classified {len(mapped)} as PGx variants")
-    
-    phenotypes = infer_phenotypes(mapped)
-    print(f"DEBUG test-vcf: Phenotypes = {phenotypes}")
-    
+    phenotypes = classification["phenotypes"]
+    logger.debug(
+        "test_vcf variants_scanned=%d pgx_variants=%d phenotypes=%s",
+        classification["total_variants_scanned"], len(mapped), phenotypes
+    )
+
     return {
-        "raw_variants": len(variants),
+        "raw_variants": classification["total_variants_scanned"],
         "pgx_variants": len(mapped),
         "detected_rsids": [v["rsid"] for v in mapped],
         "phenotypes": phenotypes,
-        "mapped_variants": mapped
+        "mapped_variants": to_dicts(mapped)
     }
 
 
@@ -82,189 +206,247 @@ def analyze_manual(data: ManualInput):
         "drug": data.drug
     }
 
+# ---------------------------
+# Streaming Responses
+# ---------------------------
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream"
+}
+
+
+def _stream_mode(stream, accept):
+    # Opt-in via the `stream` form field or the Accept header
+    if stream:
+        mode = stream.lower()
+        if mode not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'sse'")
+        return mode
+
+    for mode, media_type in STREAM_MEDIA_TYPES.items():
+        if media_type in (accept or ""):
+            return mode
+
+    return None
+
+
+def _encode_event(event, data, mode):
+    if mode == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+async def _analysis_events(analysis, patient_id, mode):
+    # Deterministic results go out immediately; explanations follow one
+    # event per drug in completion order
+    yield _encode_event("parse", {
+        "patient_id": patient_id,
+        "upload_id": analysis["upload_id"],
+        "quality_metrics": quality_metrics(analysis)
+    }, mode)
+    yield _encode_event("phenotypes", {"patient_id": patient_id, "phenotypes": analysis["phenotypes"]}, mode)
+
+    for result in await workers.run_in_thread(format_results, analysis, patient_id):
+        yield _encode_event("result", result, mode)
+
+    llm_requests = analysis["llm_requests"]
+
+    async for i, llm_resp in iter_explanations([request for _, request in llm_requests]):
+        yield _encode_event("explanation", {
+            "drug": llm_requests[i][0],
+            "llm_generated_explanation": explanation_entry(llm_resp)
+        }, mode)
+
+    yield _encode_event("done", {"patient_id": patient_id}, mode)
+
 # ---------------------------
 # Main Analyze Endpoint
 # ---------------------------
 
 @app.post("/analyze")
 async def analyze(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
     drug: str = Form(...),
-    patient_id: str = Form("unknown")
+    patient_id: str = Form("unknown"),
+    index: UploadFile = File(None),
+    stream: str = Form(None),
+    upload_id: str = Form(None)
 ):
 
-    variants = extract_variants(file)
-    print(f"DEBUG: Extracted {len(variants)} variants from VCF")
-    if variants:
-        print(f"DEBUG: First variant: {variants[0]}")
+    mode = _stream_mode(stream, request.headers.get("accept"))
 
-    classification = classify_variants(variants)
-    mapped = classification["recognized_pgx_variants"]
-    print(f"DEBUG: Classified {len(mapped)} as pharmacogenomic variants")
-    if mapped:
-        print(f"DEBUG: First recognized variant: {mapped[0]}")
-
-    # Check if any pharmacogenomic variants were detected
-    if not mapped:
-        print("WARNING: No pharmacogenomic variants detected in VCF")
+    if file is None and not upload_id:
+        raise HTTPException(status_code=400, detail="Upload a VCF file or pass the upload_id of a previous upload")
 
-    phenotypes = infer_phenotypes(mapped)
-    print(f"DEBUG: Inferred phenotypes: {phenotypes}")
-
-    cpic_result = apply_cpic_guideline(phenotypes, drug)
+    # Parsing runs in the worker pool (so the event loop keeps serving other
+    # requests) unless the same bytes were already parsed. Phenotype, CPIC
+    # and formatting run in threads whether or not the parse was cached
+    drug_list = parse_drugs(drug)
+    digest, classification = await _classify(file, index, upload_id)
+    analysis = await workers.run_in_thread(analyze_classification, classification, drug_list)
+    analysis["upload_id"] = digest
 
-    confidence = calculate_confidence(mapped, phenotypes)
-
-    # Diplotype helper
-    def compute_diplotype(variants_for_gene):
-        if not variants_for_gene:
-            return "*1/*1"
-
-        alleles = []
-
-        for v in variants_for_gene:
-            allele = v.get("allele")
-            gt = v.get("genotype")
-
-            if gt == "1/1":
-                alleles.extend([allele, allele])
-            elif gt == "0/1":
-                alleles.append(allele)
-
-        while len(alleles) < 2:
-            alleles.append("*1")
-
-        return f"{alleles[0]}/{alleles[1]}"
-
-    drug_list = [d.strip().upper() for d in drug.split(",")]
-
-    drug_results = {}
-
-    for drug_key in drug_list:
-
-        risk_entry = cpic_result.get(drug_key)
-
-        if not risk_entry:
-            drug_results[drug_key] = {
-                "primary_gene": None,
-                "diplotype": None,
-                "phenotype": None,
-                "risk_assessment": {
-                    "risk_label": "Unknown",
-                    "confidence_score": confidence,
-                    "severity": "Unknown"
-                },
-                "clinical_recommendation": {
-                    "recommendation": "No CPIC guideline available",
-                    "evidence_level": None
-                },
-                "llm_generated_explanation": {
-                    "summary": "No gene/variant match to generate explanation.",
-                    "variant_citations": []
-                }
-            }
-            continue
-
-        primary_gene = risk_entry.get("gene")
-        variants_for_primary = [v for v in mapped if v.get("gene") == primary_gene] if primary_gene else []
-
-        diplotype = compute_diplotype(variants_for_primary)
-
-        # LLM explanation per drug
-        llm_resp = generate_explanation(
-            primary_gene,
-            risk_entry.get("phenotype"),
-            drug_key,
-            variants_for_primary
+    mapped = analysis["mapped"]
+    if mapped:
+        logger.debug(
+            "analyze upload_id=%s variants_scanned=%d pgx_variants=%d first_rsid=%s phenotypes=%s",
+            digest, analysis["total_variants_scanned"], len(mapped), mapped[0].rsid, analysis["phenotypes"]
+        )
+    else:
+        logger.info(
+            "analyze upload_id=%s variants_scanned=%d no pharmacogenomic variants detected",
+            digest, analysis["total_variants_scanned"]
         )
 
-        drug_results[drug_key] = {
-            "primary_gene": primary_gene,
-            "diplotype": diplotype,
-            "phenotype": risk_entry.get("phenotype"),
-            "risk_assessment": {
-                "risk_label": risk_entry.get("risk_category"),
-                "confidence_score": confidence,
-                "severity": risk_entry.get("severity")
-            },
-            "clinical_recommendation": {
-                "recommendation": risk_entry.get("recommendation"),
-                "evidence_level": risk_entry.get("evidence_level")
-            },
-            "llm_generated_explanation": {
-                "summary": llm_resp.get("explanation_text"),
-                "variant_citations": llm_resp.get("variant_citations")
-            }
-        }
+    if mode:
+        return StreamingResponse(
+            _analysis_events(analysis, patient_id, mode),
+            media_type=STREAM_MEDIA_TYPES[mode],
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
 
-    quality_metrics = {
-        "vcf_parsing_success": len(variants) > 0,
-        "total_variants_scanned": classification["total_variants_scanned"],
-        "non_pgx_variants_count": classification["non_pgx_variants_count"],
-        "confidence_score": confidence
-    }
+    # One explanation per drug, fanned out concurrently: latency is roughly
+    # that of the slowest drug rather than the sum
+    explanations = await generate_explanations([request for _, request in analysis["llm_requests"]])
+    attach_explanations(analysis, explanations)
 
     # Build response in frontend-expected format
-    results = []
-    
-    for drug_key, drug_data in drug_results.items():
-        result = {
-            "patient_id": patient_id,
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "drug": drug_key,
-            "pharmacogenomic_profile": {
-                "primary_gene": drug_data.get("primary_gene"),
-                "diplotype": drug_data.get("diplotype"),
-                "phenotype": drug_data.get("phenotype"),
-                "detected_variants": [v for v in mapped if v.get("gene") == drug_data.get("primary_gene")] if drug_data.get("primary_gene") else []
-            },
-            "risk_assessment": drug_data.get("risk_assessment", {}),
-            "clinical_recommendation": drug_data.get("clinical_recommendation", {}),
-            "llm_generated_explanation": drug_data.get("llm_generated_explanation", {}),
-            "quality_metrics": quality_metrics
-        }
-        results.append(result)
-    
+    results = await workers.run_in_thread(format_results, analysis, patient_id)
+
     # Return single result if one drug, array if multiple
     return results[0] if len(results) == 1 else results
 
+# ---------------------------
+# Multi-sample (Cohort) Endpoint
+# ---------------------------
+
+@app.post("/analyze-cohort")
+async def analyze_cohort_vcf(
+    file: UploadFile = File(...),
+    drug: str = Form(...)
+):
+    drug_list = parse_drugs(drug)
+    cohort = await _run(analyze_cohort_upload, file, drug_list)
+
+    return {
+        "sample_count": cohort["sample_count"],
+        "drugs": drug_list,
+        "results": cohort["results"],
+        "quality_metrics": {
+            "vcf_parsing_success": cohort["total_variants_scanned"] > 0,
+            "total_variants_scanned": cohort["total_variants_scanned"],
+            "variants_scanned_scope": "all_rows",
+            "pgx_sites_decoded": cohort["pgx_sites_decoded"]
+        }
+    }
+
+# ---------------------------
+# Batch Endpoint
+# ---------------------------
+
+class SpooledStreamingResponse(StreamingResponse):
+    """
+    Streams content, then deletes the spooled upload files once the
+    response is over: finished, abandoned by the client, or never started.
+    """
+
+    def __init__(self, content, spooled, **kwargs):
+        super().__init__(content, **kwargs)
+        self.spooled = spooled
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            # Synchronous: a cancelled request must not skip the cleanup
+            workers.discard(self.spooled)
+
+
+@app.post("/analyze-batch")
+async def analyze_batch(
+    drug: str = Form(...),
+    archive: UploadFile = File(None),
+    files: List[UploadFile] = File(None),
+    manifest: str = Form(None)
+):
+    # Many patients in one request: a tar/zip of VCFs and/or VCF file parts,
+    # optionally with a JSON manifest of patient_id -> file name. Results are
+    # streamed as NDJSON, one line per patient as each finishes.
+    try:
+        manifest_map = parse_manifest(manifest)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if archive is None and not files:
+        raise HTTPException(status_code=400, detail="Upload an archive or one or more VCF files")
+
+    try:
+        workers.check_capacity()
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    drug_list = parse_drugs(drug)
+
+    # Uploads are closed when the handler returns, so copy them out first
+    archive_path = None
+    file_paths = []
+
+    def spooled():
+        return [path for _, path in file_paths] + ([archive_path] if archive_path else [])
+
+    try:
+        if archive is not None:
+            archive_path = await workers.run_in_thread(workers.spool_upload, archive)
+        for f in files or []:
+            file_paths.append((f.filename, await workers.run_in_thread(workers.spool_upload, f)))
+    except BaseException:
+        workers.discard(spooled())
+        raise
+
+    async def ndjson():
+        sources = iter_sources(archive_path, file_paths, manifest_map)
+        async for result in run_batch(sources, drug_list):
+            yield json.dumps(result) + "\n"
+
+    return SpooledStreamingResponse(ndjson(), spooled(), media_type="application/x-ndjson")
+
 # ---------------------------
 # Additional Test Routes
 # ---------------------------
 
 @app.post("/test-mapping")
 async def test_mapping(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    mapped = map_rsids_to_effects(variants)
-    return mapped
+    mapped = await _run(map_upload, file)
+    return to_dicts(mapped)
+
+
+def _test_cpic(mapped, drug="CLOPIDOGREL"):
+    # Phenotype, CPIC and confidence for the /test-* routes, run in a thread
+    phenotypes = infer_phenotypes(mapped)
+    cpic_result = apply_cpic_guideline(phenotypes, drug)
+    return phenotypes, cpic_result, calculate_confidence(mapped, phenotypes)
 
 
 @app.post("/test-phenotype")
 async def test_phenotype(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    mapped = map_rsids_to_effects(variants)
-    phenotypes = infer_phenotypes(mapped)
+    mapped = await _run(map_upload, file)
+    phenotypes = await workers.run_in_thread(infer_phenotypes, mapped)
     return phenotypes
 
 
 @app.post("/test-cpic")
 async def test_cpic(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    mapped = map_rsids_to_effects(variants)
-    phenotypes = infer_phenotypes(mapped)
-
-    result = apply_cpic_guideline(phenotypes, "CLOPIDOGREL")
+    mapped = await _run(map_upload, file)
+    _, result, _ = await workers.run_in_thread(_test_cpic, mapped)
     return result
 
 
 @app.post("/test-full")
 async def test_full(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    mapped = map_rsids_to_effects(variants)
-    phenotypes = infer_phenotypes(mapped)
-
-    cpic_result = apply_cpic_guideline(phenotypes, "CLOPIDOGREL")
-    confidence = calculate_confidence(mapped, phenotypes)
+    mapped = await _run(map_upload, file)
+    _, cpic_result, confidence = await workers.run_in_thread(_test_cpic, mapped)
 
     return {
         "cpic_result": cpic_result,
@@ -274,21 +456,14 @@ async def test_full(file: UploadFile = File(...)):
 
 @app.post("/test-complete")
 async def test_complete(file: UploadFile = File(...)):
-    variants = extract_variants(file)
-    mapped = map_rsids_to_effects(variants)
-    phenotypes = infer_phenotypes(mapped)
-
-    cpic_result = apply_cpic_guideline(phenotypes, "CLOPIDOGREL")
-    confidence = calculate_confidence(mapped, phenotypes)
-
-    explanations = {}
-
-    for gene in cpic_result.keys():
-        explanations[gene] = generate_explanation(
-            gene,
-            phenotypes.get(gene),
-            "CLOPIDOGREL"
-        )
+    mapped = await _run(map_upload, file)
+    phenotypes, cpic_result, confidence = await workers.run_in_thread(_test_cpic, mapped)
+
+    genes = list(cpic_result.keys())
+    responses = await generate_explanations(
+        [(gene, phenotypes.get(gene), "CLOPIDOGREL") for gene in genes]
+    )
+    explanations = dict(zip(genes, responses))
 
     return {
         "cpic_result": cpic_result,
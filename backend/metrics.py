@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# In-process metrics rendered in the Prometheus text format (no client
+# library needed). Pipeline stage timings are histograms; bytes parsed and
+# cache lookups are counters, so rates and hit ratios come from rate().
+# Work done in analysis worker processes is recorded into a buffer and
+# replayed by the parent (see workers.py), so one scrape covers the whole
+# pool. With several uvicorn workers each process reports its own series.
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = "pharmaguard_stage_seconds"
+PARSED_BYTES = "pharmaguard_parsed_bytes_total"
+CACHE_LOOKUPS = "pharmaguard_cache_lookups_total"
+LLM_CALLS = "pharmaguard_llm_calls_total"
+LLM_FALLBACKS = "pharmaguard_llm_fallbacks_total"
+LLM_COALESCED = "pharmaguard_llm_coalesced_total"
+LLM_BATCH_ITEMS = "pharmaguard_llm_batch_items_total"
+LLM_RETRIES = "pharmaguard_llm_retries_total"
+
+_DESCRIPTIONS = {
+    STAGE_SECONDS: ("histogram", "Time spent in each analysis stage"),
+    PARSED_BYTES: ("counter", "Bytes of VCF input parsed"),
+    CACHE_LOOKUPS: ("counter", "Cache lookups by cache and result"),
+    LLM_CALLS: ("counter", "LLM API calls by backend and outcome"),
+    LLM_FALLBACKS: ("counter", "Explanations served by the fallback backend, by reason"),
+    LLM_COALESCED: ("counter", "Explanation requests that joined an identical in-flight call"),
+    LLM_BATCH_ITEMS: ("counter", "Explanations requested in batched prompts, by answer validity"),
+    LLM_RETRIES: ("counter", "LLM API calls retried after a retryable error, by backend"),
+}
+
+_capture = threading.local()
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{name}="{str(value)}"' for name, value in pairs)
+    return "{" + body + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """
+    Counters and fixed-bucket histograms keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (last one is +Inf), then sum
+                histogram = self._histograms[key] = [0] * (len(STAGE_BUCKETS) + 1) + [0.0]
+            histogram[bisect_left(STAGE_BUCKETS, value)] += 1
+            histogram[-1] += value
+
+    def value(self, name, **labels):
+        """
+        Counter value, or observation count for a histogram.
+        """
+
+        key = (name, _label_key(labels))
+        with self._lock:
+            if key in self._histograms:
+                return sum(self._histograms[key][:-1])
+            return self._counters.get(key, 0)
+
+    def render(self, gauges=None):
+        """
+        Prometheus text exposition of every series, plus the given
+        {name: (help, value)} gauges.
+        """
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind, help_text):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, *_DESCRIPTIONS.get(name, ("counter", name)))
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        for (name, labels), histogram in histograms:
+            describe(name, *_DESCRIPTIONS.get(name, ("histogram", name)))
+            cumulative = 0
+            for bound, count in zip(STAGE_BUCKETS + ("+Inf",), histogram[:-1]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram[-1])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            describe(name, "gauge", help_text)
+            lines.append(f"{name} {_format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _record(kind, name, value, labels):
+    events = getattr(_capture, "events", None)
+    if events is not None:
+        events.append((kind, name, value, labels))
+    elif kind == "inc":
+        registry.inc(name, value, **labels)
+    else:
+        registry.observe(name, value, **labels)
+
+
+def inc(name, value=1, **labels):
+    _record("inc", name, value, labels)
+
+
+def observe(name, value, **labels):
+    _record("observe", name, value, labels)
+
+
+def observe_stage(stage, seconds):
+    observe(STAGE_SECONDS, seconds, stage=stage)
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def cache_lookup(cache, hit):
+    inc(CACHE_LOOKUPS, cache=cache, result="hit" if hit else "miss")
+
+
+def call_captured(func, *args, **kwargs):
+    """
+    Run func in a worker process and return (result, recorded events) for
+    replay() in the parent.
+    """
+
+    _capture.events = []
+    try:
+        result = func(*args, **kwargs)
+        return result, _capture.events
+    finally:
+        _capture.events = None
+
+
+def replay(events):
+    for kind, name, value, labels in events:
+        _record(kind, name, value, labels)
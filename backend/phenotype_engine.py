@@ -1,63 +1,214 @@
 from collections import defaultdict
 
-CRITICAL_GENES = {
-    "CYP2D6",
-    "CYP2C19",
-    "CYP2C9",
-    "SLCO1B1",
-    "TPMT",
-    "DPYD"
+import numpy as np
+
+from knowledge_base import get_kb
+from diplotype_engine import allele_tables, REFERENCE_ALLELE, INDETERMINATE
+
+# Activity-score phenotyping.
+# Each allele has an activity value (CPIC style, e.g. CYP2D6 *10 = 0.25,
+# CYP2C19 *17 = 1.5); a diplotype's score is the sum of its two alleles
+# and gene-specific thresholds map the score to PM/IM/NM/RM/UM. Scores are
+# kept in quarter units, so for every gene the score -> phenotype mapping
+# and the diplotype -> phenotype mapping are dense arrays built once per
+# knowledge base version. Phenotyping a sample is then an array lookup.
+# The phenotype follows the same diplotype decision as call_diplotype:
+# when that call is indeterminate, so is the phenotype.
+
+# Activity of alleles without a curated value, by functional effect
+EFFECT_ACTIVITY = {
+    "loss_of_function": 0.0,
+    "reduced_function": 0.5,
+    "increased_function": 1.5
 }
 
+DEFAULT_THRESHOLDS = [(0, "PM"), (0.25, "IM"), (2, "NM")]
+
+
+def _quarters(value):
+    return int(round(value * 4))
+
+
+def _copies(variant):
+    genotype = variant.get("genotype", "0/1")
+
+    if genotype == "1/1":
+        return 2
+    if genotype == "0/1":
+        return 1
+    return 0
+
+
+class ActivityTable:
+    """
+    Diplotype -> activity score -> phenotype for one gene.
+    """
+
+    def __init__(self, gene, alleles, activity, thresholds):
+        self.gene = gene
+        self.alleles = alleles
+        self.activity = activity
+        self.reference = _quarters(activity.get(REFERENCE_ALLELE, 1.0))
+        self.labels = np.array([label for _, label in thresholds])
+
+        values = [self.reference] + [_quarters(v) for v in activity.values()]
+        values += [_quarters(v) for v in EFFECT_ACTIVITY.values()]
+        top = max(2 * max(values), _quarters(thresholds[-1][0]))
+
+        # Phenotype code for every reachable score (quarter units)
+        self.by_quarter = np.zeros(top + 1, dtype=np.int8)
+        for code, (minimum, _) in enumerate(thresholds):
+            self.by_quarter[_quarters(minimum):] = code
+
+        # Phenotype code for every diplotype of the gene's allele table
+        if alleles is not None:
+            allele_scores = np.array([self.allele_quarters(name) for name in alleles.names])
+            self.pair_codes = self.by_quarter[allele_scores[:, None] + allele_scores[None, :]]
+
+    def allele_quarters(self, allele, effect=None):
+        value = self.activity.get(allele)
+        if value is None:
+            value = EFFECT_ACTIVITY.get(effect)
+        if value is None:
+            return self.reference
+        return _quarters(value)
+
+    def score_code(self, quarters):
+        return self.by_quarter[np.clip(quarters, 0, len(self.by_quarter) - 1)]
+
+    def dosage_quarters(self, variants):
+        """
+        Reference diplotype score adjusted by every called allele copy.
+        Used for calls that carry no rsID of the gene's allele table
+        (effect-only variants).
+        """
+
+        score = 2 * self.reference
+        for v in variants:
+            score += _copies(v) * (self.allele_quarters(v.get("allele"), v.get("effect")) - self.reference)
+        return score
+
+    def phenotype(self, variants):
+        if not variants:
+            return str(self.labels[self.score_code(2 * self.reference)])
+
+        if self.alleles is not None and all(v.get("rsid") in self.alleles.core_index for v in variants):
+            pair = self.alleles.call_indices(variants)
+            if pair is None:
+                return INDETERMINATE
+            return str(self.labels[self.pair_codes[pair]])
+
+        # A diploid gene cannot carry more than two alt alleles
+        if sum(_copies(v) for v in variants) > 2:
+            return INDETERMINATE
+
+        return str(self.labels[self.score_code(self.dosage_quarters(variants))])
+
+
+def activity_tables(kb=None):
+    """
+    {gene: ActivityTable} for the critical genes, once per knowledge base version.
+    """
+
+    kb = kb or get_kb()
+
+    def build(kb):
+        alleles = allele_tables(kb)
+        return {
+            gene: ActivityTable(
+                gene,
+                alleles.get(gene),
+                kb.activity.get(gene, {}),
+                kb.phenotype_thresholds.get(gene, DEFAULT_THRESHOLDS)
+            )
+            for gene in kb.critical_genes
+        }
+
+    return kb.derived("activity_tables", build)
+
+
 def infer_phenotypes(mapped_variants):
     """
     Infer phenotype per gene.
-    If no variant detected → default to NM.
+    If no variant detected → default to the reference diplotype (NM).
     """
 
-    gene_effect_counts = defaultdict(lambda: {"loss": 0, "reduced": 0})
+    variants_by_gene = defaultdict(list)
 
     for variant in mapped_variants:
-        gene = variant["gene"]
-        effect = variant["effect"]
-        genotype = variant.get("genotype", "0/1")
+        variants_by_gene[variant["gene"]].append(variant)
 
-        if genotype == "1/1":
-            allele_count = 2
-        elif genotype == "0/1":
-            allele_count = 1
-        else:
-            allele_count = 0
+    phenotypes = {}
 
-        if effect == "loss_of_function":
-            gene_effect_counts[gene]["loss"] += allele_count
+    # Ensure all critical genes are evaluated
+    for gene, table in activity_tables().items():
+        phenotypes[gene] = table.phenotype(variants_by_gene.get(gene, []))
 
-        elif effect == "reduced_function":
-            gene_effect_counts[gene]["reduced"] += allele_count
+    return phenotypes
 
-    phenotypes = {}
 
-    # Ensure all critical genes are evaluated
-    for gene in CRITICAL_GENES:
+def build_activity_weights(rsids, variant_database):
+    """
+    Variant x gene weight matrix for a fixed list of rsIDs: the change in
+    the gene's activity score (quarter units) per alt allele copy. Unknown
+    rsIDs get an all-zero row.
+    """
+
+    tables = activity_tables()
+    genes = sorted(tables)
+    gene_index = {gene: g for g, gene in enumerate(genes)}
+    weights = np.zeros((len(rsids), len(genes)), dtype=np.int32)
+
+    for i, rsid in enumerate(rsids):
+        info = variant_database.get(rsid)
+        if not info or info["gene"] not in gene_index:
+            continue
+
+        table = tables[info["gene"]]
+        weights[i, gene_index[info["gene"]]] = (
+            table.allele_quarters(info["allele"], info["effect"]) - table.reference
+        )
 
-        loss = gene_effect_counts[gene]["loss"]
-        reduced = gene_effect_counts[gene]["reduced"]
+    return genes, weights
 
-        if loss >= 2:
-            phenotype = "PM"
 
-        elif loss == 1:
-            phenotype = "IM"
+def infer_phenotypes_batch(allele_counts, rsids, variant_database, site_mask=None):
+    """
+    Cohort phenotyping in one pass.
+
+    allele_counts is a samples x variants matrix of alt-allele counts
+    (negative = missing), with columns matching rsids. Counts times the
+    variant x gene activity weights give every sample's activity scores,
+    which index each gene's score -> phenotype table. Matches
+    infer_phenotypes for alleles defined by a single variant (all current
+    definitions); cohort genotypes carry no phase to resolve multi-variant
+    alleles. With single-variant alleles a sample's call is indeterminate
+    exactly when it has more than two alt alleles in the gene. Returns
+    {gene: array of phenotype labels, one per sample}.
+    """
+
+    tables = activity_tables()
+    genes, weights = build_activity_weights(rsids, variant_database)
 
-        elif reduced >= 2:
-            phenotype = "PM"
+    counts = np.clip(np.asarray(allele_counts), 0, 2).astype(np.int32)
+    if site_mask is not None:
+        counts = counts * np.asarray(site_mask, dtype=np.int32)
 
-        elif reduced == 1:
-            phenotype = "IM"
+    scores = counts @ weights
 
-        else:
-            phenotype = "NM"
+    # Alt allele copies per sample and gene
+    gene_index = {gene: g for g, gene in enumerate(genes)}
+    membership = np.zeros((len(rsids), len(genes)), dtype=np.int32)
+    for i, rsid in enumerate(rsids):
+        info = variant_database.get(rsid)
+        if info and info["gene"] in gene_index:
+            membership[i, gene_index[info["gene"]]] = 1
+    copies = counts @ membership
 
-        phenotypes[gene] = phenotype
+    results = {}
+    for g, gene in enumerate(genes):
+        table = tables[gene]
+        labels = table.labels[table.score_code(scores[:, g] + 2 * table.reference)]
+        results[gene] = np.where(copies[:, g] > 2, INDETERMINATE, labels)
 
-    return phenotypes
\ No newline at end of file
+    return results
@@ -0,0 +1,357 @@
+import copy
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from vcf_parser import iter_variants, iter_indexed_variants
+from variant_mapper import map_rsids_to_effects, classify_variants, pharmacogene_regions, pgx_rsids, pgx_positions
+from knowledge_base import get_kb
+from phenotype_engine import infer_phenotypes, activity_tables
+from cpic_engine import apply_cpic_guideline, decision_table
+from scoring_engine import calculate_confidence
+from diplotype_engine import call_diplotype, allele_tables
+from records import to_dicts
+from result_cache import ResultCache, fingerprint
+from cohort_engine import extract_genotype_matrix, analyze_cohort
+import metrics
+
+# Deterministic analysis stages (parse -> classify -> phenotype -> CPIC ->
+# confidence). Everything here is a plain top-level function over picklable
+# inputs and outputs, so it can run in a worker process (see workers.py).
+# Sources are either a file path or an open binary file object.
+
+# Per process: each worker keeps its own memo of derived results
+result_cache = ResultCache()
+
+
+def warm():
+    """
+    Load the knowledge base and build everything derived from it (parser
+    prefilters, allele, activity and CPIC decision tables), so the first
+    request does not pay for it. Returns the knowledge base version.
+    """
+
+    kb = get_kb()
+    pgx_rsids(kb)
+    pgx_positions(kb)
+    allele_tables(kb)
+    activity_tables(kb)
+    decision_table(kb)
+    return kb.version
+
+
+@contextmanager
+def open_source(source):
+    if source is None or not isinstance(source, str):
+        yield source
+        return
+
+    with open(source, "rb") as f:
+        yield f
+
+
+def _source_size(file):
+    if file is None:
+        return 0
+
+    # Uploads arrive as paths, binary streams or UploadFile wrappers
+    stream = getattr(file, "file", file)
+    position = stream.tell()
+    size = stream.seek(0, os.SEEK_END)
+    stream.seek(position)
+    return size
+
+
+def _timed_variants(variants, timings):
+    # Accumulates the time spent producing variants (decode + parse), so it
+    # can be told apart from the time spent classifying them
+    iterator = iter(variants)
+
+    while True:
+        start = time.perf_counter()
+        try:
+            variant = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            timings["parse"] += time.perf_counter() - start
+        yield variant
+
+
+def build_drug_results(mapped, cpic_result, confidence, drug_list):
+    """
+    Per-drug results without LLM explanations, plus the
+    (drug, (gene, phenotype, drug, variants)) explanation requests.
+    """
+
+    drug_results = {}
+    llm_requests = []
+
+    for drug_key in drug_list:
+
+        risk_entry = cpic_result.get(drug_key)
+
+        if not risk_entry:
+            drug_results[drug_key] = {
+                "primary_gene": None,
+                "diplotype": None,
+                "phenotype": None,
+                "risk_assessment": {
+                    "risk_label": "Unknown",
+                    "confidence_score": confidence,
+                    "severity": "Unknown"
+                },
+                "clinical_recommendation": {
+                    "recommendation": "No CPIC guideline available",
+                    "evidence_level": None
+                },
+                "llm_generated_explanation": {
+                    "summary": "No gene/variant match to generate explanation.",
+                    "variant_citations": []
+                }
+            }
+            continue
+
+        primary_gene = risk_entry.get("gene")
+        variants_for_primary = _variants_for(mapped, primary_gene)
+
+        diplotype = call_diplotype(primary_gene, variants_for_primary)
+
+        # LLM explanations are requested separately (and concurrently)
+        llm_requests.append((drug_key, (
+            primary_gene,
+            risk_entry.get("phenotype"),
+            drug_key,
+            variants_for_primary
+        )))
+
+        drug_results[drug_key] = {
+            "primary_gene": primary_gene,
+            "diplotype": diplotype,
+            "phenotype": risk_entry.get("phenotype"),
+            "risk_assessment": {
+                "risk_label": risk_entry.get("risk_category"),
+                "confidence_score": confidence,
+                "severity": risk_entry.get("severity")
+            },
+            "clinical_recommendation": {
+                "recommendation": risk_entry.get("recommendation"),
+                "evidence_level": risk_entry.get("evidence_level")
+            },
+            "llm_generated_explanation": {}
+        }
+
+    return drug_results, llm_requests
+
+
+def _variants_for(mapped, gene):
+    return [v for v in mapped if v.gene == gene] if gene else []
+
+
+def derive_results(mapped, drug_list):
+    """
+    Phenotypes, confidence, per-drug results and explanation requests for
+    one patient's recognized variants. Memoized by genotype fingerprint;
+    explanation requests always carry this patient's own variants.
+    """
+
+    key = fingerprint(mapped, drug_list)
+    cached = result_cache.get(key)
+    metrics.cache_lookup("result", cached is not None)
+
+    if cached is None:
+        with metrics.timed("phenotype"):
+            phenotypes = infer_phenotypes(mapped)
+
+        # Drug list is parsed once by the caller; CPIC resolution is table lookups
+        with metrics.timed("cpic"):
+            cpic_result = apply_cpic_guideline(phenotypes, drug_list)
+
+        with metrics.timed("confidence"):
+            confidence = calculate_confidence(mapped, phenotypes)
+
+        with metrics.timed("diplotype"):
+            drug_results, llm_requests = build_drug_results(mapped, cpic_result, confidence, drug_list)
+
+        cached = {
+            "phenotypes": phenotypes,
+            "confidence": confidence,
+            "drug_results": drug_results,
+            "llm_requests": [(drug_key, request[:3]) for drug_key, request in llm_requests]
+        }
+        result_cache.set(key, cached)
+
+    # Callers fill in explanations, so hand out copies of the shared entry
+    return {
+        "phenotypes": dict(cached["phenotypes"]),
+        "confidence": cached["confidence"],
+        "drug_results": copy.deepcopy(cached["drug_results"]),
+        "llm_requests": [
+            (drug_key, (gene, phenotype, drug, _variants_for(mapped, gene)))
+            for drug_key, (gene, phenotype, drug) in cached["llm_requests"]
+        ]
+    }
+
+
+def classify_upload(source, index_source=None, digest=None):
+    """
+    Parse and classify one single-sample VCF. The result only depends on
+    the upload's bytes, so it can be cached by content hash. digest is
+    the VCF's content hash when the caller already has it.
+    """
+
+    with open_source(source) as file, open_source(index_source) as index_file:
+
+        # Variants are streamed straight into classification, so the upload
+        # is never materialized as a full list of lines or records. For
+        # bgzipped VCFs only the pharmacogene regions are decoded (via
+        # .tbi/.csi index), and only lines with a known PGx rsID or
+        # position are parsed.
+        kb = get_kb()
+        parse_stats = {}
+        timings = {"parse": 0.0}
+        start = time.perf_counter()
+
+        metrics.inc(metrics.PARSED_BYTES, _source_size(file))
+        variants = iter_indexed_variants(
+            file,
+            pharmacogene_regions(),
+            index_file=index_file,
+            rsids=pgx_rsids(kb),
+            stats=parse_stats,
+            positions=pgx_positions(kb),
+            digest=digest
+        )
+        classification = classify_variants(_timed_variants(variants, timings), parse_stats)
+
+        metrics.observe_stage("parse", timings["parse"])
+        metrics.observe_stage("classify", time.perf_counter() - start - timings["parse"])
+
+    # Indexed bgzipped uploads are only scanned inside the pharmacogene
+    # regions; the file still parsed if the index lists any data rows
+    scope = parse_stats.get("scope", "all_rows")
+    classification["variants_scanned_scope"] = scope
+    classification["vcf_parsing_success"] = (
+        classification["total_variants_scanned"] > 0 if scope == "all_rows"
+        else parse_stats.get("indexed_sequences", 0) > 0
+    )
+
+    # Cached classifications are only valid for the knowledge base they used
+    classification["kb_version"] = kb.version
+    return classification
+
+
+def analyze_classification(classification, drug_list):
+    mapped = classification["recognized_pgx_variants"]
+
+    return dict(
+        derive_results(mapped, drug_list),
+        total_variants_scanned=classification["total_variants_scanned"],
+        variants_scanned_scope=classification.get("variants_scanned_scope", "all_rows"),
+        vcf_parsing_success=classification.get("vcf_parsing_success", classification["total_variants_scanned"] > 0),
+        non_pgx_variants_count=classification["non_pgx_variants_count"],
+        mapped=mapped
+    )
+
+
+def analyze_upload(source, drug_list, index_source=None):
+    """
+    Run the deterministic /analyze pipeline over one single-sample VCF.
+    """
+
+    return analyze_classification(classify_upload(source, index_source), drug_list)
+
+
+def explanation_entry(llm_resp):
+    return {
+        "summary": llm_resp.get("explanation_text"),
+        "variant_citations": llm_resp.get("variant_citations")
+    }
+
+
+def attach_explanations(analysis, explanations):
+    for (drug_key, _), llm_resp in zip(analysis["llm_requests"], explanations):
+        analysis["drug_results"][drug_key]["llm_generated_explanation"] = explanation_entry(llm_resp)
+
+
+def quality_metrics(analysis):
+    return {
+        "vcf_parsing_success": analysis["vcf_parsing_success"],
+        "total_variants_scanned": analysis["total_variants_scanned"],
+        "variants_scanned_scope": analysis["variants_scanned_scope"],
+        "non_pgx_variants_count": analysis["non_pgx_variants_count"],
+        "confidence_score": analysis["confidence"]
+    }
+
+
+def format_results(analysis, patient_id):
+    """
+    Build the frontend-facing response: one entry per drug.
+    """
+
+    mapped = analysis["mapped"]
+    metrics = quality_metrics(analysis)
+
+    results = []
+
+    for drug_key, drug_data in analysis["drug_results"].items():
+        result = {
+            "patient_id": patient_id,
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "drug": drug_key,
+            "pharmacogenomic_profile": {
+                "primary_gene": drug_data.get("primary_gene"),
+                "diplotype": drug_data.get("diplotype"),
+                "phenotype": drug_data.get("phenotype"),
+                "detected_variants": to_dicts(v for v in mapped if v.gene == drug_data.get("primary_gene")) if drug_data.get("primary_gene") else []
+            },
+            "risk_assessment": drug_data.get("risk_assessment", {}),
+            "clinical_recommendation": drug_data.get("clinical_recommendation", {}),
+            "llm_generated_explanation": drug_data.get("llm_generated_explanation", {}),
+            "quality_metrics": metrics
+        }
+
+        # Lets clients re-run with other drugs without re-sending the VCF
+        if analysis.get("upload_id"):
+            result["upload_id"] = analysis["upload_id"]
+
+        results.append(result)
+
+    return results
+
+
+def debug_parse(source):
+    """
+    Full decode of every line (no rsID prefilter), for /test-vcf.
+    """
+
+    with open_source(source) as file:
+        parse_stats = {}
+        classification = classify_variants(iter_variants(file, stats=parse_stats, positions=pgx_positions()), parse_stats)
+
+    classification["phenotypes"] = infer_phenotypes(classification["recognized_pgx_variants"])
+    return classification
+
+
+def map_upload(source):
+    with open_source(source) as file:
+        return map_rsids_to_effects(iter_variants(file, rsids=pgx_rsids(), positions=pgx_positions()))
+
+
+def analyze_cohort_upload(source, drug_list):
+    with open_source(source) as file:
+        metrics.inc(metrics.PARSED_BYTES, _source_size(file))
+
+        with metrics.timed("cohort_parse"):
+            matrix = extract_genotype_matrix(file, rsids=pgx_rsids(), positions=pgx_positions())
+
+    with metrics.timed("cohort_analyze"):
+        results = analyze_cohort(matrix, drug_list)
+
+    return {
+        "sample_count": len(matrix["samples"]),
+        "results": results,
+        "total_variants_scanned": matrix["total_variants_scanned"],
+        "pgx_sites_decoded": len(matrix["sites"])
+    }
@@ -0,0 +1,127 @@
+from bisect import bisect_left, bisect_right
+
+# Coordinate-based variant annotation.
+# Positions are kept per chromosome in sorted arrays, so a CHROM/POS/REF/ALT
+# lookup is a binary search (O(log n)) and needs no rsID. Built once per
+# knowledge base version; scales to thousands of defined positions. Each
+# genome build gets its own index, so a GRCh37 position never matches a
+# GRCh38 annotation (and vice versa).
+
+
+def normalize_chrom(chrom):
+    # "chr10", "Chr10" and "10" name the same contig
+    if chrom[:3].lower() == "chr":
+        return chrom[3:]
+    return chrom
+
+
+class PositionIndex:
+    """
+    Point annotations keyed on (chrom, pos, ref, alt).
+    `records` is an iterable of (chrom, pos, ref, alt, value) tuples.
+    """
+
+    def __init__(self, records):
+        by_chrom = {}
+
+        for chrom, pos, ref, alt, value in records:
+            by_chrom.setdefault(normalize_chrom(chrom), []).append((pos, ref, alt, value))
+
+        self._positions = {}
+        self._entries = {}
+
+        for chrom, rows in by_chrom.items():
+            rows.sort(key=lambda row: row[0])
+            self._positions[chrom] = [row[0] for row in rows]
+            self._entries[chrom] = [row[1:] for row in rows]
+
+    def __len__(self):
+        return sum(len(positions) for positions in self._positions.values())
+
+    def _span(self, chrom, start, end):
+        chrom = normalize_chrom(chrom)
+        positions = self._positions.get(chrom)
+
+        if positions is None:
+            return None, 0, 0
+
+        return chrom, bisect_left(positions, start), bisect_right(positions, end)
+
+    def has_position(self, chrom, pos):
+        chrom, lo, hi = self._span(chrom, pos, pos)
+        return hi > lo
+
+    def match(self, chrom, pos, ref=None, alt=None):
+        """
+        (value, ALT allele index) annotated at chrom:pos, or None. When
+        given, ref must match and alt must contain the annotated ALT; the
+        index (1-based, as in GT) says which of the comma-separated ALT
+        alleles it is, so only genotypes carrying that allele count.
+        """
+
+        chrom, lo, hi = self._span(chrom, pos, pos)
+        if hi <= lo:
+            return None
+
+        alts = alt.split(",") if alt else None
+
+        for entry_ref, entry_alt, value in self._entries[chrom][lo:hi]:
+            if ref is not None and entry_ref != ref:
+                continue
+            if alts is None:
+                return value, 1
+            if entry_alt in alts:
+                return value, alts.index(entry_alt) + 1
+
+        return None
+
+    def lookup(self, chrom, pos, ref=None, alt=None):
+        """
+        Value annotated at chrom:pos, or None (see match).
+        """
+
+        found = self.match(chrom, pos, ref, alt)
+        return None if found is None else found[0]
+
+    def overlapping(self, chrom, start, end):
+        """
+        (pos, ref, alt, value) for every annotation in [start, end].
+        """
+
+        chrom, lo, hi = self._span(chrom, start, end)
+        if hi <= lo:
+            return []
+
+        return [
+            (pos,) + entry
+            for pos, entry in zip(self._positions[chrom][lo:hi], self._entries[chrom][lo:hi])
+        ]
+
+
+class BuildPositionIndex:
+    """
+    One PositionIndex per genome build. `records` is an iterable of
+    (chrom, pos, ref, alt, value, build) tuples; VCFs whose header does
+    not name a build are annotated with default_build.
+    """
+
+    def __init__(self, records, default_build):
+        by_build = {}
+
+        for chrom, pos, ref, alt, value, build in records:
+            by_build.setdefault(build, []).append((chrom, pos, ref, alt, value))
+
+        self.default_build = default_build
+        self.builds = {build: PositionIndex(rows) for build, rows in by_build.items()}
+        self._empty = PositionIndex([])
+
+    def __len__(self):
+        return sum(len(index) for index in self.builds.values())
+
+    def for_build(self, build=None):
+        """
+        Index of the given build (default_build when None); an empty index
+        for builds without annotations.
+        """
+
+        return self.builds.get(build or self.default_build, self._empty)
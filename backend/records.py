@@ -0,0 +1,116 @@
+import sys
+
+# Compact variant records shared by the parser, mapper and engines.
+# Slotted classes avoid a per-row dict; repeated strings (genotypes,
+# filters, gene/allele/effect labels) are interned or shared with the
+# knowledge base. Records still support dict-style access (record["gene"],
+# record.get("dp")) so callers that pass plain dicts keep working, and are
+# converted to JSON-ready dicts only at the API boundary via to_dict().
+
+intern = sys.intern
+
+
+class Record:
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, key) == getattr(other, key) for key in self.__slots__)
+
+    def __repr__(self):
+        fields = ", ".join(f"{key}={getattr(self, key)!r}" for key in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, key) for key in self.__slots__)
+
+    def __setstate__(self, state):
+        # Pickles from before a slot was added leave it as None
+        for i, key in enumerate(self.__slots__):
+            setattr(self, key, state[i] if i < len(state) else None)
+
+
+class VariantCall(Record):
+    """
+    One parsed VCF data line (first sample).
+    """
+
+    __slots__ = ("rsid", "genotype", "ref", "alt", "qual", "filter", "dp", "gq", "chrom", "pos", "gt")
+
+    def __init__(self, rsid, genotype, ref, alt, qual, filter, dp, gq, chrom=None, pos=None, gt=None):
+        self.rsid = rsid
+        self.genotype = intern(genotype)
+        self.ref = ref
+        self.alt = alt
+        self.qual = qual
+        self.filter = intern(filter)
+        self.dp = dp
+        self.gq = gq
+        self.chrom = chrom
+        self.pos = pos
+        self.gt = intern(gt) if gt else gt
+
+
+class PgxVariant(Record):
+    """
+    A call recognized in the pharmacogenomic variant database.
+    gene/allele/effect are the knowledge base's own string objects.
+    genotype is normalized to "0/1" / "1/1"; gt keeps the raw GT field,
+    including phase ("1|0").
+    """
+
+    __slots__ = ("rsid", "gene", "allele", "effect", "genotype", "dp", "gq", "filter", "chrom", "pos", "gt")
+
+    def __init__(self, rsid, gene, allele, effect, genotype, dp, gq, filter, chrom=None, pos=None, gt=None):
+        self.rsid = rsid
+        self.gene = gene
+        self.allele = allele
+        self.effect = effect
+        self.genotype = genotype
+        self.dp = dp
+        self.gq = gq
+        self.filter = filter
+        self.chrom = chrom
+        self.pos = pos
+        self.gt = gt
+
+
+class Site(Record):
+    """
+    Per-site columns of a multi-sample VCF row; genotypes live in the
+    cohort's allele-count matrix.
+    """
+
+    __slots__ = ("chrom", "pos", "rsid", "ref", "alt", "qual", "filter")
+
+    def __init__(self, chrom, pos, rsid, ref, alt, qual, filter):
+        self.chrom = chrom
+        self.pos = pos
+        self.rsid = rsid
+        self.ref = ref
+        self.alt = alt
+        self.qual = qual
+        self.filter = intern(filter)
+
+
+def to_dicts(records):
+    return [record.to_dict() for record in records]
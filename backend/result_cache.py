@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+
+from knowledge_base import get_kb
+
+# Memo of the downstream pipeline (phenotype -> CPIC -> diplotype ->
+# confidence) keyed by a genotype fingerprint. Patients with the same
+# recognized variants and quality buckets get identical results, so only
+# the first one pays for them. Entries are tied to the knowledge base
+# version, so a reloaded variant database or guideline set drops them.
+
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 4096))
+
+# Quality thresholds used by scoring_engine.calculate_confidence
+GQ_BUCKET = 90
+DP_BUCKET = 30
+
+
+def knowledge_base_version():
+    """
+    Version of the loaded knowledge base.
+    """
+
+    return get_kb().version
+
+
+def _phase(gt):
+    # Phased calls can change the diplotype; unphased spellings cannot
+    return gt if gt and "|" in gt else ""
+
+
+def fingerprint(mapped_variants, drug_list):
+    """
+    Canonical key for everything the downstream pipeline reads from a
+    patient: rsID, genotype, phase, GQ/DP bucket and filter per recognized
+    variant (order-independent), plus the requested drugs in order.
+    """
+
+    variants = tuple(sorted(
+        (
+            v["rsid"],
+            v.get("genotype") or "",
+            _phase(v.get("gt")),
+            (v.get("gq") or 0) >= GQ_BUCKET,
+            (v.get("dp") or 0) >= DP_BUCKET,
+            v.get("filter") or ""
+        )
+        for v in mapped_variants
+    ))
+
+    return variants, tuple(drug_list)
+
+
+class ResultCache:
+    """
+    Bounded in-process LRU. Values are stored as given and must be
+    treated as read-only by callers.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.version = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def invalidate(self, version=None):
+        """
+        Drop every entry. Happens automatically when the knowledge base
+        version changes.
+        """
+
+        with self._lock:
+            self._entries.clear()
+            self.version = version or knowledge_base_version()
+
+    def _check_version(self):
+        # Called with the lock held
+        version = knowledge_base_version()
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key):
+        with self._lock:
+            self._check_version()
+            value = self._entries.get((self.version, key))
+
+            if value is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end((self.version, key))
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_version()
+            self._entries[(self.version, key)] = value
+            self._entries.move_to_end((self.version, key))
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# Check activity-score phenotyping (gene-specific thresholds, *10, *17)
+import numpy as np
+
+from records import PgxVariant
+from phenotype_engine import infer_phenotypes, infer_phenotypes_batch, activity_tables
+from cpic_engine import apply_cpic_guideline
+from variant_mapper import VARIANT_DATABASE
+
+
+def variant(rsid, genotype, gt=None):
+    info = VARIANT_DATABASE[rsid]
+    return PgxVariant(rsid, info["gene"], info["allele"], info["effect"], genotype, 40, 99, "PASS", gt=gt)
+
+
+cases = [
+    ("CYP2D6", [], "NM"),
+    ("CYP2D6", [variant("rs1065852", "0/1")], "NM"),                               # *1/*10 = 1.25
+    ("CYP2D6", [variant("rs1065852", "1/1")], "IM"),                               # *10/*10 = 0.5
+    ("CYP2D6", [variant("rs3892097", "0/1")], "IM"),                               # *1/*4 = 1
+    ("CYP2D6", [variant("rs3892097", "0/1"), variant("rs1065852", "0/1")], "IM"),  # *4/*10 = 0.25
+    ("CYP2D6", [variant("rs3892097", "1/1")], "PM"),
+    ("CYP2C19", [variant("rs12248560", "0/1")], "RM"),                             # *1/*17
+    ("CYP2C19", [variant("rs12248560", "1/1")], "UM"),                             # *17/*17
+    ("CYP2C19", [variant("rs4244285", "0/1"), variant("rs12248560", "0/1")], "IM"),  # *2/*17
+    ("CYP2C19", [variant("rs4244285", "0/1"), variant("rs4986893", "1/1")], "Indeterminate"),  # 3 alt alleles
+    ("SLCO1B1", [variant("rs4149056", "0/1")], "IM"),
+    ("SLCO1B1", [variant("rs4149056", "1/1")], "PM"),                              # two reduced alleles
+]
+
+for gene, variants, expected in cases:
+    phenotype = infer_phenotypes(variants)[gene]
+    assert phenotype == expected, (gene, variants, phenotype)
+print(f"Checked {len(cases)} diplotypes")
+
+# Dicts without rsID/allele are scored from their effect
+assert infer_phenotypes([{"gene": "TPMT", "effect": "loss_of_function", "genotype": "1/1"}])["TPMT"] == "PM"
+assert infer_phenotypes([{"gene": "CYP2C19", "effect": "increased_function", "genotype": "0/1"}])["CYP2C19"] == "RM"
+
+# Diplotype -> phenotype tables are dense arrays
+table = activity_tables()["CYP2D6"]
+names = table.alleles.names
+assert table.pair_codes.shape == (len(names), len(names))
+print(f"CYP2D6 diplotype table: {table.pair_codes.shape}, labels {[str(label) for label in table.labels]}")
+
+# Ultrarapid and rapid metabolizers have CPIC rules
+clopidogrel = apply_cpic_guideline({"CYP2C19": "UM"}, "CLOPIDOGREL")["CLOPIDOGREL"]
+codeine = apply_cpic_guideline({"CYP2D6": "UM"}, "CODEINE")["CODEINE"]
+assert clopidogrel["risk_category"] == "Safe" and codeine["risk_category"] == "Toxic"
+print(f"CODEINE UM: {codeine['recommendation']}")
+
+# Cohort phenotyping agrees with per-sample diplotype calls
+rsids = sorted(VARIANT_DATABASE)
+counts = np.random.default_rng(19).integers(0, 3, size=(300, len(rsids)))
+batch = infer_phenotypes_batch(counts, rsids, VARIANT_DATABASE)
+labels = {1: "0/1", 2: "1/1"}
+
+for j in range(counts.shape[0]):
+    variants = [variant(rsid, labels[int(counts[j, i])]) for i, rsid in enumerate(rsids) if counts[j, i] > 0]
+    assert {gene: str(batch[gene][j]) for gene in batch} == infer_phenotypes(variants)
+print(f"Batch phenotyping matches per-sample diplotypes for {counts.shape[0]} samples")
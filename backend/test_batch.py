@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Check batch source discovery and result streaming (LLM calls are faked)
+import asyncio
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+
+import batch
+
+
+def make_tar():
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for name in ("run1/P1.vcf", "run1/P2.vcf", "run1/P3.vcf.gz", "run1/notes.txt"):
+            tar.add('test_variants.vcf', arcname=name)
+
+    path = tempfile.mktemp(suffix=".tar.gz")
+    with open(path, "wb") as f:
+        f.write(buf.getvalue())
+    return path
+
+
+def copy(name):
+    path = tempfile.mktemp(suffix=".vcf")
+    shutil.copy(name, path)
+    return path
+
+
+calls = []
+
+
+async def fake_explanation(gene, phenotype, drug, variants_for_gene=None):
+    calls.append((gene, drug))
+    await asyncio.sleep(0.01)
+    return {"explanation_text": f"{gene} {phenotype} {drug}", "variant_citations": []}
+
+
+batch.agenerate_explanation = fake_explanation
+
+print(batch.patient_id_for("run1/P3.vcf.gz"), batch.is_vcf_name("run1/notes.txt"))
+
+# Archive members and uploaded parts, named by file
+sources = list(batch.iter_sources(make_tar(), [("UP.vcf", copy('test_sample.vcf'))]))
+print([(patient_id, error) for patient_id, _, error in sources])
+assert [s[0] for s in sources] == ["UP", "P1", "P2", "P3"]
+for _, path, _ in sources:
+    os.unlink(path)
+
+# Manifest picks and renames patients; missing entries are reported
+manifest = batch.parse_manifest('{"A": "run1/P1.vcf", "B": "P2.vcf", "C": "gone.vcf"}')
+sources = batch.iter_sources(make_tar(), manifest=manifest)
+
+
+async def collect():
+    return [result async for result in batch.run_batch(sources, ["CODEINE", "CLOPIDOGREL"], concurrency=2)]
+
+
+results = asyncio.run(collect())
+for result in results:
+    if "results" in result:
+        print(result["patient_id"], [r["risk_assessment"]["risk_label"] for r in result["results"]])
+    else:
+        print(result)
+
+summary = results[-1]["summary"]
+assert summary == {"patients": 3, "succeeded": 2, "failed": 1, "unique_explanations": 2}
+
+# Two identical patients share one explanation per drug
+assert len(calls) == 2
+print(f"LLM calls: {len(calls)}")
+
+# Spooled uploads are removed even when the client leaves before the
+# stream starts (the generator never runs, so only the response can do it)
+from main import SpooledStreamingResponse
+
+spooled = [make_tar(), copy('test_sample.vcf')]
+
+
+async def never_started():
+    sources = batch.iter_sources(spooled[0], [("UP.vcf", spooled[1])])
+    async for result in batch.run_batch(sources, ["CODEINE"]):
+        yield str(result)
+
+
+async def disconnected(message):
+    raise OSError("client went away")
+
+
+async def respond():
+    response = SpooledStreamingResponse(never_started(), spooled)
+    try:
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, None, disconnected)
+    except Exception as e:
+        return type(e).__name__
+
+
+print(f"Client gone before the first chunk: {asyncio.run(respond())}")
+assert not any(os.path.exists(path) for path in spooled)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Check gzip / BGZF VCF ingestion against the plain-text parse
+import gzip
+import multiprocessing
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import bgzf
+from vcf_parser import extract_variants, iter_indexed_variants
+from variant_mapper import pharmacogene_regions
+
+class MockFile:
+    def __init__(self, content):
+        self.file = BytesIO(content)
+
+def parse_in_worker(content):
+    # Runs in a spawned process, as large uploads do in the analysis pool
+    bgzf.BGZF_WORKERS = 4
+    variants = extract_variants(MockFile(content))
+    return len(variants), bgzf._pool is not None
+
+def main():
+    with open("test_variants.vcf", "rb") as f:
+        vcf_content = f.read()
+
+    expected = extract_variants(MockFile(vcf_content))
+    print(f"Plain VCF: {len(expected)} variants")
+
+    # Small blocks so the file spans several parallel batches
+    big = vcf_content + b"".join(
+        line + b"\n" for line in vcf_content.splitlines() if not line.startswith(b"#")
+    ) * 40
+    big_expected = extract_variants(MockFile(big))
+
+    out = BytesIO()
+    bgzf.write_bgzf(big, out, block_data=97)
+    blocks = list(bgzf.iter_blocks(BytesIO(out.getvalue())))
+    assert bgzf.is_bgzf(out.getvalue())
+    variants = extract_variants(MockFile(out.getvalue()))
+    assert variants == big_expected
+    print(f"BGZF VCF: {len(variants)} variants from {len(blocks)} blocks")
+
+    # Blocks are decompressed in parallel inside analysis worker processes too
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        count, pooled = pool.submit(parse_in_worker, out.getvalue()).result()
+    assert count == len(big_expected) and pooled
+    print(f"In a worker process: {count} variants, decompression pool used")
+
+    gz = gzip.compress(vcf_content[:200]) + gzip.compress(vcf_content[200:])
+    assert not bgzf.is_bgzf(gz)
+    variants = extract_variants(MockFile(gz))
+    assert variants == expected
+    print(f"Multi-member gzip VCF: {len(variants)} variants")
+
+    # Truncated uploads are errors, not partial results
+    truncated = gzip.compress(vcf_content)
+    truncated = truncated[:len(truncated) // 2]
+    for broken in (truncated, out.getvalue()[:len(out.getvalue()) // 2]):
+        try:
+            extract_variants(MockFile(broken))
+        except (EOFError, zlib.error) as e:
+            print(f"Truncated input rejected: {e}")
+        else:
+            raise AssertionError("truncated input was accepted")
+
+    # Cut off at a block boundary: every block is intact, only the end
+    # marker (and the rest of the file) is missing
+    cut = b"".join(blocks[:2])
+    for parse in (extract_variants, lambda f: list(iter_indexed_variants(f, pharmacogene_regions()))):
+        try:
+            parse(MockFile(cut))
+        except EOFError as e:
+            print(f"Truncated at a block boundary rejected: {e}")
+        else:
+            raise AssertionError("BGZF without its EOF marker was accepted")
+
+    # ... and a 400 from the API
+    import main as app_main
+    from fastapi.testclient import TestClient
+    with TestClient(app_main.app) as client:
+        response = client.post("/analyze", files={"file": ("test.vcf.gz", truncated)}, data={"drug": "CODEINE"})
+        assert response.status_code == 400, (response.status_code, response.text)
+        print(f"/analyze: {response.status_code} {response.json()['detail']}")
+
+        response = client.post("/analyze", files={"file": ("test.vcf.gz", cut)}, data={"drug": "CODEINE"})
+        assert response.status_code == 400, (response.status_code, response.text)
+
+if __name__ == "__main__":
+    main()
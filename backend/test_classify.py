@@ -1,14 +1,9 @@
 from vcf_parser import extract_variants
 from variant_mapper import classify_variants
 
-class MockFile:
-    def read(self):
-        with open('test_sample.vcf', 'rb') as f:
-            return f.read()
-
 class MockUploadFile:
     def __init__(self):
-        self.file = MockFile()
+        self.file = open('test_sample.vcf', 'rb')
 
 file = MockUploadFile()
 variants = extract_variants(file)
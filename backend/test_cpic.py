@@ -3,14 +3,9 @@ from variant_mapper import classify_variants
 from phenotype_engine import infer_phenotypes
 from cpic_engine import apply_cpic_guideline
 
-class MockFile:
-    def read(self):
-        with open('test_sample.vcf', 'rb') as f:
-            return f.read()
-
 class MockUploadFile:
     def __init__(self):
-        self.file = MockFile()
+        self.file = open('test_sample.vcf', 'rb')
 
 file = MockUploadFile()
 variants = extract_variants(file)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# Check star-allele diplotype calling (multi-SNP alleles, phase)
+import time
+from io import BytesIO
+
+from diplotype_engine import AlleleTable, call_diplotype
+from pipeline import analyze_upload
+
+
+def call(rsid, gt):
+    genotype = gt.replace("|", "/")
+    return {"rsid": rsid, "genotype": "0/1" if genotype == "1/0" else genotype, "gt": gt}
+
+
+# *4 carries both core variants; *10 only the first
+table = AlleleTable("CYP2D6", {
+    "*1": [],
+    "*4": ["rs1065852", "rs3892097"],
+    "*10": ["rs1065852"],
+    "*41": ["rs28371725"]
+})
+
+assert table.call([]) == ("*1", "*1")
+assert table.call([call("rs1065852", "0/1"), call("rs3892097", "0/1")]) == ("*1", "*4")
+assert table.call([call("rs1065852", "1/1"), call("rs3892097", "0/1")]) == ("*4", "*10")
+assert table.call([call("rs1065852", "0/1"), call("rs28371725", "0/1")]) == ("*10", "*41")
+
+# Phase decides cis (one *4 haplotype) vs trans
+assert table.call([call("rs1065852", "1|0"), call("rs3892097", "1|0")]) == ("*1", "*4")
+assert table.call([call("rs1065852", "0|1"), call("rs28371725", "1|0")]) == ("*10", "*41")
+print(f"Phased cis: {table.call([call('rs1065852', '1|0'), call('rs3892097', '1|0')])}")
+
+# Knowledge base alleles
+variant = {"rsid": "rs3892097", "allele": "*4", "genotype": "1/1", "gt": "1/1"}
+assert call_diplotype("CYP2D6", [variant]) == "*4/*4"
+assert call_diplotype("CYP2C19", []) == "*1/*1"
+assert call_diplotype("UNKNOWN", [dict(variant, genotype="0/1")]) == "*4/*1"
+
+# Three alt alleles fit no diplotype: indeterminate, not the closest pair
+inconsistent = [
+    {"rsid": "rs4244285", "allele": "*2", "genotype": "0/1", "gt": "0/1"},
+    {"rsid": "rs4986893", "allele": "*3", "genotype": "1/1", "gt": "1/1"}
+]
+assert call_diplotype("CYP2C19", inconsistent) == "Indeterminate"
+assert call_diplotype("UNKNOWN", inconsistent) == "Indeterminate"
+assert table.call([call("rs1065852", "1/1"), call("rs3892097", "1/1"), call("rs28371725", "0/1")]) is None
+
+# Two pairs explaining the calls equally (unphased cis/trans) is no call either
+ambiguous = AlleleTable("AMB", {"*1": [], "*2": ["rs1", "rs2"], "*3": ["rs1"], "*4": ["rs2"]})
+assert ambiguous.call([call("rs1", "0/1"), call("rs2", "0/1")]) is None
+assert ambiguous.call([call("rs1", "1|0"), call("rs2", "1|0")]) == ("*1", "*2")
+
+# A CYP2D6-scale table: 150 alleles over 200 core variants
+core = [f"rs{1000 + i}" for i in range(200)]
+definitions = {"*1": []}
+for k in range(150):
+    definitions[f"*{k + 2}"] = [core[(k * 7 + d * 13) % len(core)] for d in range(1 + k % 3)]
+
+big = AlleleTable("BIG", definitions)
+calls = [call(rsid, "0/1") for rsid in definitions["*5"]]
+calls += [call(rsid, "0/1") for rsid in definitions["*77"] if rsid not in definitions["*5"]]
+
+start = time.perf_counter()
+for _ in range(100):
+    result = big.call(calls)
+elapsed = (time.perf_counter() - start) / 100
+assert result == ("*5", "*77")
+print(f"150-allele table: {result} in {elapsed * 1000:.2f} ms per call")
+
+# Phased VCF calls flow through the pipeline ("1|0" is no longer dropped)
+vcf = (
+    "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n"
+    "chr10\t94781859\trs4244285\tG\tA\t99\tPASS\t.\tGT:DP:GQ\t1|0:40:99\n"
+    "chr10\t94780653\trs4986893\tG\tA\t99\tPASS\t.\tGT:DP:GQ\t0|1:40:99\n"
+)
+analysis = analyze_upload(BytesIO(vcf.encode()), ["CLOPIDOGREL"])
+assert [v.gt for v in analysis["mapped"]] == ["1|0", "0|1"]
+assert analysis["drug_results"]["CLOPIDOGREL"]["diplotype"] == "*2/*3"
+print(f"CLOPIDOGREL: {analysis['drug_results']['CLOPIDOGREL']['diplotype']} ({analysis['phenotypes']['CYP2C19']})")
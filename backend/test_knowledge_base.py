@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# Check the compiled knowledge base (build, mmap reader, reload)
+import json
+import os
+import shutil
+import tempfile
+
+import kb_build
+import knowledge_base
+from knowledge_base import KnowledgeBase, get_kb
+from cpic_engine import apply_cpic_guideline
+import pipeline
+
+genes, variants, guidelines = kb_build.load_sources()
+
+work_dir = tempfile.mkdtemp()
+path = os.path.join(work_dir, "pgx_kb.bin")
+version = kb_build.build(output=path)
+
+kb = KnowledgeBase(path)
+assert kb.version == version == get_kb().version
+assert len(kb.variants) == len(variants) and set(kb.variants) == set(variants)
+assert kb.variants["rs3892097"]["allele"] == "*4"
+assert kb.variants["rs3892097"]["coordinates"]["GRCh38"] == ["22", 42128945, "C", "T"]
+assert "rs1" not in kb.variants and "." not in kb.variants and kb.variants.get("rs16947") is None
+assert kb.critical_genes == frozenset(genes["critical_genes"])
+assert kb.regions["GRCh38"]["CYP2D6"] == ("22", 42120000, 42135000)
+print(f"Loaded {len(kb.variants)} variants, {len(kb.guidelines)} drugs, version {kb.version[:12]}")
+
+# Malformed files and sources are rejected
+with open(os.path.join(work_dir, "bad.bin"), "wb") as f:
+    f.write(b"not a knowledge base")
+try:
+    KnowledgeBase(os.path.join(work_dir, "bad.bin"))
+    raise AssertionError("expected ValueError")
+except ValueError as e:
+    print(f"Rejected: {e}")
+
+try:
+    kb_build.compile_kb(genes, {"CYP2D6*4": variants["rs3892097"]}, guidelines)
+    raise AssertionError("expected ValueError")
+except ValueError as e:
+    print(f"Rejected: {e}")
+
+# Every variant must lie inside its gene's region, or indexed bgzipped
+# uploads (decoded only inside the regions) would never see it
+moved = json.loads(json.dumps(variants))
+moved["rs4986893"]["coordinates"]["GRCh38"][1] = 41978871
+try:
+    kb_build.compile_kb(genes, moved, guidelines)
+    raise AssertionError("expected ValueError")
+except ValueError as e:
+    print(f"Rejected: {e}")
+
+# Replacing the file swaps in the new version without a restart
+source_dir = os.path.join(work_dir, "knowledge")
+shutil.copytree(kb_build.SOURCE_DIR, source_dir)
+guidelines["CODEINE"]["CYP2D6"]["NM"]["recommendation"] = "Standard dosing (updated)"
+with open(os.path.join(source_dir, "cpic_guidelines.json"), "w") as f:
+    json.dump(guidelines, f)
+
+original_path = knowledge_base.PGX_KB_PATH
+knowledge_base.PGX_KB_PATH = path
+try:
+    assert knowledge_base.reload_if_changed().version == version
+    pipeline.derive_results([], ["CODEINE"])
+
+    new_version = kb_build.build(source_dir, path)
+    assert new_version != version
+    assert knowledge_base.reload_if_changed().version == new_version
+    assert apply_cpic_guideline({}, "CODEINE")["CODEINE"]["recommendation"] == "Standard dosing (updated)"
+
+    # Derived results from the old version are dropped
+    result = pipeline.derive_results([], ["CODEINE"])
+    assert result["drug_results"]["CODEINE"]["clinical_recommendation"]["recommendation"] == "Standard dosing (updated)"
+    assert pipeline.result_cache.version == new_version
+    print(f"Reloaded version {new_version[:12]}")
+finally:
+    knowledge_base.PGX_KB_PATH = original_path
+    knowledge_base.reload_if_changed()
+    shutil.rmtree(work_dir)
+
+assert get_kb().version == version
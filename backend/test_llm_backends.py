@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# Check the explanation backends: template, stub server and budget fallback
+import asyncio
+import os
+import threading
+import time
+
+os.environ["LLM_CACHE_PATH"] = ""
+
+import llm_engine
+from llm_stub_server import make_server
+from variant_mapper import VARIANT_DATABASE
+
+variant = dict(VARIANT_DATABASE["rs4244285"], rsid="rs4244285", genotype="0/1")
+
+
+def start_stub(**options):
+    server = make_server(port=0, **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    llm_engine._backends["stub"] = llm_engine.OpenAICompatibleBackend("stub", url, "stub")
+    return server
+
+
+async def main():
+    # Template explanations cite alleles, mechanism and the CPIC action
+    start = time.perf_counter()
+    text = llm_engine.template_explanation("CYP2C19", "IM", "CLOPIDOGREL", [variant])
+    elapsed = time.perf_counter() - start
+    assert "rs4244285 (CYP2C19*2, no function, heterozygous)" in text
+    assert "thiol metabolite" in text and "Recommendation (CPIC Level A)" in text
+    print(f"Template ({elapsed * 1e6:.0f} us): {text}")
+
+    llm_engine.LLM_BACKEND = "template"
+    result = await llm_engine.agenerate_explanation("CYP2D6", "NM", "CODEINE", [])
+    assert "No CYP2D6 variants were detected" in result["explanation_text"]
+
+    # The stub server speaks the OpenAI chat completions API
+    llm_engine.LLM_BACKEND = "stub"
+    server = start_stub(latency=0.05)
+    result = await llm_engine.agenerate_explanation("CYP2C19", "IM", "CLOPIDOGREL", [variant])
+    assert result["explanation_text"] == "Stub explanation for CLOPIDOGREL: CYP2C19 phenotype IM."
+    assert result["variant_citations"] == [{"rsid": "rs4244285", "allele": "*2", "genotype": "0/1"}]
+    print(f"Stub: {result['explanation_text']}")
+    server.shutdown()
+
+    # Over the latency budget the fallback answers; the remote answer is
+    # still cached when it arrives
+    server = start_stub(latency=0.5)
+    llm_engine.LLM_LATENCY_BUDGET_SECONDS = 0.05
+    start = time.perf_counter()
+    result = await llm_engine.agenerate_explanation("TPMT", "PM", "AZATHIOPRINE", [])
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.4 and result["explanation_text"].startswith("TPMT poor metabolizer"), (elapsed, result)
+    print(f"Budget fallback after {elapsed:.2f}s: {result['explanation_text'][:40]}...")
+
+    await asyncio.sleep(0.8)
+    result = await llm_engine.agenerate_explanation("TPMT", "PM", "AZATHIOPRINE", [])
+    assert result["explanation_text"].startswith("Stub explanation"), result
+    server.shutdown()
+
+    # Upstream errors fall back too, or surface as "LLM Error" without a fallback
+    server = start_stub(error_rate=1.0)
+    llm_engine._backends["stub"]._get_clients()[1].max_retries = 0
+    result = await llm_engine.agenerate_explanation("DPYD", "IM", "FLUOROURACIL", [])
+    assert result["explanation_text"].startswith("DPYD intermediate metabolizer")
+
+    llm_engine.LLM_FALLBACK_BACKEND = "none"
+    result = await llm_engine.agenerate_explanation("DPYD", "IM", "FLUOROURACIL", [])
+    assert result["explanation_text"].startswith("LLM Error:")
+    print(f"No fallback: {result['explanation_text'][:40]}...")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
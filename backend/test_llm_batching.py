@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Check micro-batched explanation prompts and per-item fallback
+import asyncio
+import os
+import threading
+
+os.environ["LLM_CACHE_PATH"] = ""
+
+import llm_engine
+import metrics
+from llm_engine import _parse_batch, OpenAICompatibleBackend
+from llm_stub_server import make_server
+
+DRUGS = [
+    ("CYP2D6", "IM", "CODEINE"), ("CYP2C19", "PM", "CLOPIDOGREL"), ("CYP2C9", "NM", "WARFARIN"),
+    ("SLCO1B1", "IM", "SIMVASTATIN"), ("TPMT", "PM", "AZATHIOPRINE"), ("DPYD", "IM", "FLUOROURACIL")
+]
+
+
+class PartialBackend(OpenAICompatibleBackend):
+    # Batched answers are missing the second item; single prompts work
+    def __init__(self):
+        super().__init__("partial", None, "partial")
+        self.batches = []
+        self.singles = []
+
+    async def acomplete_batch(self, requests):
+        self.batches.append(len(requests))
+        return [None if i == 1 else f"batched {drug}" for i, (_, _, drug, _) in enumerate(requests)]
+
+    async def acomplete(self, gene, phenotype, drug, variants_for_gene):
+        self.singles.append(drug)
+        return f"single {drug}"
+
+
+class FailingBackend(PartialBackend):
+    async def acomplete_batch(self, requests):
+        raise RuntimeError("upstream unavailable")
+
+
+async def main():
+    # Answers are matched by id; anything unusable is None
+    assert _parse_batch('[{"id": 2, "explanation": "b"}, {"id": 1, "explanation": "a"}]', 2) == ["a", "b"]
+    assert _parse_batch('```json\n[{"id": 1, "explanation": "a"}]\n```', 2) == ["a", None]
+    assert _parse_batch('[{"id": 1, "explanation": ""}, {"id": 9, "explanation": "x"}, "c"]', 3) == [None, None, "c"]
+    assert _parse_batch("Sorry, I cannot help with that.", 2) == [None, None]
+    assert _parse_batch('[{"id": 1, "explanation": "a"', 1) == [None]
+
+    # A six-drug analysis makes one completion instead of six
+    server = make_server(port=0, latency=0.05)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    llm_engine._backends["stub"] = OpenAICompatibleBackend("stub", url, "stub")
+    llm_engine.LLM_BACKEND = "stub"
+
+    results = await llm_engine.generate_explanations([(gene, phenotype, drug, []) for gene, phenotype, drug in DRUGS])
+    calls = metrics.registry.value(metrics.LLM_CALLS, backend="stub", outcome="ok")
+    assert calls == 1, calls
+    for (gene, phenotype, drug), result in zip(DRUGS, results):
+        assert result["explanation_text"] == f"Stub explanation for {drug}: {gene} phenotype {phenotype}."
+    print(f"{len(DRUGS)} explanations in {calls} completion")
+    server.shutdown()
+
+    # A bad item is re-requested on its own; the rest of the batch stands
+    backend = llm_engine._backends["stub"] = PartialBackend()
+    results = await llm_engine.generate_explanations([(gene, "IM", drug, []) for gene, _, drug in DRUGS[:4]])
+    assert backend.batches == [4] and backend.singles == ["CLOPIDOGREL"]
+    assert [r["explanation_text"] for r in results] == [
+        "batched CODEINE", "single CLOPIDOGREL", "batched WARFARIN", "batched SIMVASTATIN"
+    ]
+    assert metrics.registry.value(metrics.LLM_BATCH_ITEMS, result="invalid") == 1
+    print(f"Per-item fallback: {[r['explanation_text'] for r in results]}")
+
+    # A failed batch falls back for every item
+    llm_engine._backends["stub"] = FailingBackend()
+    results = await llm_engine.generate_explanations([(gene, "PM", drug, []) for gene, _, drug in DRUGS[4:]])
+    assert all(r["explanation_text"].startswith(gene) for (gene, _, _), r in zip(DRUGS[4:], results))
+    print(f"Failed batch: {results[0]['explanation_text'][:40]}...")
+
+    # max_items bounds the batch size
+    backend = llm_engine._backends["stub"] = PartialBackend()
+    llm_engine.batcher.max_items = 2
+    await llm_engine.generate_explanations([(gene, "UM", drug, []) for gene, _, drug in DRUGS])
+    assert backend.batches == [2, 2, 2]
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
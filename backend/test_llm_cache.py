@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# Check the LLM explanation cache (no API calls are made)
+import os
+import tempfile
+import time
+from llm_cache import ExplanationCache, make_key
+
+path = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+
+variants = [
+    {"rsid": "rs4244285", "allele": "*2", "genotype": "0/1"},
+    {"rsid": "rs4986893", "allele": "*3", "genotype": "1/1"},
+]
+key = make_key("CYP2C19", "PM", "CLOPIDOGREL", variants, "model-a", "1")
+
+# Canonical key: variant order and extra fields don't matter; model/prompt do
+assert key == make_key("CYP2C19", "PM", "CLOPIDOGREL", [dict(v, dp=10) for v in reversed(variants)], "model-a", "1")
+assert key != make_key("CYP2C19", "PM", "CLOPIDOGREL", variants, "model-b", "1")
+assert key != make_key("CYP2C19", "PM", "CLOPIDOGREL", variants, "model-a", "2")
+print(f"Key: {key[:16]}...")
+
+value = {"explanation_text": "cached text", "variant_citations": variants}
+cache = ExplanationCache(path=path, max_entries=2, ttl=60)
+assert cache.get(key) is None
+cache.set(key, value)
+assert cache.get(key) == value
+
+# A fresh instance (another worker) is served from the SQLite tier
+other = ExplanationCache(path=path, max_entries=2, ttl=60)
+assert other.get(key) == value
+print(f"Disk tier stats: {other.stats()}")
+
+# LRU eviction keeps the memory tier bounded
+memory_only = ExplanationCache(path=None, max_entries=2, ttl=60)
+for i in range(5):
+    memory_only.set(f"k{i}", {"explanation_text": str(i)})
+assert memory_only.get("k0") is None and memory_only.get("k4") is not None
+print(f"Memory tier stats: {memory_only.stats()}")
+
+# TTL expiry in both tiers
+short = ExplanationCache(path=path, max_entries=2, ttl=0.05)
+short.set("expiring", value)
+time.sleep(0.1)
+assert short.get("expiring") is None
+assert ExplanationCache(path=path, ttl=60).get("expiring") is None
+print("Expired entries are not served")
+
+# The async path keeps SQLite off the event loop: a writer holding the
+# database lock delays aset, but not other coroutines
+import asyncio
+import sqlite3
+
+
+async def locked_write():
+    blocker = sqlite3.connect(path)
+    blocker.execute("BEGIN IMMEDIATE")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    async def release():
+        await asyncio.sleep(0.3)
+        blocker.commit()
+
+    task = asyncio.create_task(ticker())
+    await asyncio.gather(cache.aset("async", value), release())
+    task.cancel()
+    blocker.close()
+
+    assert await ExplanationCache(path=path, ttl=60).aget("async") == value
+    return ticks
+
+
+ticks = asyncio.run(locked_write())
+assert ticks > 10, ticks
+print(f"Event loop ticks while SQLite was locked: {ticks}")
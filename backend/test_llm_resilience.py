@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# Check LLM retries, rate limiting, deadlines and the circuit breaker
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+os.environ["LLM_CACHE_PATH"] = ""
+
+import llm_engine
+import llm_resilience
+import metrics
+from llm_engine import OpenAICompatibleBackend
+from llm_resilience import CircuitBreaker, TokenBucket, backoff_delay, is_retryable
+from llm_stub_server import make_server
+
+
+class StatusError(Exception):
+    # Shaped like the SDK's API errors
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status_code = status
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+class FlakyBackend(OpenAICompatibleBackend):
+    # Raises the queued errors first, then answers
+    def __init__(self, errors=()):
+        super().__init__("flaky", None, "flaky")
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def acomplete(self, gene, phenotype, drug, variants_for_gene):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"remote {drug}"
+
+    def complete(self, gene, phenotype, drug, variants_for_gene, timeout):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return f"remote {drug}"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fallbacks(reason):
+    return metrics.registry.value(metrics.LLM_FALLBACKS, reason=reason)
+
+
+async def main():
+    llm_resilience.LLM_RETRY_BASE_SECONDS = 0.01
+
+    # Rate limits and server errors are retried, client errors are not
+    assert is_retryable(StatusError(429)) and is_retryable(StatusError(503)) and is_retryable(ConnectionError())
+    assert not is_retryable(StatusError(400)) and not is_retryable(RuntimeError("bad"))
+    assert all(0 <= backoff_delay(attempt, base=1, cap=3) <= min(3, 2 ** attempt) for attempt in range(6))
+
+    # Token bucket: the burst goes out at once, then one token per 1/rate seconds
+    clock = Clock()
+    bucket = TokenBucket(rate=2, burst=2, clock=clock)
+    assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.5, 1.0]
+    clock.now = 2.0
+    assert bucket.reserve() == 0
+    assert TokenBucket(rate=0).reserve() == 0
+
+    # Breaker: opens after N failures, lets one trial through after the reset
+    breaker = CircuitBreaker(failures=2, reset_seconds=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    clock.now += 10
+    assert breaker.state == "half_open" and breaker.allow() and not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+    print("Backoff, token bucket and breaker states OK")
+
+    # A retryable error is retried and the caller gets the remote answer
+    llm_engine.LLM_BACKEND = "flaky"
+    backend = llm_engine._backends["flaky"] = FlakyBackend([StatusError(429), StatusError(503)])
+    result = await llm_engine.agenerate_explanation("CYP2D6", "IM", "CODEINE", [])
+    assert result["explanation_text"] == "remote CODEINE" and backend.calls == 3
+    assert metrics.registry.value(metrics.LLM_RETRIES, backend="flaky") == 2
+    print(f"Retried twice: {result['explanation_text']}")
+
+    # A client error is not
+    backend = llm_engine._backends["flaky"] = FlakyBackend([StatusError(400)])
+    result = await llm_engine.agenerate_explanation("CYP2C19", "PM", "CLOPIDOGREL", [])
+    assert backend.calls == 1 and result["explanation_text"].startswith("CYP2C19 poor metabolizer")
+
+    # Retry-After is honoured, but never past the call's deadline
+    backend = llm_engine._backends["flaky"] = FlakyBackend([StatusError(429, retry_after="30")])
+    start = time.perf_counter()
+    result = await llm_engine.agenerate_explanation("CYP2C9", "IM", "WARFARIN", [], timeout=0.2)
+    elapsed = time.perf_counter() - start
+    assert elapsed < 0.5 and result["explanation_text"].startswith("CYP2C9"), (elapsed, result)
+    print(f"Deadline held at {elapsed:.2f}s despite Retry-After: 30")
+
+    # Calls are paced by the backend's token bucket
+    backend = llm_engine._backends["flaky"] = FlakyBackend()
+    backend.rate_limiter = TokenBucket(rate=20, burst=1)
+    start = time.perf_counter()
+    for drug in ("SIMVASTATIN", "AZATHIOPRINE", "FLUOROURACIL"):
+        await llm_engine.agenerate_explanation("SLCO1B1", "NM", drug, [])
+    elapsed = time.perf_counter() - start
+    assert elapsed >= 0.09, elapsed
+    print(f"3 calls at 20/s took {elapsed:.2f}s")
+
+    # The blocking entry point is retried and paced the same way
+    backend = llm_engine._backends["flaky"] = FlakyBackend([StatusError(503)])
+    backend.rate_limiter = TokenBucket(rate=20, burst=1)
+    result = llm_engine.generate_explanation("CYP3A5", "PM", "TACROLIMUS", [])
+    assert result["explanation_text"] == "remote TACROLIMUS" and backend.calls == 2
+    start = time.perf_counter()
+    for drug in ("SIMVASTATIN", "AZATHIOPRINE"):
+        llm_engine.generate_explanation("SLCO1B1", "IM", drug, [])
+    assert time.perf_counter() - start >= 0.09
+    backend = llm_engine._backends["flaky"] = FlakyBackend([StatusError(400)])
+    result = llm_engine.generate_explanation("CYP2C19", "IM", "CLOPIDOGREL", [])
+    assert backend.calls == 1 and result["explanation_text"].startswith("CYP2C19")
+    print("Blocking path: 503 retried, calls paced, 400 not retried")
+
+    # Against a failing upstream (the stub answering 503) each call is
+    # retried, then the breaker opens and calls skip the upstream entirely
+    server = make_server(port=0, error_rate=1.0, error_status=503)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    backend = llm_engine._backends["stub"] = OpenAICompatibleBackend("stub", url, "stub")
+    backend.breaker = CircuitBreaker(failures=2, reset_seconds=0.3)
+    llm_engine.LLM_BACKEND = "stub"
+
+    for phenotype in ("PM", "IM"):
+        result = await llm_engine.agenerate_explanation("TPMT", phenotype, "AZATHIOPRINE", [])
+        assert result["explanation_text"].startswith("TPMT"), result
+    retries = metrics.registry.value(metrics.LLM_RETRIES, backend="stub")
+    assert retries == 2 * llm_resilience.LLM_MAX_RETRIES, retries
+    assert llm_engine.circuit_state() == "open"
+
+    errors = metrics.registry.value(metrics.LLM_CALLS, backend="stub", outcome="error")
+    start = time.perf_counter()
+    results = await llm_engine.generate_explanations([("DPYD", p, "FLUOROURACIL", []) for p in ("PM", "IM", "NM")])
+    elapsed = time.perf_counter() - start
+    assert all(r["explanation_text"].startswith("DPYD") for r in results)
+    assert metrics.registry.value(metrics.LLM_CALLS, backend="stub", outcome="error") == errors
+    assert fallbacks("circuit_open") == 3
+    print(f"Circuit open: 3 fallbacks in {elapsed * 1000:.1f} ms, no upstream calls")
+    server.shutdown()
+
+    # After the reset time a successful trial call closes it again
+    await asyncio.sleep(0.3)
+    backend._clients = None
+    backend.base_url = start_healthy_stub()
+    result = await llm_engine.agenerate_explanation("DPYD", "PM", "FLUOROURACIL", [])
+    assert result["explanation_text"] == "Stub explanation for FLUOROURACIL: DPYD phenotype PM."
+    assert llm_engine.circuit_state() == "closed"
+    print(f"Recovered: {result['explanation_text']}")
+
+
+def start_healthy_stub():
+    server = make_server(port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
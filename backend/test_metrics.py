@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# Check stage timing histograms, counters and the /metrics text format
+import asyncio
+from io import BytesIO
+
+import metrics
+import workers
+from metrics import registry, STAGE_SECONDS, PARSED_BYTES, CACHE_LOOKUPS
+from pipeline import analyze_upload
+
+
+def stage_count(stage):
+    return registry.value(STAGE_SECONDS, stage=stage)
+
+
+async def main():
+    content = open('test_variants.vcf', 'rb').read()
+
+    # Histogram buckets are cumulative and end with +Inf
+    local = metrics.Registry()
+    for seconds in (0.0002, 0.003, 0.003, 42):
+        local.observe(STAGE_SECONDS, seconds, stage="demo")
+    local.inc(CACHE_LOOKUPS, cache="demo", result="hit")
+    text = local.render({"demo_gauge": ("Demo", 3)})
+    assert 'pharmaguard_stage_seconds_bucket{stage="demo",le="0.0005"} 1' in text
+    assert 'pharmaguard_stage_seconds_bucket{stage="demo",le="0.005"} 3' in text
+    assert 'pharmaguard_stage_seconds_bucket{stage="demo",le="+Inf"} 4' in text
+    assert 'pharmaguard_stage_seconds_count{stage="demo"} 4' in text
+    assert '# TYPE pharmaguard_cache_lookups_total counter' in text and "demo_gauge 3" in text
+    print(f"Rendered {len(text.splitlines())} lines")
+
+    # Every deterministic stage is timed once per analysis
+    analyze_upload(BytesIO(content), ["CODEINE"])
+    for stage in ("parse", "classify", "phenotype", "cpic", "confidence", "diplotype"):
+        assert stage_count(stage) == 1, stage
+    assert registry.value(PARSED_BYTES) == len(content)
+
+    # A repeat genotype is a result cache hit and skips the derived stages
+    analyze_upload(BytesIO(content), ["CODEINE"])
+    assert stage_count("parse") == 2 and stage_count("phenotype") == 1
+    hits = registry.value(CACHE_LOOKUPS, cache="result", result="hit")
+    misses = registry.value(CACHE_LOOKUPS, cache="result", result="miss")
+    assert (hits, misses) == (1, 1)
+    print(f"Result cache: {hits} hit, {misses} miss")
+
+    # Timings recorded in worker processes are merged into this process
+    workers.ANALYSIS_WORKERS = 2
+    workers.ANALYSIS_THREAD_MAX_BYTES = 0
+    await workers.run_upload(analyze_upload, BytesIO(content), ["WARFARIN"])
+    workers.shutdown()
+    assert stage_count("parse") == 3 and stage_count("upload_spool") == 1
+    assert registry.value(PARSED_BYTES) == 3 * len(content)
+    print(f"Parsed bytes after process pool run: {registry.value(PARSED_BYTES)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -47,3 +47,26 @@ for test in test_cases:
         print(f"    {drug}: {gene} -> {risk}")
 
 print("\n" + "="*60)
+
+# Diplotype and phenotype come from the same call, including
+# indeterminate ones (CYP2C19 *2 het + *3 hom in the sample VCFs)
+from pipeline import analyze_upload
+from phenotype_engine import activity_tables
+
+for path in ("test_sample.vcf", "../frontend/public/sample.vcf"):
+    with open(path, "rb") as f:
+        analysis = analyze_upload(f, ["CLOPIDOGREL", "CODEINE", "AZATHIOPRINE", "SIMVASTATIN"])
+
+    for drug, result in analysis["drug_results"].items():
+        gene, diplotype, phenotype = result["primary_gene"], result["diplotype"], result["phenotype"]
+
+        if diplotype == "Indeterminate":
+            assert phenotype == "Indeterminate", (path, drug, phenotype)
+        else:
+            table = activity_tables()[gene]
+            a, b = (table.alleles.names.index(name) for name in diplotype.split("/"))
+            assert phenotype == str(table.labels[table.pair_codes[a, b]]), (path, drug, diplotype, phenotype)
+
+    clopidogrel = analysis["drug_results"]["CLOPIDOGREL"]
+    assert clopidogrel["diplotype"] == clopidogrel["phenotype"] == "Indeterminate"
+    print(f"{path}: CLOPIDOGREL {clopidogrel['diplotype']} -> {clopidogrel['risk_assessment']['risk_label']}")
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# Check coordinate-based annotation of VCF lines without rsIDs
+from io import BytesIO
+
+from position_index import PositionIndex
+from variant_mapper import PGX_POSITIONS, build_position_index, VARIANT_DATABASE
+from vcf_parser import detect_build
+from pipeline import classify_upload, analyze_cohort_upload, debug_parse
+
+index = PositionIndex([
+    ("chr1", 300, "A", "G", "c"),
+    ("1", 100, "C", "T", "a"),
+    ("1", 200, "G", "A", "b"),
+    ("1", 200, "G", "C", "b2"),
+])
+assert len(index) == 4
+assert index.lookup("1", 200, "G", "C") == "b2"
+assert index.lookup("chr1", 200, "G", "T,A") == "b"
+assert index.lookup("1", 200, "T", "A") is None
+assert index.lookup("2", 100) is None and not index.has_position("1", 150)
+assert [row[0] for row in index.overlapping("CHR1", 150, 300)] == [200, 200, 300]
+
+# match() also says which ALT of a multi-allelic row is the annotated one
+assert index.match("1", 200, "G", "T,A") == ("b", 2)
+assert index.match("1", 100, "C", "T") == ("a", 1)
+
+# Each build is indexed on its own: a position never matches across builds
+grch38 = build_position_index(VARIANT_DATABASE, "GRCh38")
+assert grch38.lookup("chr10", 94781859, "G", "A") == "rs4244285"
+assert grch38.lookup("10", 96541616, "G", "A") is None
+assert PGX_POSITIONS.for_build("GRCh37").lookup("10", 96541616, "G", "A") == "rs4244285"
+assert PGX_POSITIONS.for_build().lookup("10", 96541616, "G", "A") is None
+assert PGX_POSITIONS.for_build("GRCh37").lookup("10", 94781859, "G", "A") is None
+print(f"Indexed positions: {len(PGX_POSITIONS)} ({len(grch38)} on GRCh38)")
+
+# The build comes from the header
+assert detect_build("##reference=file:///refs/human_g1k_v37.fasta") == "GRCh37"
+assert detect_build("##reference=GRCh38") == "GRCh38"
+assert detect_build("##contig=<ID=chr1,length=248956422>") == "GRCh38"
+assert detect_build("##contig=<ID=1,length=249250621,assembly=b37>") == "GRCh37"
+assert detect_build("##contig=<ID=chr2,length=242193529>") is None
+
+header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n"
+rows = [
+    "chr10\t94781859\t.\tG\tA\t99\tPASS\t.\tGT:DP:GQ\t0/1:40:99",   # CYP2C19*2, no rsID
+    "chr22\t42128945\t.\tC\tT\t99\tPASS\t.\tGT:DP:GQ\t1|1:35:95",   # CYP2D6*4, no rsID
+    "chr10\t94781859\t.\tG\tC\t99\tPASS\t.\tGT:DP:GQ\t0/1:40:99",   # wrong ALT
+    "chr10\t94781000\t.\tG\tA\t99\tPASS\t.\tGT:DP:GQ\t0/1:40:99",   # unknown position
+    "chr22\t42128945\trs16947\tC\tT\t99\tPASS\t.\tGT:DP:GQ\t0/1:35:95",  # explicit rsID wins
+]
+content = (header + "\n".join(rows) + "\n").encode()
+
+classification = classify_upload(BytesIO(content))
+found = [(v.rsid, v.genotype, v.chrom, v.pos) for v in classification["recognized_pgx_variants"]]
+print(f"Recognized: {found}")
+assert found == [
+    ("rs4244285", "0/1", "chr10", 94781859),
+    ("rs3892097", "1/1", "chr22", 42128945),
+]
+# Every data row is scanned, recognized or not
+assert classification["total_variants_scanned"] == len(rows)
+
+cohort = analyze_cohort_upload(BytesIO(content), ["CLOPIDOGREL"])
+assert cohort["results"]["S1"]["phenotypes"]["CYP2C19"] == "IM"
+assert cohort["results"]["S1"]["phenotypes"]["CYP2D6"] == "PM"
+assert cohort["total_variants_scanned"] == debug_parse(BytesIO(content))["total_variants_scanned"] == len(rows)
+print(f"Cohort phenotypes: CYP2C19={cohort['results']['S1']['phenotypes']['CYP2C19']}, CYP2D6={cohort['results']['S1']['phenotypes']['CYP2D6']}")
+
+# Multi-allelic rows: only the annotated ALT counts (CYP2C19*2 is G>A)
+rows = [
+    "chr10\t94781859\t.\tG\tA,C\t99\tPASS\t.\tGT:DP:GQ\t0/2:40:99\t1/2:40:99\t0/1:40:99",   # *2 is ALT 1
+    "chr22\t42128945\t.\tC\tG,T\t99\tPASS\t.\tGT:DP:GQ\t0/1:35:95\t2|2:35:95\t1/2:35:95",  # *4 is ALT 2
+]
+cohort_header = header.replace("\tS1\n", "\tS1\tS2\tS3\n")
+multi = (cohort_header + "\n".join(rows) + "\n").encode()
+
+for sample, expected in (("S1", []), ("S2", [("rs4244285", "0/1"), ("rs3892097", "1/1")]), ("S3", [("rs4244285", "0/1"), ("rs3892097", "0/1")])):
+    single = multi.decode().replace("\tS1\tS2\tS3\n", f"\t{sample}\n")
+    column = {"S1": 9, "S2": 10, "S3": 11}[sample]
+    single = "\n".join(
+        "\t".join(line.split("\t")[:9] + [line.split("\t")[column]]) if not line.startswith("#") and line else line
+        for line in single.split("\n")
+    ).encode()
+    found = [(v.rsid, v.genotype) for v in classify_upload(BytesIO(single))["recognized_pgx_variants"]]
+    assert found == expected, (sample, found)
+
+    detected = analyze_cohort_upload(BytesIO(multi), ["CLOPIDOGREL"])["results"][sample]["detected_variants"]
+    assert [(v["rsid"], v["genotype"]) for v in detected] == expected, (sample, detected)
+print("Multi-allelic rows: genotypes count only the annotated ALT")
+
+# A GRCh37 file is annotated with GRCh37 coordinates, and only those
+grch37 = (
+    "##fileformat=VCFv4.2\n##reference=hg19\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\n"
+    "10\t96541616\t.\tG\tA\t99\tPASS\t.\tGT\t0/1\n"
+    "chr10\t94781859\t.\tG\tA\t99\tPASS\t.\tGT\t0/1\n"
+).encode()
+found = [(v.rsid, v.pos) for v in classify_upload(BytesIO(grch37))["recognized_pgx_variants"]]
+assert found == [("rs4244285", 96541616)], found
+print(f"GRCh37 header: {found}")
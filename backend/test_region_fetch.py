@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# Check tabix-driven pharmacogene region fetch against a full parse
+import os
+import tempfile
+from io import BytesIO
+
+os.environ["VCF_INDEX_CACHE_DIR"] = tempfile.mkdtemp()
+
+import bgzf
+import vcf_index
+from vcf_parser import extract_variants, iter_indexed_variants
+from variant_mapper import pharmacogene_regions
+
+class MockFile:
+    def __init__(self, content):
+        self.file = BytesIO(content)
+
+def main():
+    with open("../TC_P1_PATIENT_001_Normal.vcf", "rb") as f:
+        vcf_content = f.read()
+
+    # Pad with off-panel records so most blocks don't overlap a pharmacogene
+    header, body = vcf_content.split(b"#CHROM", 1)
+    columns, records = body.split(b"\n", 1)
+    filler = b"".join(
+        b"chr2\t%d\trs9%07d\tA\tG\t99\tPASS\t.\tGT:DP:GQ\t0/1:40:99\n" % (1000 + i * 50, i)
+        for i in range(20000)
+    )
+    vcf_content = header + b"#CHROM" + columns + b"\n" + filler + records
+
+    out = BytesIO()
+    bgzf.write_bgzf(vcf_content, out, block_data=4096)
+    compressed = out.getvalue()
+
+    regions = pharmacogene_regions()
+    keep = vcf_index.region_filter(regions)
+    expected = [
+        v for v, line in zip(
+            extract_variants(MockFile(vcf_content)),
+            [l for l in vcf_content.decode().splitlines() if not l.startswith("#")]
+        ) if keep(line)
+    ]
+    print(f"Full parse: {len(extract_variants(MockFile(vcf_content)))} variants, {len(expected)} in pharmacogene regions")
+
+    # First upload: full pass, index built and cached
+    first = list(iter_indexed_variants(MockFile(compressed), regions))
+    assert first == expected
+    print(f"First upload (index built): {len(first)} variants")
+
+    # Re-upload of the same bytes: served from the cached index
+    digest = vcf_index.file_digest(BytesIO(compressed))
+    index = vcf_index.load_cached_index(digest)
+    assert index is not None
+    second = list(iter_indexed_variants(MockFile(compressed), regions))
+    assert second == expected
+    print(f"Cached index: {len(second)} variants")
+
+    # A damaged cache entry is a miss: the file is dropped and rebuilt
+    path = os.path.join(vcf_index.INDEX_CACHE_DIR, f"{digest}.tbi")
+    with open(path, "rb") as f:
+        cached = f.read()
+    with open(path, "wb") as f:
+        f.write(cached[:len(cached) // 2])
+    assert vcf_index.load_cached_index(digest) is None and not os.path.exists(path)
+    assert list(iter_indexed_variants(MockFile(compressed), regions)) == expected
+    assert vcf_index.load_cached_index(digest) is not None
+    assert not [name for name in os.listdir(vcf_index.INDEX_CACHE_DIR) if name.endswith(".tmp")]
+    print("Truncated cached index: rebuilt")
+
+    # The cache directory is kept private; a shared one is tightened
+    assert os.stat(vcf_index.INDEX_CACHE_DIR).st_mode & 0o777 == 0o700
+    shared = tempfile.mkdtemp()
+    os.chmod(shared, 0o777)
+    vcf_index.INDEX_CACHE_DIR, vcf_index._cache_checked = shared, False
+    vcf_index.save_cached_index(digest, index)
+    assert os.stat(shared).st_mode & 0o777 == 0o700 and vcf_index.load_cached_index(digest) is not None
+
+    # Explicit .tbi upload
+    tbi = index.to_tbi()
+    third = list(iter_indexed_variants(MockFile(compressed), regions, index_file=BytesIO(tbi)))
+    assert third == expected
+    print(f"Uploaded .tbi ({len(tbi)} bytes): {len(third)} variants")
+
+    total_blocks = len(list(bgzf.iter_blocks(BytesIO(compressed))))
+    chunks = []
+    for chrom, start, end in regions:
+        chunks.extend(index.chunks(chrom, start - 1, end))
+    touched = {offset >> 16 for chunk in chunks for offset in chunk}
+    print(f"Blocks touched: ~{len(touched)} of {total_blocks}")
+
+    # The scanned count is labelled with its scope: every row for plain
+    # text, only the pharmacogene regions for indexed bgzipped uploads
+    from pipeline import classify_upload, quality_metrics, analyze_classification
+    plain = classify_upload(BytesIO(vcf_content))
+    indexed = classify_upload(BytesIO(compressed))
+    assert plain["variants_scanned_scope"] == "all_rows" and plain["vcf_parsing_success"]
+    assert indexed["variants_scanned_scope"] == "pharmacogene_regions" and indexed["vcf_parsing_success"]
+    assert plain["total_variants_scanned"] > indexed["total_variants_scanned"]
+    for classification in (plain, indexed):
+        metrics = quality_metrics(analyze_classification(classification, ["CODEINE"]))
+        print(f"Scanned {metrics['total_variants_scanned']} ({metrics['variants_scanned_scope']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Check memoization of derived results by genotype fingerprint
+from records import PgxVariant
+from result_cache import fingerprint, knowledge_base_version
+import pipeline
+
+
+def patient(dp):
+    return [
+        PgxVariant("rs4244285", "CYP2C19", "*2", "loss_of_function", "1/1", dp, 99, "PASS"),
+        PgxVariant("rs3892097", "CYP2D6", "*4", "loss_of_function", "0/1", 45, 95, "PASS"),
+    ]
+
+
+drugs = ["CLOPIDOGREL", "CODEINE"]
+
+# Same quality buckets -> same key, regardless of variant order
+assert fingerprint(patient(40), drugs) == fingerprint(list(reversed(patient(55))), drugs)
+# Crossing a bucket boundary or changing drugs changes the key
+assert fingerprint(patient(40), drugs) != fingerprint(patient(20), drugs)
+assert fingerprint(patient(40), drugs) != fingerprint(patient(40), drugs[:1])
+
+cache = pipeline.result_cache
+cache.invalidate()
+before = cache.stats()
+
+first = pipeline.derive_results(patient(40), drugs)
+second = pipeline.derive_results(patient(55), drugs)
+after = cache.stats()
+assert after["hits"] - before["hits"] == 1 and after["misses"] - before["misses"] == 1
+assert first["drug_results"] == second["drug_results"]
+print(f"CLOPIDOGREL: {second['drug_results']['CLOPIDOGREL']['diplotype']} -> {second['drug_results']['CLOPIDOGREL']['risk_assessment']['risk_label']}")
+
+# Hits are independent copies that carry the patient's own variants
+second["drug_results"]["CLOPIDOGREL"]["llm_generated_explanation"] = {"summary": "x"}
+assert pipeline.derive_results(patient(40), drugs)["drug_results"]["CLOPIDOGREL"]["llm_generated_explanation"] == {}
+assert second["llm_requests"][0][1][3][0].dp == 55
+
+# Uncached computation agrees with the memo
+cache.invalidate()
+fresh = pipeline.derive_results(patient(55), drugs)
+assert fresh["phenotypes"] == first["phenotypes"] and fresh["confidence"] == first["confidence"]
+
+# Entries made under another knowledge base version are dropped
+assert cache.version == knowledge_base_version()
+print(f"KB version: {cache.version[:12]}, entries: {cache.stats()['entries']}")
+cache.version = "reloaded"
+assert cache.get(fingerprint(patient(55), drugs)) is None
+assert cache.stats()["entries"] == 0 and cache.version == knowledge_base_version()
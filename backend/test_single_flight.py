@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# Check that identical in-flight explanation calls are coalesced
+import asyncio
+import os
+import threading
+
+os.environ["LLM_CACHE_PATH"] = ""
+
+import llm_engine
+import metrics
+from llm_engine import SingleFlight
+from llm_stub_server import make_server
+
+
+async def main():
+    # 50 identical requests during a burst make one upstream call
+    server = make_server(port=0, latency=0.2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    llm_engine._backends["stub"] = llm_engine.OpenAICompatibleBackend("stub", url, "stub")
+    llm_engine.LLM_BACKEND = "stub"
+
+    request = ("CYP2C19", "NM", "CLOPIDOGREL", [])
+    results = await asyncio.gather(*(llm_engine.agenerate_explanation(*request) for _ in range(50)))
+    upstream = metrics.registry.value(metrics.LLM_CALLS, backend="stub", outcome="ok")
+    assert upstream == 1 and len({r["explanation_text"] for r in results}) == 1
+    assert llm_engine.in_flight.coalesced == 49 and len(llm_engine.in_flight) == 0
+    print(f"50 callers -> {upstream} upstream call, {llm_engine.in_flight.coalesced} coalesced")
+
+    # Different requests are not coalesced
+    results = await asyncio.gather(*(llm_engine.agenerate_explanation(gene, "IM", drug, []) for gene, drug in [
+        ("CYP2D6", "CODEINE"), ("TPMT", "AZATHIOPRINE"), ("DPYD", "FLUOROURACIL")
+    ]))
+    assert len({r["explanation_text"] for r in results}) == 3 and llm_engine.in_flight.coalesced == 49
+    server.shutdown()
+
+    # One cancelled caller leaves the shared call running for the others
+    flights = SingleFlight()
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.1)
+        return "done"
+
+    first = asyncio.ensure_future(flights.wait("k", call))
+    second = asyncio.ensure_future(flights.wait("k", call))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "done" and len(started) == 1
+
+    # ...and the call stops once every caller is gone
+    callers = [asyncio.ensure_future(flights.wait("k", call)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    task = flights._flights["k"].task
+    for caller in callers:
+        caller.cancel()
+    await asyncio.sleep(0.01)
+    assert task.cancelled() and len(flights) == 0
+    print("Cancellation: shared call kept for remaining callers, stopped when none are left")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Check that the app boots without an API key or the LLM SDK
+import asyncio
+import os
+import sys
+import time
+
+# Deterministic-only mode, and no key even if .env has one
+os.environ["DETERMINISTIC_ONLY"] = "1"
+os.environ["MISTRAL_API_KEY"] = ""
+
+start = time.perf_counter()
+import main
+import llm_engine
+elapsed = time.perf_counter() - start
+
+from fastapi.testclient import TestClient
+
+# Set directly too, in case another script imported llm_engine first
+llm_engine.DETERMINISTIC_ONLY = True
+
+assert "openai" not in sys.modules
+print(f"Imported main in {elapsed:.2f}s without the OpenAI SDK")
+
+# Startup warms the knowledge base; CPIC results need no LLM
+with TestClient(main.app) as client:
+    content = open('test_variants.vcf', 'rb').read()
+    response = client.post("/analyze", files={"file": ("test.vcf", content)}, data={"drug": "CODEINE"})
+    assert response.status_code == 200, response.text
+    result = response.json()
+    assert result["risk_assessment"]["risk_label"] == "Adjust Dosage"
+    assert "rs3892097 (CYP2D6*4" in result["llm_generated_explanation"]["summary"]
+    print(f"CODEINE: {result['risk_assessment']['risk_label']} / {result['llm_generated_explanation']['summary']}")
+
+    # Derived results are computed off the event loop, both for a new
+    # upload and when its classification comes from the upload cache,
+    # and in the /test-* routes
+    on_loop = []
+
+    def recording(func):
+        def wrapper(*args):
+            try:
+                on_loop.append(asyncio.get_running_loop() is not None)
+            except RuntimeError:
+                on_loop.append(False)
+            return func(*args)
+        return wrapper
+
+    analyze_classification, infer_phenotypes = main.analyze_classification, main.infer_phenotypes
+    main.analyze_classification = recording(analyze_classification)
+    main.infer_phenotypes = recording(infer_phenotypes)
+    for name in ("new.vcf", "again.vcf"):
+        upload = content + b"# 1\n"
+        response = client.post("/analyze", files={"file": (name, upload)}, data={"drug": "CODEINE"})
+        assert response.status_code == 200, response.text
+    for route in ("/test-phenotype", "/test-cpic", "/test-full", "/test-complete"):
+        response = client.post(route, files={"file": ("test.vcf", content)})
+        assert response.status_code == 200, response.text
+    main.analyze_classification, main.infer_phenotypes = analyze_classification, infer_phenotypes
+    assert on_loop == [False] * 6, on_loop
+
+assert "openai" not in sys.modules
+
+# Without a key, explanations report the error instead of failing at import
+llm_engine.DETERMINISTIC_ONLY = False
+llm_engine.LLM_FALLBACK_BACKEND = "none"
+assert llm_engine.warm() is False
+explanation = llm_engine.generate_explanation("CYP2D6", "IM", "CODEINE", [])
+assert explanation["explanation_text"] == "LLM Error: MISTRAL_API_KEY not found in .env"
+print(explanation["explanation_text"])
+llm_engine.LLM_FALLBACK_BACKEND = "template"
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# Check that chunked streaming parsing matches a whole-file parse
+from io import BytesIO
+from vcf_parser import iter_lines, iter_variants, extract_variants
+
+class MockFile:
+    def __init__(self, content):
+        self.file = BytesIO(content)
+
+with open("test_variants.vcf", "rb") as f:
+    vcf_content = f.read()
+
+expected = extract_variants(MockFile(vcf_content))
+print(f"Whole-file parse: {len(expected)} variants")
+
+# Tiny chunks force lines (and CRLF pairs) to straddle chunk boundaries
+for chunk_size in (1, 7, 64, 4096):
+    streamed = list(iter_variants(MockFile(vcf_content), chunk_size=chunk_size))
+    crlf = list(iter_variants(MockFile(vcf_content.replace(b"\n", b"\r\n")), chunk_size=chunk_size))
+    assert streamed == expected, chunk_size
+    assert crlf == expected, chunk_size
+    print(f"  chunk_size={chunk_size}: {len(streamed)} variants (CRLF: {len(crlf)})")
+
+# Multi-byte UTF-8 split across chunk boundaries
+text = "##comment=Müller ✓\nline two\nno newline at end"
+lines = list(iter_lines(MockFile(text.encode("utf-8")), chunk_size=1))
+assert lines == text.splitlines(), lines
+print(f"UTF-8 boundary lines: {lines}")
+
+# rsID prefilter must classify exactly like the full decode
+from variant_mapper import classify_variants, PGX_RSIDS
+
+with open("../TC_P1_PATIENT_001_Normal.vcf", "rb") as f:
+    tc_content = f.read()
+
+full_stats = {}
+full = classify_variants(iter_variants(MockFile(tc_content), stats=full_stats), full_stats)
+stats = {}
+fast = classify_variants(iter_variants(MockFile(tc_content), rsids=PGX_RSIDS, stats=stats), stats)
+assert fast == full, (fast, full)
+print(f"Prefilter: {stats['prefiltered']} lines skipped without full decode, "
+      f"{full['total_variants_scanned']} scanned either way")
+data_rows = sum(1 for line in tc_content.decode().splitlines() if line and not line.startswith("#"))
+assert full["total_variants_scanned"] == data_rows
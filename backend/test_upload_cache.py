@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# Check the upload dedup cache (content hash ids, LRU and disk tier)
+import os
+import tempfile
+from io import BytesIO
+
+from pipeline import classify_upload
+from upload_cache import UploadCache, upload_id, upload_digests, is_upload_id
+
+content = open('test_variants.vcf', 'rb').read()
+
+# Same bytes -> same id; an index upload is part of the id
+first = upload_id(BytesIO(content))
+assert is_upload_id(first) and not is_upload_id("../etc/passwd")
+assert first == upload_id(BytesIO(content))
+assert first != upload_id(BytesIO(content), BytesIO(b"index"))
+assert upload_digests(BytesIO(content)) == (first, first)
+assert upload_digests(BytesIO(content), BytesIO(b"index"))[1] == first
+print(f"Upload id: {first[:16]}...")
+
+# Hashing rewinds the stream, so it can still be parsed
+stream = BytesIO(content)
+upload_id(stream)
+classification = classify_upload(stream)
+assert classify_upload(BytesIO(content), digest=first)["recognized_pgx_variants"] == classification["recognized_pgx_variants"]
+print(f"Classified {len(classification['recognized_pgx_variants'])} PGx variants")
+
+spill_dir = os.path.join(tempfile.mkdtemp(), "uploads")
+cache = UploadCache(max_entries=1, spill_dir=spill_dir)
+cache.set(first, classification)
+assert cache.get(first) is classification
+
+# Entries are written to a private directory on insert, so another
+# server process sharing it resolves the same upload_id
+assert os.stat(spill_dir).st_mode & 0o777 == 0o700
+assert cache.stats()["spills"] == 1
+other_process = UploadCache(spill_dir=spill_dir)
+assert other_process.get(first)["recognized_pgx_variants"] == classification["recognized_pgx_variants"]
+
+# Evicted entries are reloaded from disk on demand
+other = upload_id(BytesIO(b"other"))
+cache.set(other, {"recognized_pgx_variants": []})
+assert cache.stats()["spills"] == 2
+
+restored = cache.get(first)
+assert restored["recognized_pgx_variants"] == classification["recognized_pgx_variants"]
+assert cache.stats()["disk_hits"] == 1
+
+# Re-parsing after a knowledge base reload replaces the stale entry on
+# disk, so other processes stop loading (and rejecting) the old one
+cache.set(other, {"recognized_pgx_variants": [], "kb_version": "old"})
+cache.set(other, {"recognized_pgx_variants": [], "kb_version": "new"})
+assert UploadCache(spill_dir=spill_dir).get(other)["kb_version"] == "new"
+
+# Unknown ids miss; memory-only caches forget evicted entries
+assert cache.get("0" * 64) is None
+memory_only = UploadCache(max_entries=1, spill_dir="")
+memory_only.set(first, classification)
+memory_only.set(other, {})
+assert memory_only.get(first) is None
+
+# A directory other users can write is made private before use
+shared = tempfile.mkdtemp()
+os.chmod(shared, 0o777)
+UploadCache(spill_dir=shared).set(first, {})
+assert os.stat(shared).st_mode & 0o777 == 0o700
+print(f"Stats: {cache.stats()}")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# Check that analysis runs off the event loop with admission control
+import asyncio
+import time
+from io import BytesIO
+
+import workers
+from pipeline import analyze_upload, format_results
+
+
+def slow(source, value):
+    time.sleep(0.2)
+    return value
+
+
+async def main():
+    content = open('test_variants.vcf', 'rb').read()
+
+    # Thread pool path gives the same result as running inline
+    analysis = await workers.run_upload(analyze_upload, BytesIO(content), ["CODEINE"])
+    inline = analyze_upload(BytesIO(content), ["CODEINE"])
+    assert analysis["phenotypes"] == inline["phenotypes"]
+    assert analysis["drug_results"] == inline["drug_results"]
+    result = format_results(analysis, "P1")[0]
+    print(f"CODEINE: {result['pharmacogenomic_profile']['diplotype']} -> {result['risk_assessment']['risk_label']}")
+
+    # The event loop keeps ticking while a job runs
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    await workers.run_upload(slow, BytesIO(b""), None)
+    task.cancel()
+    assert ticks > 5
+    print(f"Event loop ticks during job: {ticks}")
+
+    # Requests beyond the queue limit are rejected, not queued
+    workers.ANALYSIS_MAX_PENDING = 2
+    results = await asyncio.gather(
+        *(workers.run_upload(slow, BytesIO(b""), i) for i in range(4)),
+        return_exceptions=True
+    )
+    rejected = [r for r in results if isinstance(r, workers.Overloaded)]
+    assert len(rejected) == 2 and workers.pending() == 0
+    print(f"Accepted {len(results) - len(rejected)}, rejected {len(rejected)} (Retry-After {rejected[0].retry_after}s)")
+
+    workers.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
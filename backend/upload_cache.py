@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from vcf_index import file_digest
+
+# Classified variant sets keyed by upload content hash.
+# Re-running /analyze on the same VCF (e.g. with another drug) skips
+# parsing entirely, and clients can reference a prior upload by its
+# upload_id instead of re-sending the bytes. Without UPLOAD_CACHE_DIR an
+# upload_id is only known to the server process that parsed it; with it,
+# every entry is also written to that directory on insert, so processes
+# sharing the directory (e.g. uvicorn --workers N) resolve each other's
+# ids and entries evicted from the in-memory LRU stay available. Entries
+# are pickles, so the directory must be private to the server's user: it
+# is created 0700 and ignored if another user owns it.
+
+UPLOAD_CACHE_MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_MAX_ENTRIES", 256))
+UPLOAD_CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR", "")
+UPLOAD_CACHE_DISK_MAX_ENTRIES = int(os.getenv("UPLOAD_CACHE_DISK_MAX_ENTRIES", 10000))
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{64}$")
+
+logger = logging.getLogger("pharmaguard")
+
+
+def upload_digests(file, index_file=None):
+    """
+    (upload id, content hash of the VCF itself). The id covers the index
+    too, if one was sent; without one both are the same. Both streams are
+    rewound afterwards.
+    """
+
+    digest = file_digest(getattr(file, "file", file))
+
+    if index_file is None:
+        return digest, digest
+
+    index_digest = file_digest(getattr(index_file, "file", index_file))
+    return hashlib.sha256(f"{digest}:{index_digest}".encode("ascii")).hexdigest(), digest
+
+
+def upload_id(file, index_file=None):
+    """
+    Content hash identifying an upload (and its index, if one was sent).
+    Both streams are rewound afterwards.
+    """
+
+    return upload_digests(file, index_file)[0]
+
+
+def is_upload_id(value):
+    return bool(value) and _UPLOAD_ID.match(value) is not None
+
+
+class UploadCache:
+    """
+    In-memory LRU of classification results with an optional shared disk
+    tier. Values are stored as given and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=UPLOAD_CACHE_MAX_ENTRIES, spill_dir=UPLOAD_CACHE_DIR,
+                 disk_max_entries=UPLOAD_CACHE_DISK_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.disk_max_entries = disk_max_entries
+
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.spills = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_checked = False
+
+    def _disk_ready(self):
+        # Create the directory private to this user, or refuse to use one
+        # that others can write (its pickles would be loaded blindly)
+        if not self.spill_dir or self._disk_checked:
+            return bool(self.spill_dir)
+
+        try:
+            os.makedirs(self.spill_dir, mode=0o700, exist_ok=True)
+            info = os.stat(self.spill_dir)
+            if info.st_uid != os.getuid():
+                raise PermissionError(f"{self.spill_dir} is owned by another user")
+            if info.st_mode & 0o077:
+                os.chmod(self.spill_dir, 0o700)
+        except OSError as e:
+            logger.warning("upload cache disk tier disabled: %s", e)
+            self.spill_dir = ""
+
+        self._disk_checked = True
+        return bool(self.spill_dir)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{key}.pickle")
+
+    def _spill(self, key, value):
+        # Always overwritten: set() follows a fresh parse, and an entry on
+        # disk may be stale (made under an older knowledge base)
+        if not self._disk_ready():
+            return
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.spill_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._spill_path(key))
+            self.spills += 1
+        except OSError:
+            # Disk tier is optional; dropping the entry is fine
+            return
+
+        if self.spills % 64 == 0:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        try:
+            paths = [
+                os.path.join(self.spill_dir, name)
+                for name in os.listdir(self.spill_dir)
+                if name.endswith(".pickle")
+            ]
+            if len(paths) <= self.disk_max_entries:
+                return
+            paths.sort(key=os.path.getmtime)
+            for path in paths[:len(paths) - self.disk_max_entries]:
+                os.unlink(path)
+        except OSError:
+            pass
+
+    def _load_spilled(self, key):
+        if not self._disk_ready():
+            return None
+
+        path = self._spill_path(key)
+
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        os.utime(path)
+        return value
+
+    def get(self, key):
+        if not is_upload_id(key):
+            return None
+
+        with self._lock:
+            value = self._entries.get(key)
+
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+        if self.spill_dir:
+            value = self._load_spilled(key)
+            if value is not None:
+                self._remember(key, value)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value):
+        # Written through to disk, so other processes can resolve the id
+        self._remember(key, value)
+
+        if self.spill_dir:
+            self._spill(key, value)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "spills": self.spills,
+                "memory_entries": len(self._entries),
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
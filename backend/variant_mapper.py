@@ -1,56 +1,102 @@
-# Curated Pharmacogenomic Variant Database
-# Based on CPIC & PharmVar references (simplified for hackathon)
-
-CRITICAL_GENES = {
-    "CYP2D6",
-    "CYP2C19",
-    "CYP2C9",
-    "SLCO1B1",
-    "TPMT",
-    "DPYD"
+import os
+
+from records import PgxVariant
+from position_index import PositionIndex, BuildPositionIndex
+from knowledge_base import get_kb
+
+# Curated pharmacogenomic variant database, gene list and loci live in the
+# compiled knowledge base (knowledge/*.json -> kb_build.py). These
+# module-level names resolve to the currently loaded version on access.
+
+_KB_NAMES = {
+    "VARIANT_DATABASE": lambda kb: kb.variants,
+    "CRITICAL_GENES": lambda kb: kb.critical_genes,
+    "PHARMACOGENE_REGIONS": lambda kb: kb.regions,
+    "PGX_RSIDS": lambda kb: pgx_rsids(kb),
+    "PGX_POSITIONS": lambda kb: pgx_positions(kb)
 }
 
 
-VARIANT_DATABASE = {
-    "rs4244285": {
-        "gene": "CYP2C19",
-        "allele": "*2",
-        "effect": "loss_of_function"
-    },
-    "rs4986893": {
-        "gene": "CYP2C19",
-        "allele": "*3",
-        "effect": "loss_of_function"
-    },
-    "rs3892097": {
-        "gene": "CYP2D6",
-        "allele": "*4",
-        "effect": "loss_of_function"
-    },
-    "rs4149056": {
-        "gene": "SLCO1B1",
-        "allele": "*5",
-        "effect": "reduced_function"
-    },
-    "rs1142345": {
-        "gene": "TPMT",
-        "allele": "*3A",
-        "effect": "loss_of_function"
-    },
-    "rs3918290": {
-        "gene": "DPYD",
-        "allele": "*2A",
-        "effect": "loss_of_function"
-    }
-}
+# Genome build assumed for coordinates of VCFs whose header names none
+VCF_DEFAULT_BUILD = os.getenv("VCF_DEFAULT_BUILD", "GRCh38")
+
+
+def __getattr__(name):
+    if name in _KB_NAMES:
+        return _KB_NAMES[name](get_kb())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def pgx_rsids(kb=None):
+    """
+    rsIDs worth fully decoding; everything else can be prefiltered by the
+    parser. A plain frozenset, since it is probed for every VCF line.
+    """
+
+    kb = kb or get_kb()
+    return kb.derived("rsids", lambda kb: frozenset(kb.variants))
+
+
+def build_position_index(variant_database, build=None):
+    """
+    CHROM/POS/REF/ALT -> rsID index over the database's "coordinates"
+    (forward strand, 1-based). Without a build, positions from every
+    build are indexed together, as for pharmacogene_regions().
+    """
+
+    records = []
+
+    for rsid, info in variant_database.items():
+        for name, (chrom, pos, ref, alt) in info.get("coordinates", {}).items():
+            if build is None or name == build:
+                records.append((chrom, pos, ref, alt, rsid))
 
+    return PositionIndex(records)
 
-def classify_variants(variants):
+
+def pgx_positions(kb=None):
+    """
+    Position indexes per build; let the parser recognize PGx variants in
+    VCFs with "." in the ID column. The parser picks the build named in
+    the VCF header, or VCF_DEFAULT_BUILD.
+    """
+
+    kb = kb or get_kb()
+    return kb.derived("positions", lambda kb: BuildPositionIndex(kb.position_rows(), VCF_DEFAULT_BUILD))
+
+
+def pharmacogene_regions(build=None):
+    """
+    Regions for the critical genes. Without a build, the union across
+    builds is returned, since VCF headers rarely state the assembly reliably.
+    """
+
+    kb = get_kb()
+    builds = [build] if build else sorted(kb.regions)
+    regions = set()
+
+    for name in builds:
+        for gene, region in kb.regions[name].items():
+            if gene in kb.critical_genes:
+                regions.add(region)
+
+    return sorted(regions)
+
+
+def classify_variants(variants, parse_stats=None):
+
+    kb = get_kb()
+    variant_database = kb.variants
+    critical_genes = kb.critical_genes
 
     recognized = []
     non_pgx_count = 0
+    total = 0
 
+    # Accepts any iterable (e.g. vcf_parser.iter_variants) so classification
+    # can run while the upload is still being parsed
     for variant in variants:
+        total += 1
         rsid = variant["rsid"]
         genotype = variant["genotype"]
         filter_status = variant.get("filter")
@@ -60,34 +106,44 @@ def classify_variants(variants):
             continue
 
         # Check if RSID is in our pharmacogenomic database
-        if rsid in VARIANT_DATABASE and genotype in ["0/1", "1/1"]:
-            variant_info = VARIANT_DATABASE[rsid]
+        if rsid in variant_database and genotype in ["0/1", "1/1"]:
+            variant_info = variant_database[rsid]
             gene = variant_info["gene"]
 
             # Only include if it's a critical pharmacogene
-            if gene in CRITICAL_GENES:
-                recognized.append({
-                    "rsid": rsid,
-                    "gene": gene,
-                    "allele": variant_info["allele"],
-                    "effect": variant_info["effect"],
-                    "genotype": genotype,
-                    "dp": variant.get("dp"),
-                    "gq": variant.get("gq"),
-                    "filter": filter_status
-                })
+            if gene in critical_genes:
+                recognized.append(PgxVariant(
+                    rsid,
+                    gene,
+                    variant_info["allele"],
+                    variant_info["effect"],
+                    genotype,
+                    variant.get("dp"),
+                    variant.get("gq"),
+                    filter_status,
+                    variant.get("chrom"),
+                    variant.get("pos"),
+                    variant.get("gt")
+                ))
         else:
             # Variant not in our database or not present
             non_pgx_count += 1
 
+    # Lines the parser prefiltered on rsID are still scanned non-PGx variants
+    if parse_stats:
+        prefiltered = parse_stats.get("prefiltered", 0)
+        total += prefiltered
+        non_pgx_count += prefiltered
+
     return {
-        "total_variants_scanned": len(variants),
+        "total_variants_scanned": total,
         "recognized_pgx_variants": recognized,
         "non_pgx_variants_count": non_pgx_count
     }
 
 def map_rsids_to_effects(variants):
 
+    variant_database = get_kb().variants
     mapped_variants = []
 
     for variant in variants:
@@ -95,19 +151,22 @@ def map_rsids_to_effects(variants):
         genotype = variant["genotype"]
 
         # Only include if mutation actually present
-        if rsid in VARIANT_DATABASE and genotype in ["0/1", "1/1"]:
-
-            variant_info = VARIANT_DATABASE[rsid]
-
-            mapped_variants.append({
-                "rsid": rsid,
-                "gene": variant_info["gene"],
-                "allele": variant_info["allele"],
-                "effect": variant_info["effect"],
-                "genotype": genotype,
-                "dp": variant.get("dp"),
-                "gq": variant.get("gq"),
-                "filter": variant.get("filter")
-            })
+        if rsid in variant_database and genotype in ["0/1", "1/1"]:
+
+            variant_info = variant_database[rsid]
+
+            mapped_variants.append(PgxVariant(
+                rsid,
+                variant_info["gene"],
+                variant_info["allele"],
+                variant_info["effect"],
+                genotype,
+                variant.get("dp"),
+                variant.get("gq"),
+                variant.get("filter"),
+                variant.get("chrom"),
+                variant.get("pos"),
+                variant.get("gt")
+            ))
 
     return mapped_variants
\ No newline at end of file
@@ -0,0 +1,499 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from io import BytesIO
+
+import bgzf
+
+# Tabix (.tbi) and CSI (.csi) index support for bgzipped VCFs.
+# Only the BGZF blocks overlapping the requested regions are decompressed.
+
+TBI_MAGIC = b"TBI\x01"
+CSI_MAGIC = b"CSI\x01"
+
+# Binning scheme used by .tbi (CSI stores its own)
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+# tabix header preset for VCF: format, col_seq, col_beg, col_end, meta, skip
+TBX_VCF = (2, 1, 2, 0, ord("#"), 0)
+
+INDEX_CACHE_DIR = os.getenv(
+    "VCF_INDEX_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "pharmaguard-vcf-index")
+)
+
+logger = logging.getLogger("pharmaguard")
+
+_cache_checked = False
+_cache_lock = threading.Lock()
+
+
+def reg2bin(beg, end, min_shift=TBI_MIN_SHIFT, depth=TBI_DEPTH):
+    end -= 1
+    s = min_shift
+    t = ((1 << depth * 3) - 1) // 7
+
+    for level in range(depth, 0, -1):
+        if beg >> s == end >> s:
+            return t + (beg >> s)
+        s += 3
+        t -= 1 << (level - 1) * 3
+
+    return 0
+
+
+def reg2bins(beg, end, min_shift=TBI_MIN_SHIFT, depth=TBI_DEPTH):
+    """
+    All bins that may hold records overlapping [beg, end) (0-based).
+    """
+
+    bins = []
+    end -= 1
+    s = min_shift + depth * 3
+    t = 0
+
+    for level in range(depth + 1):
+        bins.extend(range(t + (beg >> s), t + (end >> s) + 1))
+        s -= 3
+        t += 1 << level * 3
+
+    return bins
+
+
+class VcfIndex:
+    """
+    In-memory form of a tabix/CSI index: per-sequence bins of
+    (start, end) virtual-offset chunks plus a tabix linear index.
+    """
+
+    def __init__(self, names, min_shift=TBI_MIN_SHIFT, depth=TBI_DEPTH):
+        self.names = list(names)
+        self.tids = {name: tid for tid, name in enumerate(self.names)}
+        self.min_shift = min_shift
+        self.depth = depth
+        self.bins = [{} for _ in self.names]
+        self.linear = [[] for _ in self.names]
+
+    def resolve(self, chrom):
+        # Regions are written without a "chr" prefix; indexes may use either
+        for name in (chrom, "chr" + chrom, chrom[3:] if chrom.startswith("chr") else None):
+            if name in self.tids:
+                return self.tids[name]
+        return None
+
+    def chunks(self, chrom, beg, end):
+        tid = self.resolve(chrom)
+        if tid is None:
+            return []
+
+        max_bin = ((1 << (self.depth + 1) * 3) - 1) // 7
+        bins = self.bins[tid]
+
+        # Chunks ending before the first record in these windows can be skipped
+        linear = self.linear[tid]
+        windows = linear[beg >> self.min_shift:((end - 1) >> self.min_shift) + 1]
+        offsets = [offset for offset in windows if offset]
+        min_offset = min(offsets) if offsets else 0
+
+        found = []
+        for bin_id in reg2bins(beg, end, self.min_shift, self.depth):
+            if bin_id >= max_bin:
+                continue
+            for chunk_beg, chunk_end in bins.get(bin_id, ()):
+                if chunk_end > min_offset:
+                    found.append((chunk_beg, chunk_end))
+
+        return found
+
+    def to_tbi(self):
+        """
+        Serialize as a BGZF-compressed .tbi file.
+        """
+
+        names = b"".join(name.encode("utf-8") + b"\x00" for name in self.names)
+
+        out = BytesIO()
+        out.write(TBI_MAGIC)
+        out.write(struct.pack("<i", len(self.names)))
+        out.write(struct.pack("<6i", *TBX_VCF))
+        out.write(struct.pack("<i", len(names)))
+        out.write(names)
+
+        for tid in range(len(self.names)):
+            bins = self.bins[tid]
+            out.write(struct.pack("<i", len(bins)))
+            for bin_id in sorted(bins):
+                chunks = bins[bin_id]
+                out.write(struct.pack("<Ii", bin_id, len(chunks)))
+                for chunk_beg, chunk_end in chunks:
+                    out.write(struct.pack("<QQ", chunk_beg, chunk_end))
+
+            linear = self.linear[tid]
+            out.write(struct.pack("<i", len(linear)))
+            out.write(struct.pack(f"<{len(linear)}Q", *linear))
+
+        compressed = BytesIO()
+        bgzf.write_bgzf(out.getvalue(), compressed)
+        return compressed.getvalue()
+
+
+class _Reader:
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.offset)
+        self.offset += struct.calcsize(fmt)
+        return values
+
+    def take(self, size):
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+
+def _parse_names(raw):
+    return [name.decode("utf-8") for name in raw.split(b"\x00") if name]
+
+
+def load_index(data):
+    """
+    Parse .tbi or .csi index bytes (BGZF-compressed or already inflated).
+    """
+
+    if bgzf.is_gzip(data):
+        data = b"".join(bgzf.iter_decompressed(BytesIO(data)))
+
+    reader = _Reader(data)
+    magic = reader.take(4)
+
+    if magic == TBI_MAGIC:
+        n_ref, = reader.unpack("<i")
+        reader.unpack("<6i")
+        l_nm, = reader.unpack("<i")
+        index = VcfIndex(_parse_names(reader.take(l_nm)))
+
+        for tid in range(n_ref):
+            n_bin, = reader.unpack("<i")
+            for _ in range(n_bin):
+                bin_id, n_chunk = reader.unpack("<Ii")
+                index.bins[tid][bin_id] = [reader.unpack("<QQ") for _ in range(n_chunk)]
+            n_intv, = reader.unpack("<i")
+            index.linear[tid] = list(reader.unpack(f"<{n_intv}Q"))
+
+        return index
+
+    if magic == CSI_MAGIC:
+        min_shift, depth, l_aux = reader.unpack("<3i")
+        aux = _Reader(reader.take(l_aux))
+
+        # Sequence names live in a tabix-style aux header; without them
+        # (e.g. CSI built for BCF) regions can't be resolved by name
+        names = []
+        if l_aux >= 28:
+            aux.unpack("<6i")
+            l_nm, = aux.unpack("<i")
+            names = _parse_names(aux.take(l_nm))
+
+        n_ref, = reader.unpack("<i")
+        index = VcfIndex(names or [str(tid) for tid in range(n_ref)], min_shift, depth)
+
+        for tid in range(n_ref):
+            n_bin, = reader.unpack("<i")
+            for _ in range(n_bin):
+                bin_id, _loffset, n_chunk = reader.unpack("<IQi")
+                index.bins[tid][bin_id] = [reader.unpack("<QQ") for _ in range(n_chunk)]
+
+        return index
+
+    raise ValueError("Unrecognized VCF index format (expected .tbi or .csi)")
+
+
+class IndexBuilder:
+    """
+    Builds a tabix index from (line, start, end) virtual offsets while a
+    bgzipped VCF is streamed, so the first upload pays for indexing and
+    later uploads of the same file don't.
+    """
+
+    def __init__(self):
+        self.index = VcfIndex([])
+
+    def add(self, line, voff_beg, voff_end):
+        if not line or line[:1] == b"#":
+            return
+
+        columns = line.split(b"\t", 4)
+        if len(columns) < 5:
+            return
+
+        chrom = columns[0].decode("utf-8")
+        beg = int(columns[1]) - 1
+        end = beg + max(len(columns[3]), 1)
+
+        index = self.index
+        tid = index.tids.get(chrom)
+        if tid is None:
+            tid = len(index.names)
+            index.names.append(chrom)
+            index.tids[chrom] = tid
+            index.bins.append({})
+            index.linear.append([])
+
+        chunks = index.bins[tid].setdefault(reg2bin(beg, end), [])
+        if chunks and chunks[-1][1] == voff_beg:
+            chunks[-1] = (chunks[-1][0], voff_end)
+        else:
+            chunks.append((voff_beg, voff_end))
+
+        linear = index.linear[tid]
+        last_window = (end - 1) >> TBI_MIN_SHIFT
+        if len(linear) <= last_window:
+            linear.extend([0] * (last_window + 1 - len(linear)))
+        for window in range(beg >> TBI_MIN_SHIFT, last_window + 1):
+            if not linear[window] or voff_beg < linear[window]:
+                linear[window] = voff_beg
+
+
+def iter_lines_building_index(stream, builder):
+    """
+    Yield text lines from a BGZF stream while recording each line's
+    virtual offsets into the builder.
+    """
+
+    carry = b""
+    carry_voff = 0
+
+    for coffset, data in bgzf.iter_decompressed(stream, with_offsets=True):
+        start = 0
+        while True:
+            newline = data.find(b"\n", start)
+            if newline < 0:
+                if start < len(data):
+                    if not carry:
+                        carry_voff = (coffset << 16) | start
+                    carry += data[start:]
+                break
+
+            voff_beg = carry_voff if carry else (coffset << 16) | start
+            line = carry + data[start:newline]
+            carry = b""
+
+            builder.add(line, voff_beg, (coffset << 16) | (newline + 1))
+            yield line.rstrip(b"\r").decode("utf-8")
+            start = newline + 1
+
+    if carry:
+        yield carry.rstrip(b"\r").decode("utf-8")
+
+
+def read_header(stream):
+    """
+    Header lines of a BGZF-compressed VCF, decoding only the blocks they
+    span. The stream is rewound afterwards.
+    """
+
+    lines = []
+    carry = b""
+    stream.seek(0)
+
+    while True:
+        block = bgzf.read_block(stream)
+        if not block:
+            break
+
+        parts = (carry + bgzf.decompress_block(block)).split(b"\n")
+        carry = parts.pop()
+
+        for raw in parts:
+            if not raw.startswith(b"#"):
+                stream.seek(0)
+                return lines
+            lines.append(raw.rstrip(b"\r").decode("utf-8"))
+
+    stream.seek(0)
+    return lines
+
+
+def _merge_chunks(chunks):
+    merged = []
+
+    for chunk_beg, chunk_end in sorted(chunks):
+        if merged and chunk_beg <= merged[-1][1]:
+            if chunk_end > merged[-1][1]:
+                merged[-1][1] = chunk_end
+        else:
+            merged.append([chunk_beg, chunk_end])
+
+    return merged
+
+
+def _read_chunk(stream, chunk_beg, chunk_end):
+    coffset, uoffset = chunk_beg >> 16, chunk_beg & 0xffff
+    end_coffset, end_uoffset = chunk_end >> 16, chunk_end & 0xffff
+
+    stream.seek(coffset)
+    parts = []
+
+    while coffset <= end_coffset:
+        block = bgzf.read_block(stream)
+        if not block:
+            break
+
+        data = bgzf.decompress_block(block)
+        stop = end_uoffset if coffset == end_coffset else len(data)
+        parts.append(data[uoffset:stop])
+
+        coffset += len(block)
+        uoffset = 0
+
+    return b"".join(parts)
+
+
+def _strip_chr(chrom):
+    return chrom[3:] if chrom.startswith("chr") else chrom
+
+
+def region_filter(regions):
+    """
+    Build a predicate that keeps VCF data lines whose CHROM/POS fall in any
+    of the (chrom, start, end) regions (1-based, inclusive).
+    """
+
+    wanted = {}
+    for chrom, start, end in regions:
+        wanted.setdefault(_strip_chr(chrom), []).append((start, end))
+
+    def keep(line):
+        if not line or line.startswith("#"):
+            return False
+
+        columns = line.split("\t", 2)
+        if len(columns) < 3:
+            return False
+
+        spans = wanted.get(_strip_chr(columns[0]))
+        if not spans:
+            return False
+
+        pos = int(columns[1])
+        for start, end in spans:
+            if start <= pos <= end:
+                return True
+
+        return False
+
+    return keep
+
+
+def iter_region_lines(stream, index, regions):
+    """
+    Yield the VCF data lines overlapping the given regions by decoding
+    only the BGZF blocks that the index points at.
+    """
+
+    chunks = []
+    for chrom, start, end in regions:
+        chunks.extend(index.chunks(_strip_chr(chrom), start - 1, end))
+
+    keep = region_filter(regions)
+
+    for chunk_beg, chunk_end in _merge_chunks(chunks):
+        for raw in _read_chunk(stream, chunk_beg, chunk_end).split(b"\n"):
+            line = raw.rstrip(b"\r").decode("utf-8")
+            if keep(line):
+                yield line
+
+
+def file_digest(stream):
+    """
+    Content hash of a seekable upload, used to key cached indexes.
+    The stream is rewound afterwards.
+    """
+
+    digest = hashlib.sha256()
+    stream.seek(0)
+
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        digest.update(chunk)
+
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def _cache_ready():
+    # As upload_cache: the directory is created private to this user, and
+    # one that others can write is not used (its indexes would be trusted)
+    global INDEX_CACHE_DIR, _cache_checked
+
+    with _cache_lock:
+        if not INDEX_CACHE_DIR or _cache_checked:
+            return bool(INDEX_CACHE_DIR)
+
+        try:
+            os.makedirs(INDEX_CACHE_DIR, mode=0o700, exist_ok=True)
+            info = os.stat(INDEX_CACHE_DIR)
+            if info.st_uid != os.getuid():
+                raise PermissionError(f"{INDEX_CACHE_DIR} is owned by another user")
+            if info.st_mode & 0o077:
+                os.chmod(INDEX_CACHE_DIR, 0o700)
+        except OSError as e:
+            logger.warning("VCF index cache disabled: %s", e)
+            INDEX_CACHE_DIR = ""
+
+        _cache_checked = True
+        return bool(INDEX_CACHE_DIR)
+
+
+def _cache_path(digest):
+    return os.path.join(INDEX_CACHE_DIR, f"{digest}.tbi")
+
+
+def load_cached_index(digest):
+    if not _cache_ready():
+        return None
+
+    try:
+        with open(_cache_path(digest), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    try:
+        return load_index(data)
+    except (ValueError, struct.error, EOFError, zlib.error):
+        # A damaged entry is a miss: drop it so the index is rebuilt
+        try:
+            os.unlink(_cache_path(digest))
+        except OSError:
+            pass
+        return None
+
+
+def save_cached_index(digest, index):
+    if not _cache_ready():
+        return
+
+    try:
+        # A private temp name, so concurrent writers never share a file
+        fd, tmp_path = tempfile.mkstemp(dir=INDEX_CACHE_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(index.to_tbi())
+            os.replace(tmp_path, _cache_path(digest))
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        # Caching is an optimization; a read-only disk shouldn't fail the request
+        pass
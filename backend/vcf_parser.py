@@ -1,59 +1,292 @@
-def extract_variants(file):
+import codecs
+import re
+from itertools import chain
 
-    variants = []
-    has_header = False
-    header_line = None
-    
-    contents = file.file.read().decode("utf-8").splitlines()
+import bgzf
+import vcf_index
+from records import VariantCall
 
-    for line in contents:
-        if line.startswith("##fileformat=VCF"):
-            has_header = True
-            continue
-        
-        if line.startswith("#CHROM"):
-            header_line = line
+# Uploads are read in bounded chunks so peak memory stays flat regardless
+# of VCF size (whole-genome files can be several GB).
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_chunks(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield raw VCF bytes from an upload in bounded chunks.
+    gzip and BGZF (.vcf.gz) input is detected from its magic bytes and
+    decompressed on the fly.
+    """
+
+    stream = getattr(file, "file", file)
+    head = stream.read(max(chunk_size, bgzf.BGZF_HEADER_SIZE))
+
+    if bgzf.is_bgzf(head):
+        yield from bgzf.iter_decompressed(bgzf.PrefixedStream(head, stream))
+        return
+
+    if bgzf.is_gzip(head):
+        yield from bgzf.iter_gunzip(bgzf.PrefixedStream(head, stream), chunk_size)
+        return
+
+    while head:
+        yield head
+        head = stream.read(chunk_size)
+
+
+def iter_lines(file, chunk_size=CHUNK_SIZE):
+    """
+    Yield text lines from an uploaded file without reading it all at once.
+    Bytes are decoded incrementally, so multi-byte characters split across
+    chunk boundaries are handled correctly.
+    """
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+
+    for chunk in iter_chunks(file, chunk_size):
+        text = pending + decoder.decode(chunk)
+
+        # Hold back the trailing partial line until the next chunk arrives
+        cut = max(text.rfind("\n"), text.rfind("\r"))
+        if cut < 0:
+            pending = text
             continue
 
+        pending = text[cut + 1:]
+        yield from text[:cut + 1].splitlines()
+
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield from pending.splitlines()
+
+
+_UNPHASED_ORDER = {"1/0": "0/1"}
+
+_GT_SPLIT = re.compile(r"([/|])")
+
+# Header values naming the reference assembly
+_BUILD_NAMES = (
+    ("GRCh38", ("grch38", "hg38", "hs38")),
+    ("GRCh37", ("grch37", "hg19", "b37", "hs37d5", "g1k_v37")),
+)
+_CONTIG_LENGTHS = {"248956422": "GRCh38", "249250621": "GRCh37"}  # chromosome 1
+_CONTIG_1 = re.compile(r"ID=(?:chr)?1,.*?length=(\d+)|length=(\d+),.*?ID=(?:chr)?1[,>]")
+
+
+def detect_build(line):
+    """
+    Genome build ("GRCh37"/"GRCh38") named by a ##reference, ##assembly or
+    ##contig header line, or None.
+    """
+
+    if line.startswith(("##reference", "##assembly")) or (line.startswith("##contig") and "assembly=" in line):
+        lowered = line.lower()
+        for build, names in _BUILD_NAMES:
+            if any(name in lowered for name in names):
+                return build
+
+    if line.startswith("##contig"):
+        found = _CONTIG_1.search(line)
+        if found:
+            return _CONTIG_LENGTHS.get(found.group(1) or found.group(2))
+
+    return None
+
+
+def _recode_gt(gt, allele):
+    # Copies of one ALT allele of a multi-allelic row, written as a
+    # biallelic GT: that allele is 1, every other allele 0
+    return "".join(
+        part if part in ("/", "|", ".") else ("1" if part == allele else "0")
+        for part in _GT_SPLIT.split(gt)
+    )
+
+
+def parse_line(line, positions=None):
+    """
+    Parse a single VCF data line into a VariantCall record.
+    Returns None for headers, malformed lines and non-rsID records.
+
+    With a position index (the build's PositionIndex), lines without an
+    rsID (e.g. "." in the ID column) are annotated by CHROM/POS/REF/ALT.
+    On multi-allelic rows the genotype counts only the annotated ALT.
+    """
+
+    if line.startswith("#"):
+        return None
+
+    columns = line.split("\t")
+
+    if len(columns) < 10:
+        return None
+
+    rsid = columns[2]
+    ref = columns[3]
+    alt = columns[4]
+    qual = columns[5]
+    filter_status = columns[6]
+    format_field = columns[8]
+    sample_field = columns[9]
+
+    format_keys = format_field.split(":")
+    sample_values = sample_field.split(":")
+
+    format_dict = dict(zip(format_keys, sample_values))
+
+    genotype = format_dict.get("GT")
+    dp = int(format_dict.get("DP", 0)) if format_dict.get("DP") else 0
+    gq = int(format_dict.get("GQ", 0)) if format_dict.get("GQ") else 0
+
+    pos = int(columns[1]) if columns[1].isdigit() else None
+
+    # An explicit rsID wins; coordinates only fill in a missing one, and
+    # say which ALT of a multi-allelic row is the annotated allele
+    allele = None
+    if positions is not None and pos is not None and (not rsid.startswith("rs") or "," in alt):
+        found = positions.match(columns[0], pos, ref, alt)
+        if found is not None and (found[0] == rsid or not rsid.startswith("rs")):
+            rsid, allele = found
+
+    if not rsid.startswith("rs") or genotype is None:
+        return None
+
+    if allele is not None and "," in alt:
+        genotype = _recode_gt(genotype, str(allele))
+
+    # Phase is kept in the raw GT; genotype is the unphased, ordered form
+    unphased = genotype.replace("|", "/")
+
+    return VariantCall(
+        rsid,
+        _UNPHASED_ORDER.get(unphased, unphased),
+        ref,
+        alt,
+        float(qual) if qual != "." else 0,
+        filter_status,
+        dp,
+        gq,
+        columns[0],
+        pos,
+        genotype
+    )
+
+
+def parse_lines(lines, rsids=None, stats=None, positions=None):
+    """
+    Parse an iterable of VCF lines, yielding VariantCall records.
+
+    With an rsid set, lines are prefiltered on the ID column using a bounded
+    split, and only matching lines are fully decoded. Every data line that
+    yields no variant (prefiltered, or decoded and dropped) is counted in
+    stats["prefiltered"], so scanned totals include all data rows.
+    With position indexes (variant_mapper.pgx_positions), lines without an
+    rsID also pass the prefilter when they sit at an indexed CHROM/POS of
+    the build named in the header (or the default build).
+    """
+
+    index = positions.for_build() if positions is not None else None
+
+    if stats is None:
+        stats = {}
+    stats.setdefault("prefiltered", 0)
+
+    for line in lines:
         if line.startswith("#"):
+            if index is not None and line.startswith("##"):
+                build = detect_build(line)
+                if build is not None:
+                    index = positions.for_build(build)
             continue
 
-        columns = line.split("\t")
+        if rsids is not None:
+            columns = line.split("\t", 3)
+            if len(columns) < 4:
+                continue
 
-        if len(columns) < 10:
-            continue
+            rsid = columns[2]
+            if rsid not in rsids and not (
+                index is not None
+                and not rsid.startswith("rs")
+                and columns[1].isdigit()
+                and index.has_position(columns[0], int(columns[1]))
+            ):
+                if line.count("\t") >= 9:
+                    stats["prefiltered"] += 1
+                continue
+
+        variant = parse_line(line, index)
+        if variant is not None:
+            yield variant
+        elif line.count("\t") >= 9:
+            stats["prefiltered"] += 1
+
+
+def iter_variants(file, chunk_size=CHUNK_SIZE, rsids=None, stats=None, positions=None):
+    """
+    Stream parsed variants one at a time.
+    Consumers can start classifying before the upload has been fully read.
+    """
+
+    yield from parse_lines(iter_lines(file, chunk_size), rsids, stats, positions)
+
+
+def extract_variants(file):
+    return list(iter_variants(file))
+
+
+def iter_indexed_variants(file, regions, index_file=None, rsids=None, stats=None, positions=None, digest=None):
+    """
+    Stream only the variants overlapping the given (chrom, start, end)
+    regions from a bgzipped VCF, decoding just the indexed BGZF blocks.
+
+    The index comes from the uploaded .tbi/.csi, or from the cache of an
+    earlier upload of the same file. On a cache miss the file is read once
+    in full and its index is built and cached along the way. Pass the
+    file's content hash as digest if the caller already computed it.
+    Plain-text and non-blocked gzip uploads fall back to a full parse.
+
+    For indexed reads, stats["scope"] is set to "pharmacogene_regions"
+    (only rows inside the regions are scanned and counted) and
+    stats["indexed_sequences"] to the number of sequences with data rows.
+    """
+
+    stream = getattr(file, "file", file)
+    head = stream.read(bgzf.BGZF_HEADER_SIZE)
+    stream.seek(0)
+
+    if not bgzf.is_bgzf(head):
+        yield from iter_variants(file, rsids=rsids, stats=stats, positions=positions)
+        return
+
+    # Region reads never reach the end of the file, so a cut-off upload is
+    # caught up front rather than read as one with fewer variants
+    bgzf.check_eof(stream)
+
+    if stats is None:
+        stats = {}
+    stats["scope"] = "pharmacogene_regions"
+
+    if index_file is not None:
+        index = vcf_index.load_index(getattr(index_file, "file", index_file).read())
+    else:
+        if digest is None:
+            digest = vcf_index.file_digest(stream)
+        index = vcf_index.load_cached_index(digest)
+
+        if index is None:
+            builder = vcf_index.IndexBuilder()
+            keep = vcf_index.region_filter(regions)
+
+            # Header lines too: they name the genome build
+            lines = vcf_index.iter_lines_building_index(stream, builder)
+            lines = (line for line in lines if line.startswith("#") or keep(line))
+            yield from parse_lines(lines, rsids, stats, positions)
+
+            stats["indexed_sequences"] = len(builder.index.names)
+            vcf_index.save_cached_index(digest, builder.index)
+            return
 
-        chrom = columns[0]
-        pos = columns[1]
-        rsid = columns[2]
-        ref = columns[3]
-        alt = columns[4]
-        qual = columns[5]
-        filter_status = columns[6]
-        info = columns[7]
-        format_field = columns[8]
-        sample_field = columns[9]
-
-        format_keys = format_field.split(":")
-        sample_values = sample_field.split(":")
-
-        format_dict = dict(zip(format_keys, sample_values))
-
-        genotype = format_dict.get("GT")
-        dp = int(format_dict.get("DP", 0)) if format_dict.get("DP") else 0
-        gq = int(format_dict.get("GQ", 0)) if format_dict.get("GQ") else 0
-
-        if rsid.startswith("rs") and genotype is not None:
-
-            variants.append({
-                "rsid": rsid,
-                "genotype": genotype.replace("|", "/"),
-                "ref": ref,
-                "alt": alt,
-                "qual": float(qual) if qual != "." else 0,
-                "filter": filter_status,
-                "dp": dp,
-                "gq": gq
-            })
-
-    return variants
+    stats["indexed_sequences"] = len(index.names)
+    lines = chain(vcf_index.read_header(stream), vcf_index.iter_region_lines(stream, index, regions))
+    yield from parse_lines(lines, rsids, stats, positions)
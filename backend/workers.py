@@ -0,0 +1,227 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+import metrics
+
+# Runs the CPU-bound pipeline (pipeline.py) off the event loop.
+# Small uploads go to a thread pool and are read in place; larger ones are
+# spooled to a temp file and parsed in a process pool, so one big VCF never
+# stalls other requests and parsing can use every core. Admission control
+# caps how many analyses may be queued or running at once. Metrics recorded
+# in worker processes are sent back with each result and merged here.
+
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", os.cpu_count() or 1))
+ANALYSIS_THREADS = int(os.getenv("ANALYSIS_THREADS", 4))
+ANALYSIS_THREAD_MAX_BYTES = int(os.getenv("ANALYSIS_THREAD_MAX_BYTES", 1024 * 1024))
+ANALYSIS_MAX_PENDING = int(os.getenv("ANALYSIS_MAX_PENDING", max(ANALYSIS_WORKERS, ANALYSIS_THREADS) * 4))
+ANALYSIS_RETRY_AFTER_SECONDS = int(os.getenv("ANALYSIS_RETRY_AFTER_SECONDS", 5))
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+_process_pool = None
+_thread_pool = None
+_pending = 0
+
+
+class Overloaded(Exception):
+    """
+    Raised when the analysis queue is full; callers should answer 503.
+    """
+
+    def __init__(self, retry_after=ANALYSIS_RETRY_AFTER_SECONDS):
+        super().__init__("Analysis queue is full, retry later")
+        self.retry_after = retry_after
+
+
+def _warm_worker():
+    # Each new worker builds its knowledge base tables before taking jobs
+    from pipeline import warm
+    warm()
+
+
+def _get_process_pool():
+    global _process_pool
+
+    # A single worker gains nothing over the thread pool
+    if ANALYSIS_WORKERS <= 1:
+        return None
+
+    # Spawned rather than forked: the server process has live threads
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=ANALYSIS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_worker
+        )
+
+    return _process_pool
+
+
+def _get_thread_pool():
+    global _thread_pool
+
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(
+            max_workers=ANALYSIS_THREADS,
+            thread_name_prefix="analysis"
+        )
+
+    return _thread_pool
+
+
+def pending():
+    return _pending
+
+
+def shutdown():
+    global _process_pool, _thread_pool
+
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+    if _thread_pool is not None:
+        _thread_pool.shutdown(cancel_futures=True)
+        _thread_pool = None
+
+
+def _upload_size(upload):
+    size = getattr(upload, "size", None)
+    if size is not None:
+        return size
+
+    stream = getattr(upload, "file", upload)
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def spool_upload(upload):
+    # Copy the upload to a named file a worker process can open
+    stream = getattr(upload, "file", upload)
+    stream.seek(0)
+
+    with tempfile.NamedTemporaryFile(prefix="pharmaguard-", suffix=".upload", delete=False) as out:
+        shutil.copyfileobj(stream, out, SPOOL_CHUNK_SIZE)
+
+    return out.name
+
+
+def discard(paths):
+    # Remove spooled files; ones a consumer already deleted are skipped
+    for path in paths:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def _rewind(upload):
+    if upload is not None:
+        getattr(upload, "file", upload).seek(0)
+    return upload
+
+
+def check_capacity():
+    if _pending >= ANALYSIS_MAX_PENDING:
+        raise Overloaded()
+
+
+def admit():
+    """
+    Reserve a slot for one analysis, or raise Overloaded if
+    ANALYSIS_MAX_PENDING are already queued or running.
+    """
+
+    global _pending
+
+    check_capacity()
+    _pending += 1
+
+
+def release():
+    global _pending
+    _pending -= 1
+
+
+async def run_in_thread(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_get_thread_pool(), partial(func, *args))
+
+
+async def _run_in_process(process_pool, func, *args, **kwargs):
+    result, events = await asyncio.get_running_loop().run_in_executor(
+        process_pool,
+        partial(metrics.call_captured, func, *args, **kwargs)
+    )
+    metrics.replay(events)
+    return result
+
+
+async def run_job(func, *args):
+    """
+    Run func(*args) over file paths in the process pool (thread pool when
+    there is a single worker). Counts toward the pending limit while it
+    runs but is never rejected; batch callers bound their own concurrency.
+    """
+
+    global _pending
+
+    _pending += 1
+    process_pool = _get_process_pool()
+
+    try:
+        if process_pool is not None:
+            return await _run_in_process(process_pool, func, *args)
+        return await asyncio.get_running_loop().run_in_executor(_get_thread_pool(), partial(func, *args))
+    finally:
+        _pending -= 1
+
+
+async def run_upload(func, upload, *args, index=None):
+    """
+    Run func(source, *args) on an uploaded file off the event loop, where
+    source is the upload itself (thread pool) or a spooled temp file path
+    (process pool). An optional index upload is passed as index_source.
+
+    Raises Overloaded when ANALYSIS_MAX_PENDING analyses are already
+    queued or running.
+    """
+
+    admit()
+    loop = asyncio.get_running_loop()
+    thread_pool = _get_thread_pool()
+    spooled = []
+
+    try:
+        kwargs = {}
+        process_pool = _get_process_pool()
+
+        if process_pool is not None and _upload_size(upload) > ANALYSIS_THREAD_MAX_BYTES:
+            start = time.perf_counter()
+            source = await loop.run_in_executor(thread_pool, spool_upload, upload)
+            spooled.append(source)
+
+            if index is not None:
+                kwargs["index_source"] = await loop.run_in_executor(thread_pool, spool_upload, index)
+                spooled.append(kwargs["index_source"])
+
+            metrics.observe_stage("upload_spool", time.perf_counter() - start)
+
+            return await _run_in_process(process_pool, func, source, *args, **kwargs)
+
+        if index is not None:
+            kwargs["index_source"] = _rewind(index)
+
+        return await loop.run_in_executor(thread_pool, partial(func, _rewind(upload), *args, **kwargs))
+
+    finally:
+        release()
+
+        discard(spooled)